@@ -2,16 +2,22 @@
 API for easily writing an ODC Dataset
 """
 
+import json
+import os
 import shutil
 import tempfile
+import threading
 import uuid
 import warnings
+from concurrent import futures
+from concurrent.futures import Future, ThreadPoolExecutor
 from copy import deepcopy
 from enum import Enum, auto
 from pathlib import Path, PosixPath, PurePath
 from textwrap import dedent
 from typing import (
     Any,
+    Callable,
     ClassVar,
     Dict,
     Generator,
@@ -303,10 +309,16 @@ class DatasetPrepare(Eo3Interface):
         #:
         #: Eg::
         #:
-        #:    p.valid_data_method = ValidDataMethod.filled
+        #:    p.valid_data_method = ValidDataMethod.overview
         #:
         self.valid_data_method: ValidDataMethod = ValidDataMethod.thorough
 
+        #: How much to reduce the resolution of the valid data mask,
+        #: when using :attr:`eodatasets3.ValidDataMethod.overview`
+        #:
+        #: Defaults to the first overview level.
+        self.valid_data_overview_factor: int = images.DEFAULT_OVERVIEWS[0]
+
         if not dataset:
             dataset = DatasetDoc()
         if not dataset.id:
@@ -715,6 +727,9 @@ class DatasetPrepare(Eo3Interface):
         grid: GridSpec = None,
         pixels: numpy.ndarray = None,
         nodata: Optional[Union[float, int]] = None,
+        layer: Optional[str] = None,
+        tiles: Optional[images.LazyTiles] = None,
+        on_tile: Optional[Callable[[images.TileWindow, numpy.ndarray], None]] = None,
     ):
         """
         Reference a measurement from its existing path. It may be a Path or any URL
@@ -732,9 +747,21 @@ class DatasetPrepare(Eo3Interface):
         :param expand_valid_data: Expand the valid data bounds with this measurement's valid data.
         :param relative_to_dataset_location: Should this be read relative to the dataset location?
                     (requires a computed dataset location)
+        :param layer: The measurement's layer within the file, for files holding many, such
+                      as a hdf5 dataset path. (The path isn't opened: give the grid yourself)
+        :param tiles: Or, rather than the whole array of pixels, the ``(window, block)`` tiles
+                      of the measurement, so it's never held in memory at once.
+                      (see :meth:`DatasetAssembler.write_measurement_tiles`)
+        :param on_tile: Called with each tile as it's read.
         """
         _validate_property_name(name)
 
+        if (layer is not None or tiles is not None) and not grid:
+            raise ValueError(
+                f"A grid must be given for measurement {name!r}, "
+                f"as its pixels aren't read from the path"
+            )
+
         # If we have a polygon already, there's no need to compute valid data.
         if self.geometry:
             expand_valid_data = False
@@ -750,7 +777,7 @@ class DatasetPrepare(Eo3Interface):
                 grid = images.GridSpec.from_rio(ds)
                 nodata = ds.nodata
                 if expand_valid_data:
-                    if not pixels:
+                    if pixels is None:
                         if ds.count != 1:
                             raise NotImplementedError(
                                 "TODO: Only single-band files currently supported"
@@ -762,9 +789,16 @@ class DatasetPrepare(Eo3Interface):
             grid,
             path,
             pixels,
+            layer=layer,
             nodata=nodata,
             expand_valid_data=expand_valid_data,
         )
+        if tiles is not None and (expand_valid_data or on_tile is not None):
+            for window, block in tiles:
+                if expand_valid_data:
+                    self._measurements.expand_window(grid, window, block, nodata)
+                if on_tile is not None:
+                    on_tile(window, block)
 
     def _target_metadata_path(self) -> Path:
         return self.names.resolve_path(self.names.metadata_file)
@@ -867,7 +901,8 @@ class DatasetPrepare(Eo3Interface):
         crs, grid_docs, measurement_docs = self._measurements.as_geo_docs()
 
         valid_data = self.geometry or self._measurements.consume_and_get_valid_data(
-            valid_data_method=self.valid_data_method
+            valid_data_method=self.valid_data_method,
+            overview_factor=self.valid_data_overview_factor,
         )
 
         # Avoid the messiness of different empty collection types.
@@ -1092,6 +1127,85 @@ def relative_url(base: str, offset: str, allow_absolute=False):
         return offset
 
 
+class _WorkManifest:
+    """
+    A record of the measurements finished in a resumable work directory.
+
+    Each is appended as a line of json as soon as it's finished, so that a package that
+    dies part-way through can reuse them when it's run again.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        # Finished measurements by their path within the work directory.
+        self._finished: Dict[str, Dict] = {}
+        # Those that were written or reused this time.
+        self._claimed: Set[str] = set()
+
+        if path.exists():
+            with path.open("r") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A partially-written line, from dying mid-write.
+                        continue
+                    self._finished[entry["path"]] = entry
+
+    def _key(self, file_path: Path) -> str:
+        return file_path.relative_to(self.path.parent).as_posix()
+
+    def get(self, file_path: Path) -> Optional[Dict]:
+        """Get the record of a finished measurement, if it was finished in a previous run"""
+        with self._lock:
+            key = self._key(file_path)
+            self._claimed.add(key)
+            return self._finished.get(key)
+
+    def add(self, file_path: Path, entry: Dict):
+        """Record a finished measurement."""
+        with self._lock:
+            key = self._key(file_path)
+            entry = dict(path=key, **entry)
+            self._finished[key] = entry
+            self._claimed.add(key)
+            with self.path.open("a") as f:
+                f.write(json.dumps(entry) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def remove_unfinished(self):
+        """
+        Remove everything a previous run left in the work directory, other than its
+        finished measurements.
+
+        (Such as staging folders, or files it was part-way through writing when it died)
+        """
+        self._remove_unfinished(self.path.parent)
+
+    def _remove_unfinished(self, directory: Path):
+        for path in directory.iterdir():
+            if path == self.path:
+                continue
+            if path.is_dir() and not path.is_symlink():
+                if path.name.startswith("."):
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    self._remove_unfinished(path)
+            elif self._key(path) not in self._finished:
+                path.unlink()
+
+    def finish(self):
+        """
+        Remove the manifest, and any measurements from previous runs that weren't
+        written this time.
+        """
+        for key in self._finished.keys() - self._claimed:
+            (self.path.parent / key).unlink(missing_ok=True)
+        self.path.unlink(missing_ok=True)
+
+
 class DatasetAssembler(DatasetPrepare):
     """
     Assemble a package of a dataset, including metadata, writing COG images, thumbnails,
@@ -1113,6 +1227,10 @@ class DatasetAssembler(DatasetPrepare):
         naming_conventions: str = "default",
         names: Optional[NamingConventions] = None,
         dataset: Optional[DatasetDoc] = None,
+        stage_in_memory: bool = False,
+        max_workers: Optional[int] = None,
+        num_threads: Optional[int] = None,
+        resumable: bool = False,
     ) -> None:
         """
         Assemble a dataset with ODC metadata, writing metadata and (optionally) its imagery as COGs.
@@ -1156,8 +1274,54 @@ class DatasetAssembler(DatasetPrepare):
         :param naming_conventions:
             Naming conventions to use. Supports `default` or `dea`. The latter has stricter metadata requirements
             (try it and see -- it will tell your what's missing).
+        :param stage_in_memory:
+            Build each measurement image and its overviews in memory before writing it as a COG,
+            rather than in a temporary file. Each image is then only written to disk once, at the
+            cost of holding a (compressed) copy of it in memory. (default: False)
+        :param max_workers:
+            Write measurements in a pool of this many threads, rather than one at a time.
+
+            The ``write_measurement*()`` methods will then return as soon as the write is queued.
+            Arrays given to them must not be modified until the write has finished (see the
+            returned futures, or :meth:`.wait_for_writes`).
+        :param num_threads:
+            How many CPU threads GDAL may use for this package, shared between its
+            ``max_workers`` concurrent writes. Give this if other packages are running
+            alongside it, such as in other processes. (default: all available CPUs if
+            there are ``max_workers``, otherwise GDAL's default of a single thread)
+        :param resumable:
+            Allow a package that failed part-way through to be resumed. (default: False)
+
+            The work directory is named after the ``dataset_id`` (which must be given), and is
+            kept if the package isn't finished. It records each measurement as it's finished,
+            so that when the package is run again, finished measurements are verified
+            against their checksums and reused rather than written again. Their valid data is
+            read back from the written image.
         """
+        if resumable and dataset_id is None:
+            raise ValueError(
+                "A resumable package needs a stable dataset_id, so that its work directory "
+                "can be found again."
+            )
         self._exists_behaviour = if_exists
+        self._stage_in_memory = stage_in_memory
+        self._resumable = resumable
+        self._manifest: Optional[_WorkManifest] = None
+
+        self._write_pool: Optional[ThreadPoolExecutor] = None
+        if max_workers:
+            self._write_pool = ThreadPoolExecutor(
+                max_workers=max_workers, thread_name_prefix="odc-write"
+            )
+        self._pending_writes: List[Future] = []
+        self._write_lock = threading.Lock()
+        # Share the CPUs between our concurrent writes. (Single-threaded otherwise, as
+        # callers may already be running an assembler per CPU)
+        self._default_num_threads: Optional[int] = None
+        if num_threads or max_workers:
+            self._default_num_threads = max(
+                (num_threads or images.available_cpu_count()) // (max_workers or 1), 1
+            )
         self._checksum = PackageChecksum()
         self._tmp_work_path: Optional[Path] = None
 
@@ -1192,14 +1356,29 @@ class DatasetAssembler(DatasetPrepare):
         writer only.
         """
         if not self._tmp_work_path:
-            self._tmp_work_path = Path(
-                tempfile.mkdtemp(
-                    prefix=".odcdataset-", dir=self._target_collection_path()
+            if self._resumable:
+                self._tmp_work_path = self._open_resumable_work_path()
+            else:
+                self._tmp_work_path = Path(
+                    tempfile.mkdtemp(
+                        prefix=".odcdataset-", dir=self._target_collection_path()
+                    )
                 )
-            )
 
         return self._tmp_work_path
 
+    def _open_resumable_work_path(self) -> Path:
+        """
+        Create a work directory named after the dataset, or reuse the one from a previous run.
+        """
+        work_path = self._target_collection_path() / f".odcdataset-{self.dataset_id}"
+        work_path.mkdir(mode=0o700, exist_ok=True)
+
+        self._manifest = _WorkManifest(work_path / ".odcdataset-manifest.jsonl")
+        # Anything that was part-way through being written when it died.
+        self._manifest.remove_unfinished()
+        return work_path
+
     def __enter__(self) -> "DatasetAssembler":
         return self
 
@@ -1225,7 +1404,15 @@ class DatasetAssembler(DatasetPrepare):
                 "Either call `done()` or `cancel() before closing`"
             )
 
+        if self._write_pool is not None:
+            for future in self._pending_writes:
+                future.cancel()
+            self._write_pool.shutdown(wait=True)
+
         if self._tmp_work_path:
+            if self._resumable and not self._is_completed:
+                # Keep the finished measurements for the next run.
+                return
             # TODO: add implicit cleanup like tempfile.TemporaryDirectory?
             shutil.rmtree(self._tmp_work_path, ignore_errors=True)
 
@@ -1239,7 +1426,9 @@ class DatasetAssembler(DatasetPrepare):
         expand_valid_data: bool = True,
         file_id: str = None,
         path: Path = None,
-    ):
+        max_window_bytes: Optional[int] = None,
+        num_threads: Optional[int] = None,
+    ) -> Future:
         """
         Write a measurement by copying it from a file path.
 
@@ -1255,9 +1444,18 @@ class DatasetAssembler(DatasetPrepare):
                         (DEA has measurements called ``blue``, but their written filenames must be ``band04`` by
                         convention.)
         :param path: Optional path to the image to write. Can be relative to the dataset.
+        :param max_window_bytes: Copy the image one window at a time, with each window using
+                                 at most this much memory, rather than reading it all at once.
+                                 (eg. :attr:`eodatasets3.images.DEFAULT_WINDOW_BYTES`)
+        :param num_threads: How many threads GDAL should use to compress the image and its overviews.
+                            Defaults to the assembler's ``num_threads``, shared between its
+                            ``max_workers`` (or a single thread if neither was given).
+
+        :returns: A future for the write. It will already be done, unless the assembler
+                  has a worker pool (see ``max_workers``).
         """
         with rasterio.open(input_path) as ds:
-            self.write_measurement_rio(
+            return self.write_measurement_rio(
                 name,
                 ds,
                 index=index,
@@ -1266,6 +1464,8 @@ class DatasetAssembler(DatasetPrepare):
                 overview_resampling=overview_resampling,
                 file_id=file_id,
                 path=path,
+                max_window_bytes=max_window_bytes,
+                num_threads=num_threads,
             )
 
     def write_measurement_rio(
@@ -1278,7 +1478,9 @@ class DatasetAssembler(DatasetPrepare):
         expand_valid_data=True,
         file_id=None,
         path: Path = None,
-    ):
+        max_window_bytes: Optional[int] = None,
+        num_threads: Optional[int] = None,
+    ) -> Future:
         """
         Write a measurement by reading it from an open rasterio dataset
 
@@ -1291,19 +1493,41 @@ class DatasetAssembler(DatasetPrepare):
             raise ValueError(
                 f"Image has {len(ds.indexes)} indexes to choose from, but index wasn't specified."
             )
-
-        self._write_measurement(
-            name,
-            ds.read(index or 1),
-            images.GridSpec.from_rio(ds),
-            self._work_path
-            / (path or self.names.measurement_filename(name, "tif", file_id=file_id)),
-            expand_valid_data=expand_valid_data,
-            nodata=ds.nodata,
-            overview_resampling=overview_resampling,
-            overviews=overviews,
+        index = index or 1
+        out_path = self._work_path / (
+            path or self.names.measurement_filename(name, "tif", file_id=file_id)
         )
 
+        if max_window_bytes:
+            future = self._write_measurement_tiles(
+                name,
+                images.iter_rio_tiles(ds, index, max_window_bytes=max_window_bytes),
+                ds.dtypes[index - 1],
+                images.GridSpec.from_rio(ds),
+                out_path,
+                expand_valid_data=expand_valid_data,
+                nodata=ds.nodata,
+                overview_resampling=overview_resampling,
+                overviews=overviews,
+                num_threads=num_threads,
+            )
+            # The dataset is only ours for the duration of this call, so it must be
+            # finished with before we return.
+            future.result()
+            return future
+        else:
+            return self._write_measurement(
+                name,
+                ds.read(index),
+                images.GridSpec.from_rio(ds),
+                out_path,
+                expand_valid_data=expand_valid_data,
+                nodata=ds.nodata,
+                overview_resampling=overview_resampling,
+                overviews=overviews,
+                num_threads=num_threads,
+            )
+
     def write_measurement_numpy(
         self,
         name: str,
@@ -1315,7 +1539,8 @@ class DatasetAssembler(DatasetPrepare):
         expand_valid_data=True,
         file_id: str = None,
         path: Path = None,
-    ):
+        num_threads: Optional[int] = None,
+    ) -> Future:
         """
         Write a measurement from a numpy array and grid spec.
 
@@ -1331,13 +1556,17 @@ class DatasetAssembler(DatasetPrepare):
                 nodata=-999,
             )
 
+        Chunked h5py datasets are written (and added to the valid data) a few chunks at
+        a time, rather than read all at once. They must remain readable until the write
+        has finished (see :meth:`wait_for_writes`).
+
         See :func:`write_measurement` for other parameters.
 
         :param array:
         :param grid_spec:
         :param nodata:
         """
-        self._write_measurement(
+        return self._write_measurement(
             name,
             array,
             grid_spec,
@@ -1347,6 +1576,52 @@ class DatasetAssembler(DatasetPrepare):
             nodata=nodata,
             overview_resampling=overview_resampling,
             overviews=overviews,
+            num_threads=num_threads,
+        )
+
+    def write_measurement_tiles(
+        self,
+        name: str,
+        tiles: images.LazyTiles,
+        dtype: numpy.dtype,
+        grid_spec: GridSpec,
+        nodata: Optional[Union[float, int]] = None,
+        overviews=images.DEFAULT_OVERVIEWS,
+        overview_resampling=Resampling.average,
+        expand_valid_data=True,
+        file_id: str = None,
+        path: Path = None,
+        num_threads: Optional[int] = None,
+        on_tile: Optional[Callable[[images.TileWindow, numpy.ndarray], None]] = None,
+    ) -> Future:
+        """
+        Write a measurement one window at a time, so the whole image is never in memory.
+
+        Each window is also added to the valid data as it's written.
+
+        :param tiles: The ``((ystart, yend), (xstart, xend))`` window of the grid and its pixels,
+                      for windows that cover the whole grid. They're read lazily as the image
+                      is written (such as from :func:`eodatasets3.images.iter_chunked_tiles`).
+        :param dtype: The data type of the image.
+        :param on_tile: Called with each window and its pixels as they are written, such as
+                        to accumulate a mask across bands. (Note that it's called from the
+                        worker pool, if there is one.)
+
+        See :func:`write_measurement_numpy` for other parameters.
+        """
+        return self._write_measurement_tiles(
+            name,
+            tiles,
+            dtype,
+            grid_spec,
+            self._work_path
+            / (path or self.names.measurement_filename(name, "tif", file_id=file_id)),
+            expand_valid_data=expand_valid_data,
+            nodata=nodata,
+            overview_resampling=overview_resampling,
+            overviews=overviews,
+            num_threads=num_threads,
+            on_tile=on_tile,
         )
 
     def write_measurements_odc_xarray(
@@ -1357,7 +1632,8 @@ class DatasetAssembler(DatasetPrepare):
         overview_resampling=Resampling.average,
         expand_valid_data=True,
         file_id=None,
-    ):
+        num_threads: Optional[int] = None,
+    ) -> List[Future]:
         """
         Write measurements from an ODC :class:`xarray.Dataset`
 
@@ -1372,8 +1648,11 @@ class DatasetAssembler(DatasetPrepare):
                 :meth:`datacube.Datacube.load` and other methods)
 
         See :meth:`write_measurement` for other parameters.
+
+        :returns: A future for each measurement's write.
         """
         grid_spec = images.GridSpec.from_odc_xarray(dataset)
+        written = []
         for name, dataarray in dataset.data_vars.items():
             name: str
 
@@ -1383,65 +1662,285 @@ class DatasetAssembler(DatasetPrepare):
                 dataarray.attrs.get("nodata", None) if nodata is None else nodata
             )
 
-            self._write_measurement(
+            written.append(
+                self._write_measurement(
+                    name,
+                    dataarray.data,
+                    grid_spec,
+                    (
+                        self._work_path
+                        / self.names.measurement_filename(name, "tif", file_id=file_id)
+                    ),
+                    expand_valid_data=expand_valid_data,
+                    overview_resampling=overview_resampling,
+                    overviews=overviews,
+                    nodata=nodata_value,
+                    num_threads=num_threads,
+                )
+            )
+        return written
+
+    def _write_measurement(
+        self,
+        name: str,
+        data: numpy.ndarray,
+        grid: GridSpec,
+        out_path: Path,
+        expand_valid_data: bool,
+        nodata: Optional[Union[float, int]],
+        overview_resampling: Resampling,
+        overviews: Tuple[int, ...],
+        num_threads: Optional[int] = None,
+    ) -> Future:
+        if images.is_chunked(data):
+            # Stream it, rather than reading the whole array at once.
+            return self._write_measurement_tiles(
                 name,
-                dataarray.data,
-                grid_spec,
-                (
-                    self._work_path
-                    / self.names.measurement_filename(name, "tif", file_id=file_id)
-                ),
+                images.iter_chunked_tiles(data),
+                data.dtype,
+                grid,
+                out_path,
                 expand_valid_data=expand_valid_data,
+                nodata=nodata,
                 overview_resampling=overview_resampling,
                 overviews=overviews,
-                nodata=nodata_value,
+                num_threads=num_threads,
             )
 
-    def _write_measurement(
+        self._record_measurement(name, grid, out_path)
+        written_as = self._written_as(
+            grid, data.dtype, nodata, overviews, overview_resampling, expand_valid_data
+        )
+
+        def write():
+            if self._reuse_finished_measurement(out_path, written_as, grid, nodata):
+                return
+            res = self._file_writer(grid, num_threads).write_from_ndarray(
+                data,
+                out_path,
+                geobox=grid,
+                nodata=nodata,
+                overview_resampling=overview_resampling,
+                overviews=overviews,
+            )
+            self._finish_measurement(res, out_path, written_as)
+            if expand_valid_data:
+                self._measurements.expand_window(grid, None, data, nodata)
+
+        return self._submit_write(write)
+
+    def _write_measurement_tiles(
         self,
         name: str,
-        data: numpy.ndarray,
+        tiles: images.LazyTiles,
+        dtype: numpy.dtype,
         grid: GridSpec,
         out_path: Path,
         expand_valid_data: bool,
         nodata: Optional[Union[float, int]],
         overview_resampling: Resampling,
         overviews: Tuple[int, ...],
-    ):
-        _validate_property_name(name)
+        num_threads: Optional[int] = None,
+        on_tile: Optional[Callable[[images.TileWindow, numpy.ndarray], None]] = None,
+    ) -> Future:
+        """Write a measurement one window at a time, expanding the valid data as we go."""
+        self._record_measurement(name, grid, out_path)
+
+        def expanding_valid_data(tiles: images.LazyTiles) -> images.LazyTiles:
+            for window, block in tiles:
+                self._measurements.expand_window(grid, window, block, nodata)
+                yield window, block
+
+        def reporting_tiles(tiles: images.LazyTiles) -> images.LazyTiles:
+            for window, block in tiles:
+                on_tile(window, block)
+                yield window, block
+
+        if expand_valid_data:
+            tiles = expanding_valid_data(tiles)
+        if on_tile is not None:
+            tiles = reporting_tiles(tiles)
+
+        written_as = self._written_as(
+            grid, dtype, nodata, overviews, overview_resampling, expand_valid_data
+        )
 
-        res = FileWrite.from_existing(grid.shape).write_from_ndarray(
-            data,
-            out_path,
-            geobox=grid,
-            nodata=nodata,
-            overview_resampling=overview_resampling,
-            overviews=overviews,
+        def write():
+            if self._reuse_finished_measurement(
+                out_path, written_as, grid, nodata, on_tile
+            ):
+                return
+            res = self._file_writer(grid, num_threads).write_from_tiles(
+                tiles,
+                out_path,
+                grid.shape,
+                dtype,
+                geobox=grid,
+                nodata=nodata,
+                overview_resampling=overview_resampling,
+                overviews=overviews,
+            )
+            self._finish_measurement(res, out_path, written_as)
+
+        return self._submit_write(write)
+
+    def _file_writer(self, grid: GridSpec, num_threads: Optional[int]) -> FileWrite:
+        return FileWrite.from_existing(
+            grid.shape,
+            stage_in_memory=self._stage_in_memory,
+            num_threads=num_threads or self._default_num_threads,
         )
 
-        # Ensure the file_format field is set to what we're writing.
-        file_format = res.file_format.name
-        if "odc:file_format" not in self.properties:
-            self.properties["odc:file_format"] = file_format
+    def _record_measurement(self, name: str, grid: GridSpec, out_path: Path):
+        _validate_property_name(name)
+        # Recorded immediately rather than when written, so that the order of measurements
+        # (and the naming of grids) doesn't depend on which write finishes first.
+        self._measurements.record_image(name, grid, out_path)
 
-        if file_format != self.properties["odc:file_format"]:
-            raise RuntimeError(
-                f"Inconsistent file formats between bands. "
-                f"Was {self.properties['odc:file_format']!r}, now {file_format !r}"
+    def _written_as(
+        self,
+        grid: GridSpec,
+        dtype: numpy.dtype,
+        nodata: Optional[Union[float, int]],
+        overviews: Optional[Tuple[int, ...]],
+        overview_resampling: Resampling,
+        expand_valid_data: bool,
+    ) -> Optional[Dict]:
+        """
+        How a measurement is written, to tell if a finished one can be reused when resuming.
+        """
+        if not self._resumable:
+            return None
+        # Normalised to what json reads back.
+        return json.loads(
+            json.dumps(
+                dict(
+                    shape=grid.shape,
+                    transform=grid.transform[:6],
+                    crs=grid.crs.to_wkt() if grid.crs else None,
+                    dtype=numpy.dtype(dtype).name,
+                    nodata=None if nodata is None else str(nodata),
+                    overviews=overviews and [int(o) for o in overviews],
+                    overview_resampling=overview_resampling.name,
+                    expand_valid_data=expand_valid_data,
+                )
             )
-
-        self._measurements.record_image(
-            name,
-            grid,
-            out_path,
-            data,
-            nodata=nodata,
-            expand_valid_data=expand_valid_data,
         )
+
+    def _reuse_finished_measurement(
+        self,
+        out_path: Path,
+        written_as: Optional[Dict],
+        grid: GridSpec,
+        nodata: Optional[Union[float, int]],
+        on_tile: Optional[Callable[[images.TileWindow, numpy.ndarray], None]] = None,
+    ) -> bool:
+        """
+        If resuming, reuse the measurement if a previous run finished writing it.
+
+        Its valid data (and any ``on_tile``) is read back from the written image.
+
+        :returns: Whether it was reused. If not, any partial image is removed, ready
+                  to be written again.
+        """
+        if self._manifest is None:
+            return False
+
+        finished = self._manifest.get(out_path)
+        if (
+            finished is None
+            or not out_path.exists()
+            or any(finished.get(k) != v for k, v in written_as.items())
+        ):
+            out_path.unlink(missing_ok=True)
+            return False
+
+        self._checksum.add_file(out_path)
+        if self._checksum.get(out_path) != finished["sha1"]:
+            warnings.warn(f"Rewriting measurement with a changed checksum: {out_path}")
+            out_path.unlink()
+            return False
+
+        if written_as["expand_valid_data"] or on_tile is not None:
+            with rasterio.open(out_path) as ds:
+                for window, block in images.iter_rio_tiles(ds, 1):
+                    if written_as["expand_valid_data"]:
+                        self._measurements.expand_window(grid, window, block, nodata)
+                    if on_tile is not None:
+                        on_tile(window, block)
+        self._note_file_format(finished["file_format"])
+        return True
+
+    def _finish_measurement(
+        self,
+        res: images.WriteResult,
+        out_path: Path,
+        written_as: Optional[Dict] = None,
+    ):
+        self._note_file_format(res.file_format.name)
+
         # We checksum immediately as the file has *just* been written so it may still
         # be in os/filesystem cache.
         self._checksum.add_file(out_path)
 
+        if self._manifest is not None:
+            self._manifest.add(
+                out_path,
+                dict(
+                    written_as,
+                    file_format=res.file_format.name,
+                    sha1=self._checksum.get(out_path),
+                ),
+            )
+
+    def _note_file_format(self, file_format: str):
+        with self._write_lock:
+            # Ensure the file_format field is set to what we're writing.
+            if "odc:file_format" not in self.properties:
+                self.properties["odc:file_format"] = file_format
+
+            if file_format != self.properties["odc:file_format"]:
+                raise RuntimeError(
+                    f"Inconsistent file formats between bands. "
+                    f"Was {self.properties['odc:file_format']!r}, now {file_format !r}"
+                )
+
+    def _submit_write(self, write: Callable[[], None]) -> Future:
+        """
+        Run the write in our worker pool, if we have one. Otherwise, run it now.
+        """
+        if self._write_pool is None:
+            future = Future()
+            future.set_result(write())
+            return future
+
+        future = self._write_pool.submit(write)
+        self._pending_writes.append(future)
+        return future
+
+    def wait_for_writes(self):
+        """
+        Wait for any measurements still being written by the worker pool (see ``max_workers``).
+
+        Errors from writing them will be raised here.
+
+        This is called automatically before anything that reads the measurement files,
+        such as writing thumbnails, or :meth:`.done`.
+        """
+        pending, self._pending_writes = self._pending_writes, []
+        futures.wait(pending)
+        for future in pending:
+            future.result()
+
+    def iter_measurement_paths(
+        self,
+    ) -> Generator[Tuple[GridSpec, str, Path], None, None]:
+        # No docstring deliberately: it's part of parent class docs.
+        #
+        # We override this to wait for measurement files that are still being written:
+        self.wait_for_writes()
+        return super().iter_measurement_paths()
+
     def write_thumbnail(
         self,
         red: str,
@@ -1450,9 +1949,11 @@ class DatasetAssembler(DatasetPrepare):
         resampling: Resampling = Resampling.average,
         static_stretch: Tuple[int, int] = None,
         percentile_stretch: Tuple[int, int] = (2, 98),
-        scale_factor: int = 10,
+        scale_factor: Union[int, Dict[str, int]] = 10,
         kind: str = None,
         path: Optional[Path] = None,
+        percentile_sample_size: Optional[int] = None,
+        from_overviews: bool = False,
     ):
         """
         Write a thumbnail for the dataset using the given measurements (specified by name) as r/g/b.
@@ -1471,13 +1972,35 @@ class DatasetAssembler(DatasetPrepare):
                      them (it will be put in the filename).
                      Eg. GA's ARD has two thumbnails, one of kind ``nbar`` and one of ``nbart``.
         :param scale_factor: How many multiples smaller to make the thumbnail.
+
+                             Or, to write several sizes at once, a mapping of each thumbnail's
+                             kind to its scale factor (eg. ``{"browse": 5, "icon": 50}``). The
+                             stretched quicklook is then only calculated once, for all of them.
         :param percentile_stretch: Upper/lower percentiles to stretch by
         :param resampling: rasterio :class:`rasterio.enums.Resampling` method to use.
         :param static_stretch: Use a static upper/lower value to stretch by instead of dynamic stretch.
+        :param percentile_sample_size: Estimate the percentiles of floating-point measurements
+                                       from (about) this many pixels, rather than from every pixel.
+                                       (Integer percentiles are always exact, and cheap)
+        :param from_overviews: Read the measurements at their closest overview level and
+                               reproject straight to the thumbnail, rather than via a
+                               full-resolution quicklook. (much faster, but the stretch is
+                               calculated from the overview pixels)
         """
-        thumb_path = self._work_path / (
-            path or self.names.thumbnail_filename(kind=kind)
-        )
+        self.wait_for_writes()
+        if isinstance(scale_factor, dict):
+            if kind or path:
+                raise ValueError(
+                    "The kinds of multiple thumbnails are given by the scale_factor dict: "
+                    "kind and path can't also be set"
+                )
+            scale_factor_by_kind = scale_factor
+        else:
+            scale_factor_by_kind = {kind: scale_factor}
+        thumb_paths = {
+            kind: self._work_path / (path or self.names.thumbnail_filename(kind=kind))
+            for kind in scale_factor_by_kind
+        }
 
         missing_measurements = {red, green, blue} - set(self.measurements)
         if missing_measurements:
@@ -1497,17 +2020,22 @@ class DatasetAssembler(DatasetPrepare):
             )
         grid = unique_grids[0]
 
-        FileWrite().create_thumbnail(
+        FileWrite().create_thumbnails(
             (rgbs[0][1], rgbs[1][1], rgbs[2][1]),
-            thumb_path,
-            out_scale=scale_factor,
+            {
+                thumb_paths[kind]: scale_factor
+                for kind, scale_factor in scale_factor_by_kind.items()
+            },
             resampling=resampling,
             static_stretch=static_stretch,
             percentile_stretch=percentile_stretch,
             input_geobox=grid,
+            percentile_sample_size=percentile_sample_size,
+            from_overviews=from_overviews,
         )
 
-        self.note_thumbnail(thumb_path, kind)
+        for kind, thumb_path in thumb_paths.items():
+            self.note_thumbnail(thumb_path, kind)
 
     def write_thumbnail_singleband(
         self,
@@ -1542,7 +2070,7 @@ class DatasetAssembler(DatasetPrepare):
              )
 
         """
-
+        self.wait_for_writes()
         thumb_path = self._work_path / self.names.thumbnail_filename(kind=kind)
 
         _, image_path = self.measurements.get(measurement, (None, None))
@@ -1642,6 +2170,8 @@ class DatasetAssembler(DatasetPrepare):
 
         :returns: The id and final path to the dataset metadata file.
         """
+        self.wait_for_writes()
+
         if (
             self._tmp_work_path is None
             and not self._software_versions
@@ -1662,6 +2192,9 @@ class DatasetAssembler(DatasetPrepare):
 
         dataset_location = self.names.dataset_location
 
+        if self._manifest is not None:
+            self._manifest.finish()
+
         self.note_software_version(
             "eodatasets3",
             "https://github.com/GeoscienceAustralia/eo-datasets",
@@ -1,8 +1,11 @@
+import contextlib
 import math
 import os
 import string
 import sys
 import tempfile
+import threading
+import warnings
 from collections import defaultdict
 from enum import Enum, auto
 from pathlib import Path, PurePath
@@ -35,7 +38,6 @@ from rasterio.enums import Resampling
 from rasterio.io import DatasetWriter, MemoryFile
 from rasterio.shutil import copy as rio_copy
 from rasterio.warp import calculate_default_transform, reproject
-from scipy.ndimage import binary_fill_holes
 from shapely.geometry import box
 from shapely.geometry.base import CAP_STYLE, JOIN_STYLE, BaseGeometry
 
@@ -55,32 +57,35 @@ class ValidDataMethod(Enum):
     How to calculate the valid data geometry for an image?
     """
 
-    #: Vectorize the full valid pixel mask as-is.
-    #:
-    #: In some circumstances this can be very slow.
-    #: `filled` may be safer.
+    #: Use the full valid pixel mask as-is.
     #:
+    #: The footprint is the convex hull of the valid pixels. It's found from
+    #: the first and last valid pixel of each row, without vectorizing the mask.
     thorough = auto()
 
-    #: Fill holes in the valid pixel mask before vectorizing.
+    #: Deprecated: the same as ``thorough``.
     #:
-    #: (Potentially much faster than ``thorough`` if there's many small
-    #: nodata holes, as they will create many tiny polygons.
-    #: *slightly* slower if no holes exist.)
+    #: (Filling holes in the mask can't change its convex hull, so this
+    #: no longer does anything extra.)
     filled = auto()
 
-    #: Take convex-hull of valid pixel mask before vectorizing.
-    #:
-    #: This is much slower than ``filled``, but will work in cases where
-    #: you have a lot of internal geometry that aren't holes.
-    #: Such as SLC-Off Landsat 7 data.
+    #: Deprecated: the same as ``thorough``.
     #:
-    #: Requires 'scikit-image' dependency.
+    #: (The footprint is always the convex hull of the valid pixels now, so
+    #: this no longer needs 'scikit-image'.)
     convex_hull = auto()
 
     #: Use the image file bounds, ignoring actual pixel values.
     bounds = auto()
 
+    #: Calculate from a reduced-resolution copy of the valid pixel mask,
+    #: like an overview.
+    #:
+    #: The footprint is only accurate to one reduced pixel, but it will
+    #: still contain every valid pixel. Useful when the footprint
+    #: calculation dominates the run time of high-volume packaging.
+    overview = auto()
+
 
 @attr.s(auto_attribs=True, slots=True, hash=True, frozen=True)
 class GridSpec:
@@ -234,6 +239,114 @@ def generate_tiles(
     return tiles
 
 
+#: A window of an image, as ((ystart,yend),(xstart,xend)) pixel offsets.
+TileWindow = Tuple[Tuple[int, int], Tuple[int, int]]
+
+#: Windows of an image and their pixel arrays.
+LazyTiles = Iterable[Tuple[TileWindow, numpy.ndarray]]
+
+#: Default memory limit for each window of a windowed (streaming) read.
+DEFAULT_WINDOW_BYTES = 64 * 1024 * 1024
+
+
+def iter_rio_tiles(
+    ds: DatasetReader,
+    index: int = 1,
+    max_window_bytes: int = DEFAULT_WINDOW_BYTES,
+) -> LazyTiles:
+    """
+    Lazily read a band of an open rasterio dataset, one window at a time.
+
+    Windows are aligned to the internal blocks of the dataset, and are as large as
+    possible while remaining within ``max_window_bytes`` (but are always at least
+    one block in size).
+    """
+    windows = _block_aligned_windows(
+        ds.shape,
+        ds.block_shapes[index - 1],
+        numpy.dtype(ds.dtypes[index - 1]).itemsize,
+        max_window_bytes,
+    )
+    for window in windows:
+        yield window, ds.read(index, window=window)
+
+
+def is_chunked(array) -> bool:
+    """
+    Is this a 2D array that's read lazily in regular chunks, such as a h5py dataset?
+
+    (Dask arrays aren't: reading them a window at a time would compute each window's
+    upstream tasks again, so they're better computed whole.)
+    """
+    chunks = getattr(array, "chunks", None)
+    return array.ndim == 2 and chunks is not None and isinstance(chunks[0], int)
+
+
+def iter_chunked_tiles(
+    array, max_window_bytes: int = DEFAULT_WINDOW_BYTES
+) -> LazyTiles:
+    """
+    Lazily read a 2D chunked array (see :func:`is_chunked`), one window at a time.
+
+    Windows are aligned to the chunks, so each chunk is only read once.
+    (see :func:`iter_chunked_windows`)
+    """
+    for window in iter_chunked_windows(array, max_window_bytes):
+        (ystart, yend), (xstart, xend) = window
+        yield window, numpy.asarray(array[ystart:yend, xstart:xend])
+
+
+def iter_chunked_windows(
+    array, max_window_bytes: int = DEFAULT_WINDOW_BYTES
+) -> Iterable[TileWindow]:
+    """
+    The windows to read a 2D chunked array in (see :func:`is_chunked`), aligned to its chunks.
+
+    Windows are as large as possible within ``max_window_bytes``.
+    """
+    return _block_aligned_windows(
+        array.shape, array.chunks, array.dtype.itemsize, max_window_bytes
+    )
+
+
+def _block_aligned_windows(
+    shape: Tuple[int, int],
+    block_yx: Tuple[int, int],
+    pixel_bytes: int,
+    max_window_bytes: int,
+) -> Iterable[TileWindow]:
+    """
+    Windows aligned to the blocks of an image, as large as possible while remaining
+    within ``max_window_bytes`` (but always at least one block in size).
+    """
+    block_y, block_x = block_yx
+    lines, samples = shape
+
+    max_pixels = max(max_window_bytes // pixel_bytes, 1)
+    if samples * block_y <= max_pixels:
+        # Whole rows of blocks.
+        xtile = samples
+        ytile = (max_pixels // samples) // block_y * block_y
+    else:
+        ytile = block_y
+        xtile = max((max_pixels // block_y) // block_x * block_x, block_x)
+
+    return generate_tiles(samples, lines, xtile, ytile)
+
+
+def available_cpu_count() -> int:
+    """
+    How many CPUs can this process use?
+
+    (This respects CPU affinity, such as from a batch scheduler, unlike :func:`os.cpu_count`)
+    """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        # Not available on all platforms.
+        return os.cpu_count() or 1
+
+
 def _common_suffix(names: Iterable[str]) -> str:
     return os.path.commonprefix([s[::-1] for s in names])[::-1]
 
@@ -308,46 +421,92 @@ class MeasurementBundler:
         # (value is band_name->Path)
         self._measurements_per_grid: Dict[GridSpec, _Measurements] = defaultdict(dict)
         # Valid data mask per grid, in pixel coordinates.
+        # (bit-packed along each row, as they're held for the life of the bundler)
         self.mask_by_grid: Dict[GridSpec, numpy.ndarray] = {}
+        # Images may be recorded from multiple writer threads.
+        self._lock = threading.Lock()
 
     def record_image(
         self,
         name: str,
         grid: GridSpec,
         path: Union[PurePath, str],
-        img: numpy.ndarray,
+        img: Optional[numpy.ndarray] = None,
         layer: Optional[str] = None,
         nodata: Optional[Union[float, int]] = None,
         expand_valid_data=True,
     ):
-        for measurements in self._measurements_per_grid.values():
-            if name in measurements:
-                raise ValueError(
-                    f"Duplicate addition of band called {name!r}. "
-                    f"Original at {measurements[name]} and now {path}"
-                )
+        """
+        Record a measurement.
 
-        self._measurements_per_grid[grid][name] = _MeasurementLocation(path, layer)
-        if expand_valid_data:
-            self._expand_valid_data_mask(grid, img, nodata)
+        If the image pixels aren't given, they can be added to the valid data
+        afterwards, one window at a time, with :meth:`expand_window`.
+        """
+        with self._lock:
+            for measurements in self._measurements_per_grid.values():
+                if name in measurements:
+                    raise ValueError(
+                        f"Duplicate addition of band called {name!r}. "
+                        f"Original at {measurements[name]} and now {path}"
+                    )
+
+            self._measurements_per_grid[grid][name] = _MeasurementLocation(path, layer)
+        if expand_valid_data and img is not None:
+            self.expand_window(grid, None, img, nodata)
 
-    def _expand_valid_data_mask(
-        self, grid: GridSpec, img: numpy.ndarray, nodata: Union[float, int]
+    def expand_window(
+        self,
+        grid: GridSpec,
+        window: Optional[TileWindow],
+        block: numpy.ndarray,
+        nodata: Optional[Union[float, int]] = None,
     ):
-        if nodata is None:
-            nodata = float("nan") if numpy.issubdtype(img.dtype, numpy.floating) else 0
+        """
+        Add the valid pixels of one window of an image to the grid's valid data.
 
-        if math.isnan(nodata):
-            valid_values = numpy.isfinite(img)
-        else:
-            valid_values = img != nodata
+        Windows may be added in any order, and may overlap. (It's safe to call from
+        multiple threads.)
 
-        mask = self.mask_by_grid.get(grid)
-        if mask is None:
-            mask = valid_values
-        else:
-            mask |= valid_values
-        self.mask_by_grid[grid] = mask
+        :param window: The ``((ystart, yend), (xstart, xend))`` window of the grid
+                       that the block covers, or None for the whole grid.
+        :param block: The pixels of the window
+        :param nodata: The nodata value. Defaults to ``nan`` for floats, otherwise ``0``.
+        """
+        if nodata is None:
+            nodata = (
+                float("nan") if numpy.issubdtype(block.dtype, numpy.floating) else 0
+            )
+        if window is None:
+            window = ((0, grid.shape[0]), (0, grid.shape[1]))
+        (ystart, yend), (xstart, xend) = window
+        if block.shape != (yend - ystart, xend - xstart):
+            raise ValueError(
+                f"Block of shape {block.shape} doesn't match window {window}"
+            )
+
+        # Pack the window into whole bytes of the grid's mask, padding the
+        # start if the window isn't aligned to a byte.
+        byte_start, bit_offset = divmod(xstart, 8)
+        packed = numpy.empty(
+            (yend - ystart, _packed_width(bit_offset + xend - xstart)),
+            dtype=numpy.uint8,
+        )
+        # A strip of rows at a time, to avoid an unpacked copy of the whole image.
+        for row in range(0, yend - ystart, _MASK_STRIP_ROWS):
+            valid_values = _valid_pixels(block[row : row + _MASK_STRIP_ROWS], nodata)
+            if bit_offset:
+                valid_values = numpy.pad(valid_values, ((0, 0), (bit_offset, 0)))
+            packed[row : row + _MASK_STRIP_ROWS] = numpy.packbits(valid_values, axis=1)
+            del valid_values
+
+        with self._lock:
+            mask = self.mask_by_grid.get(grid)
+            if mask is None:
+                mask = numpy.zeros(
+                    (grid.shape[0], _packed_width(grid.shape[1])), dtype=numpy.uint8
+                )
+                self.mask_by_grid[grid] = mask
+            mask[ystart:yend, byte_start : byte_start + packed.shape[1]] |= packed
 
     def _as_named_grids(self) -> Dict[str, Tuple[GridSpec, _Measurements]]:
         """Get our grids with sensible (hopefully!), names."""
@@ -460,7 +619,9 @@ class MeasurementBundler:
         return crs, grid_docs, measurement_docs
 
     def consume_and_get_valid_data(
-        self, valid_data_method: ValidDataMethod = ValidDataMethod.thorough
+        self,
+        valid_data_method: ValidDataMethod = ValidDataMethod.thorough,
+        overview_factor: int = DEFAULT_OVERVIEWS[0],
     ) -> BaseGeometry:
         """
         Consume the stored grids and produce the valid data for them.
@@ -468,33 +629,40 @@ class MeasurementBundler:
         (they are consumed in order to to minimise peak memory usage)
 
         :param valid_data_method: How to calculate the valid-data polygon?
+        :param overview_factor: How much to reduce the resolution of the mask,
+                                for :attr:`ValidDataMethod.overview`
         """
 
+        if valid_data_method in (ValidDataMethod.filled, ValidDataMethod.convex_hull):
+            warnings.warn(
+                f"ValidDataMethod.{valid_data_method.name} is deprecated, "
+                "as it gives the same footprint as ValidDataMethod.thorough",
+                category=DeprecationWarning,
+            )
+            valid_data_method = ValidDataMethod.thorough
+
         geoms = []
 
         while self.mask_by_grid:
-            grid, mask = self.mask_by_grid.popitem()
+            grid, packed_mask = self.mask_by_grid.popitem()
 
             if valid_data_method is ValidDataMethod.bounds:
-                geom = box(*grid.bounds)
-            elif valid_data_method is ValidDataMethod.filled:
-                mask = mask.astype("uint8")
-                binary_fill_holes(mask, output=mask)
-                geom = _grid_to_poly(grid, mask)
-            elif valid_data_method is ValidDataMethod.convex_hull:
-                # Requires optional dependency scikit-image
-                from skimage import morphology as morph
-
-                geom = _grid_to_poly(
-                    grid, morph.convex_hull_image(mask).astype("uint8")
-                )
-            elif valid_data_method is ValidDataMethod.thorough:
-                geom = _grid_to_poly(grid, mask.astype("uint8"))
-            else:
+                geoms.append(box(*grid.bounds))
+                continue
+
+            if valid_data_method is ValidDataMethod.overview:
+                mask = _decimate_mask(packed_mask, grid.shape, overview_factor)
+                del packed_mask
+                geoms.append(_grid_to_poly(grid, mask, scale=overview_factor))
+                continue
+
+            if valid_data_method is not ValidDataMethod.thorough:
                 raise NotImplementedError(
                     f"Unexpected valid data method: {valid_data_method}"
                 )
-            geoms.append(geom)
+            mask = _unpack_mask(packed_mask, grid.shape)
+            del packed_mask
+            geoms.append(_grid_to_poly(grid, mask))
         return shapely.ops.unary_union(geoms)
 
     def iter_names(self) -> Generator[str, None, None]:
@@ -510,28 +678,70 @@ class MeasurementBundler:
                 yield grid, band_name, meas_path.path
 
 
+# How many rows of an image to find valid pixels for at once.
+_MASK_STRIP_ROWS = 1024
+
+
+def _valid_pixels(img: numpy.ndarray, nodata: Union[float, int]) -> numpy.ndarray:
+    if math.isnan(nodata):
+        return numpy.isfinite(img)
+    return img != nodata
+
+
+def _packed_width(width: int) -> int:
+    """How many bytes are needed to hold a row of this many pixels, when bit-packed"""
+    return -(-width // 8)
+
+
+def _unpack_mask(packed_mask: numpy.ndarray, shape: Tuple[int, int]) -> numpy.ndarray:
+    """Unpack a bit-packed mask into a boolean array of the given shape"""
+    return numpy.unpackbits(packed_mask, axis=1)[:, : shape[1]].view(bool)
+
+
+def _decimate_mask(
+    packed_mask: numpy.ndarray, shape: Tuple[int, int], factor: int
+) -> numpy.ndarray:
+    """
+    Reduce the resolution of a bit-packed mask by the given factor.
+
+    A reduced pixel is valid if any of the pixels it covers are valid.
+    """
+    height, width = shape
+    decimated = numpy.zeros((-(-height // factor), -(-width // factor)), dtype=bool)
+    strip_rows = max(_MASK_STRIP_ROWS // factor, 1) * factor
+    for row in range(0, height, strip_rows):
+        strip = _unpack_mask(packed_mask[row : row + strip_rows], shape)
+        strip = numpy.pad(
+            strip, ((0, -strip.shape[0] % factor), (0, -strip.shape[1] % factor))
+        )
+        strip_height = strip.shape[0] // factor
+        decimated[row // factor : row // factor + strip_height] = strip.reshape(
+            strip_height, factor, decimated.shape[1], factor
+        ).any(axis=(1, 3))
+        del strip
+    return decimated
+
+
 def _valid_shape(shape: BaseGeometry) -> BaseGeometry:
     if shape.is_valid:
         return shape
     return shape.buffer(0)
 
 
-def _grid_to_poly(grid: GridSpec, mask: numpy.ndarray) -> BaseGeometry:
-    shape = shapely.ops.unary_union(
-        [
-            _valid_shape(shapely.geometry.shape(shape))
-            for shape, val in rasterio.features.shapes(mask)
-            if val == 1
-        ]
-    )
-    shape_y, shape_x = mask.shape
-    del mask
+def _grid_to_poly(grid: GridSpec, mask: numpy.ndarray, scale: int = 1) -> BaseGeometry:
+    """
+    :param scale: How many grid pixels wide each mask pixel is, if it's reduced-resolution.
+    """
+    shape_y, shape_x = grid.shape
     # convex hull
-    geom = shape.convex_hull
-    # buffer by 1 pixel
-    geom = geom.buffer(1, cap_style=CAP_STYLE.square, join_style=JOIN_STYLE.bevel)
-    # simplify with 1 pixel radius
-    geom = geom.simplify(1)
+    geom = _mask_convex_hull(mask)
+    del mask
+    if scale != 1:
+        geom = shapely.affinity.scale(geom, scale, scale, origin=(0, 0))
+    # buffer by 1 mask pixel
+    geom = geom.buffer(scale, cap_style=CAP_STYLE.square, join_style=JOIN_STYLE.bevel)
+    # simplify with 1 mask pixel radius
+    geom = geom.simplify(scale)
     # intersect with image bounding box
     geom = geom.intersection(shapely.geometry.box(0, 0, shape_x, shape_y))
     # transform from pixel space into CRS space
@@ -549,6 +759,33 @@ def _grid_to_poly(grid: GridSpec, mask: numpy.ndarray) -> BaseGeometry:
     return geom
 
 
+def _mask_convex_hull(mask: numpy.ndarray) -> BaseGeometry:
+    """
+    The convex hull of the valid (``1``) pixels of a mask, in pixel coordinates.
+
+    The hull of a set of pixel squares is the hull of their corners, and only
+    the first and last valid pixel of each row can contribute to it, so we don't
+    need to vectorize every pixel. (Vectorizing can create hundreds of thousands
+    of polygons for striped data, such as Landsat 7 SLC-off)
+    """
+    valid = mask if mask.dtype == bool else (mask == 1)
+    rows = numpy.flatnonzero(valid.any(axis=1))
+    if rows.size == 0:
+        return shapely.geometry.Polygon()
+
+    valid = valid[rows]
+    first = valid.argmax(axis=1)
+    last_end = valid.shape[1] - valid[:, ::-1].argmax(axis=1)
+    del valid
+
+    # The outer corners of the first and last pixels in each row.
+    xs = numpy.concatenate([first, first, last_end, last_end])
+    ys = numpy.concatenate([rows, rows + 1, rows, rows + 1])
+    return shapely.geometry.MultiPoint(
+        numpy.column_stack([xs, ys]).astype("float64")
+    ).convex_hull
+
+
 @attr.s(auto_attribs=True)
 class WriteResult:
     # path: Path
@@ -583,10 +820,12 @@ class FileWrite:
         self,
         gdal_options: Dict = None,
         overview_blocksize: Optional[int] = None,
+        stage_in_memory: bool = False,
     ) -> None:
         super().__init__()
         self.options = gdal_options or {}
         self.overview_blocksize = overview_blocksize
+        self.stage_in_memory = stage_in_memory
 
     @classmethod
     def from_existing(
@@ -597,6 +836,8 @@ class FileWrite:
         overview_blocksize: Optional[int] = None,
         compress="deflate",
         zlevel=4,
+        stage_in_memory: bool = False,
+        num_threads: Optional[Union[int, str]] = None,
     ) -> "FileWrite":
         """Returns write_img options according to the source imagery provided
         :param overviews:
@@ -605,9 +846,17 @@ class FileWrite:
             (int) override the derived base blockxsize in cogtif conversion
         :param blockysize:
             (int) override the derived base blockysize in cogtif conversion
+        :param stage_in_memory:
+            (boolean) build each image and its overviews in memory rather than a
+            temporary file, so the output is written to disk in a single pass.
+        :param num_threads:
+            (int) how many threads GDAL should use to compress blocks, for both the
+            image and its overviews. (or ``"ALL_CPUS"``. Default is a single thread)
 
         """
         options = {"compress": compress, "zlevel": zlevel}
+        if num_threads:
+            options["num_threads"] = num_threads
 
         y_size, x_size = blocksize_yx or (512, 512)
         # Do not set block sizes for small imagery
@@ -621,7 +870,11 @@ class FileWrite:
         if overviews:
             options["copy_src_overviews"] = "yes"
 
-        return FileWrite(options, overview_blocksize=overview_blocksize)
+        return FileWrite(
+            options,
+            overview_blocksize=overview_blocksize,
+            stage_in_memory=stage_in_memory,
+        )
 
     def write_from_ndarray(
         self,
@@ -658,26 +911,13 @@ class FileWrite:
             chunks. To override the blocksizes, specify them using the
             `options` keyword. Eg {'blockxsize': 512, 'blockysize': 512}.
         """
-        if out_filename.exists():
-            # Sanity check. Our measurements should have different names...
-            raise RuntimeError(
-                f"measurement output file already exists? {out_filename}"
-            )
 
         # TODO: Old packager never passed in tags. Perhaps we want some?
         tags = {}
 
-        dtype = array.dtype.name
-
-        # Check for excluded datatypes
-        excluded_dtypes = ["int64", "int8", "uint64"]
-        if dtype in excluded_dtypes:
-            raise TypeError(f"Datatype not supported: {dtype}")
-
         # convert any bools to uin8
-        if dtype == "bool":
+        if array.dtype.name == "bool":
             array = numpy.uint8(array)
-            dtype = "uint8"
 
         ndims = array.ndim
         shape = array.shape
@@ -694,6 +934,127 @@ class FileWrite:
         else:
             raise IndexError(f"Input array is not of 2 or 3 dimensions. Got {ndims}")
 
+        chunks_yx = None
+        if h5py is not None and isinstance(array, h5py.Dataset):
+            # TODO: if array is 3D get x & y chunks
+            if array.chunks[1] == array.shape[1]:
+                # GDAL doesn't like tiled or blocksize options to be set
+                # the same length as the columns (probably true for rows as well)
+                array = array[:]
+            else:
+                y_tile, x_tile = chunks_yx = array.chunks
+                tiles = generate_tiles(samples, lines, x_tile, y_tile)
+
+        rio_args = self._rio_args(
+            array.dtype,
+            bands,
+            (lines, samples),
+            geobox=geobox,
+            nodata=nodata,
+            chunks_yx=chunks_yx,
+        )
+
+        with self._open_staged(
+            out_filename, rio_args, overviews, overview_resampling
+        ) as outds:
+            if bands == 1:
+                if h5py is not None and isinstance(array, h5py.Dataset):
+                    for tile in tiles:
+                        idx = (
+                            slice(tile[0][0], tile[0][1]),
+                            slice(tile[1][0], tile[1][1]),
+                        )
+                        outds.write(array[idx], 1, window=tile)
+                else:
+                    outds.write(array, 1)
+            else:
+                if h5py is not None and isinstance(array, h5py.Dataset):
+                    for tile in tiles:
+                        idx = (
+                            slice(tile[0][0], tile[0][1]),
+                            slice(tile[1][0], tile[1][1]),
+                        )
+                        subs = array[:, idx[0], idx[1]]
+                        for i in range(bands):
+                            outds.write(subs[i], i + 1, window=tile)
+                else:
+                    for i in range(bands):
+                        outds.write(array[i], i + 1)
+            if tags is not None:
+                outds.update_tags(**tags)
+
+        return WriteResult(file_format=FileFormat.GeoTIFF)
+
+    def write_from_tiles(
+        self,
+        tiles: LazyTiles,
+        out_filename: Path,
+        shape: Tuple[int, int],
+        dtype: numpy.dtype,
+        geobox: GridSpec = None,
+        nodata: int = None,
+        overview_resampling=Resampling.nearest,
+        overviews: Optional[Tuple[int, ...]] = DEFAULT_OVERVIEWS,
+    ) -> WriteResult:
+        """
+        Writes a 2D image to disk one window at a time, so that the whole image
+        never needs to be held in memory.
+
+        :param tiles:
+            The windows of the image and their pixels, such as from :func:`iter_rio_tiles`.
+            Together they must cover the whole image.
+
+        :param shape:
+            The (lines, samples) shape of the full image.
+
+        :param dtype:
+            The data type of the image.
+
+        See :meth:`write_from_ndarray` for other parameters.
+        """
+        dtype = numpy.dtype(dtype)
+        # convert any bools to uin8
+        to_uint8 = dtype.name == "bool"
+        if to_uint8:
+            dtype = numpy.dtype("uint8")
+
+        rio_args = self._rio_args(dtype, 1, shape, geobox=geobox, nodata=nodata)
+
+        with self._open_staged(
+            out_filename, rio_args, overviews, overview_resampling
+        ) as outds:
+            for window, block in tiles:
+                if to_uint8:
+                    block = numpy.uint8(block)
+                outds.write(block, 1, window=window)
+
+        return WriteResult(file_format=FileFormat.GeoTIFF)
+
+    def _rio_args(
+        self,
+        dtype: numpy.dtype,
+        bands: int,
+        shape: Tuple[int, int],
+        geobox: GridSpec = None,
+        nodata: int = None,
+        chunks_yx: Optional[Tuple[int, int]] = None,
+    ) -> Dict:
+        """
+        Rasterio creation arguments for writing an image.
+
+        :param chunks_yx:
+            The chunk size of the input, to use as a blocksize if the options
+            don't give one.
+        """
+        dtype = numpy.dtype(dtype)
+
+        # Check for excluded datatypes
+        excluded_dtypes = ["int64", "int8", "uint64"]
+        if dtype.name in excluded_dtypes:
+            raise TypeError(f"Datatype not supported: {dtype.name}")
+
+        lines, samples = shape
+
         transform = None
         projection = None
         if geobox is not None:
@@ -706,91 +1067,95 @@ class FileWrite:
             "height": lines,
             "crs": projection,
             "transform": transform,
-            "dtype": dtype,
+            "dtype": dtype.name,
             "driver": "GTiff",
-            "predictor": self.PREDICTOR_DEFAULTS[dtype],
+            "predictor": self.PREDICTOR_DEFAULTS[dtype.name],
         }
         # Ensure 'nan' is always tagged as nodata for floating point types
-        if nodata is None and numpy.issubdtype(array.dtype, numpy.floating):
+        if nodata is None and numpy.issubdtype(dtype, numpy.floating):
             nodata = numpy.nan
 
         if nodata is not None:
             rio_args["nodata"] = nodata
 
-        if h5py is not None and isinstance(array, h5py.Dataset):
-            # TODO: if array is 3D get x & y chunks
-            if array.chunks[1] == array.shape[1]:
-                # GDAL doesn't like tiled or blocksize options to be set
-                # the same length as the columns (probably true for rows as well)
-                array = array[:]
-            else:
-                y_tile, x_tile = array.chunks
-                tiles = generate_tiles(samples, lines, x_tile, y_tile)
-
-                if "tiled" in self.options:
-                    rio_args["blockxsize"] = self.options.get("blockxsize", x_tile)
-                    rio_args["blockysize"] = self.options.get("blockysize", y_tile)
+        if chunks_yx is not None and "tiled" in self.options:
+            y_tile, x_tile = chunks_yx
+            rio_args["blockxsize"] = self.options.get("blockxsize", x_tile)
+            rio_args["blockysize"] = self.options.get("blockysize", y_tile)
 
         # the user can override any derived blocksizes by supplying `options`
         # handle case where no options are provided
         for key in self.options:
             rio_args[key] = self.options[key]
 
-        # Write to temp directory first so we can add levels afterwards with gdal.
-        with tempfile.TemporaryDirectory(
-            dir=out_filename.parent, prefix=".band_write"
-        ) as tmpdir:
-            unstructured_image = Path(tmpdir) / out_filename.name
-            """
-            This is a wrapper around rasterio writing tiles to
-            enable writing to a temporary location before rearranging
-            the overviews within the file by gdal when required
-            """
-            with rasterio.open(unstructured_image, "w", **rio_args) as outds:
-                if bands == 1:
-                    if h5py is not None and isinstance(array, h5py.Dataset):
-                        for tile in tiles:
-                            idx = (
-                                slice(tile[0][0], tile[0][1]),
-                                slice(tile[1][0], tile[1][1]),
-                            )
-                            outds.write(array[idx], 1, window=tile)
-                    else:
-                        outds.write(array, 1)
+        return rio_args
+
+    @contextlib.contextmanager
+    def _open_staged(
+        self,
+        out_filename: Path,
+        rio_args: Dict,
+        overviews: Optional[Tuple[int, ...]],
+        overview_resampling: Resampling,
+    ) -> Generator[DatasetWriter, None, None]:
+        """
+        Open an image for writing, to be rearranged into a COG at the output path on close.
+
+        GDAL can only add overviews to the end of a file, but a COG needs them at the
+        start. So the image and its overviews are first written to a staging image, which
+        is then copied to the output with the overviews moved to the front.
+
+        The staging image is a temporary file alongside the output, or in memory
+        (``/vsimem``) if ``stage_in_memory`` is set, so that the output is only
+        written once. Both produce the same file layout.
+        """
+        if out_filename.exists():
+            # Sanity check. Our measurements should have different names...
+            raise RuntimeError(
+                f"measurement output file already exists? {out_filename}"
+            )
+
+        if self.stage_in_memory:
+            with MemoryFile(filename=out_filename.name) as staged:
+                with staged.open(**rio_args) as outds:
+                    yield outds
+                    # overviews/pyramids to memory
+                    if overviews:
+                        outds.build_overviews(overviews, overview_resampling)
+
+                if overviews:
+                    self._copy_to_cog(staged.name, out_filename, rio_args)
                 else:
-                    if h5py is not None and isinstance(array, h5py.Dataset):
-                        for tile in tiles:
-                            idx = (
-                                slice(tile[0][0], tile[0][1]),
-                                slice(tile[1][0], tile[1][1]),
-                            )
-                            subs = array[:, idx[0], idx[1]]
-                            for i in range(bands):
-                                outds.write(subs[i], i + 1, window=tile)
-                    else:
-                        for i in range(bands):
-                            outds.write(array[i], i + 1)
-                if tags is not None:
-                    outds.update_tags(**tags)
+                    out_filename.write_bytes(staged.getbuffer())
+        else:
+            # Write to temp directory first so we can add levels afterwards with gdal.
+            with tempfile.TemporaryDirectory(
+                dir=out_filename.parent, prefix=".band_write"
+            ) as tmpdir:
+                unstructured_image = Path(tmpdir) / out_filename.name
+                with rasterio.open(unstructured_image, "w", **rio_args) as outds:
+                    yield outds
+                    # overviews/pyramids to disk
+                    if overviews:
+                        outds.build_overviews(overviews, overview_resampling)
 
-                # overviews/pyramids to disk
                 if overviews:
-                    outds.build_overviews(overviews, overview_resampling)
-
-            if overviews:
-                # Move the overviews to the start of the file, as required to be COG-compliant.
-                with rasterio.Env(
-                    GDAL_TIFF_OVR_BLOCKSIZE=self.overview_blocksize or 512
-                ):
-                    rio_copy(
-                        unstructured_image,
-                        out_filename,
-                        **{"copy_src_overviews": True, **rio_args},
-                    )
-            else:
-                unstructured_image.rename(out_filename)
+                    self._copy_to_cog(unstructured_image, out_filename, rio_args)
+                else:
+                    unstructured_image.rename(out_filename)
 
-        return WriteResult(file_format=FileFormat.GeoTIFF)
+    def _copy_to_cog(
+        self, staged_image: Union[Path, str], out_filename: Path, rio_args: Dict
+    ):
+        # Move the overviews to the start of the file, as required to be COG-compliant.
+        # (Rasterio sets config options thread-locally outside the main thread, so this
+        # doesn't interfere with concurrent writes in a worker pool)
+        with rasterio.Env(GDAL_TIFF_OVR_BLOCKSIZE=self.overview_blocksize or 512):
+            rio_copy(
+                staged_image,
+                out_filename,
+                **{"copy_src_overviews": True, **rio_args},
+            )
 
     def create_thumbnail(
         self,
@@ -802,6 +1167,9 @@ class FileWrite:
         percentile_stretch: Tuple[int, int] = (2, 98),
         compress_quality: int = 85,
         input_geobox: GridSpec = None,
+        percentile_sample_size: Optional[int] = None,
+        from_overviews: bool = False,
+        max_cache_bytes: int = 0,
     ):
         """
         Generate a thumbnail jpg image using the given three paths as red,green, blue.
@@ -815,11 +1183,76 @@ class FileWrite:
 
         Any non-contiguous data across the colour domain, will be set to
         zero.
+
+        Percentiles of floating-point images can be estimated from a sample of
+        (about) ``percentile_sample_size`` pixels, rather than from every pixel.
+
+        If ``from_overviews`` is set, the images are read at their closest overview level
+        (no finer than the thumbnail), and reprojected straight to the thumbnail, rather
+        than via a full-resolution quicklook. This is roughly ``out_scale²`` times less
+        work, but the percentile stretch is only calculated from the overview pixels.
+
+        The images are otherwise read twice: once for the stretch, and once to write.
+        Up to ``max_cache_bytes`` of them can be held in memory between the two, so they're
+        only decoded once. (default: none, re-reading them all)
+        """
+        self.create_thumbnails(
+            rgb,
+            {out: out_scale},
+            resampling=resampling,
+            static_stretch=static_stretch,
+            percentile_stretch=percentile_stretch,
+            compress_quality=compress_quality,
+            input_geobox=input_geobox,
+            percentile_sample_size=percentile_sample_size,
+            from_overviews=from_overviews,
+            max_cache_bytes=max_cache_bytes,
+        )
+
+    def create_thumbnails(
+        self,
+        rgb: Tuple[Path, Path, Path],
+        out_scales: Dict[Path, int],
+        resampling=Resampling.average,
+        static_stretch: Tuple[int, int] = None,
+        percentile_stretch: Tuple[int, int] = (2, 98),
+        compress_quality: int = 85,
+        input_geobox: GridSpec = None,
+        percentile_sample_size: Optional[int] = None,
+        from_overviews: bool = False,
+        max_cache_bytes: int = 0,
+    ):
+        """
+        Generate several sizes of thumbnail jpg from the same three red, green, blue paths.
+
+        The stretched, reprojected quicklook is only calculated once, and each thumbnail
+        is scaled down from it.
+
+        :param out_scales: The output path of each thumbnail, and how many multiples
+                           smaller to make it.
+
+        See :meth:`create_thumbnail` for other parameters.
         """
         # No aux.xml file with our jpeg.
         with rasterio.Env(GDAL_PAM_ENABLED=False):
+            if from_overviews:
+                # Each size is read from its own overview level.
+                for out, out_scale in out_scales.items():
+                    _write_thumbnail_from_overviews(
+                        rgb,
+                        out,
+                        out_scale,
+                        resampling,
+                        static_range=static_stretch,
+                        percentile_range=percentile_stretch,
+                        compress_quality=compress_quality,
+                        input_geobox=input_geobox,
+                        percentile_sample_size=percentile_sample_size,
+                    )
+                return
+
             with tempfile.TemporaryDirectory(
-                dir=out.parent, prefix=".thumbgen-"
+                dir=next(iter(out_scales)).parent, prefix=".thumbgen-"
             ) as tmpdir:
                 tmp_quicklook_path = Path(tmpdir) / "quicklook.tif"
 
@@ -832,47 +1265,27 @@ class FileWrite:
                     static_range=static_stretch,
                     percentile_range=percentile_stretch,
                     input_geobox=input_geobox,
+                    percentile_sample_size=percentile_sample_size,
+                    max_cache_bytes=max_cache_bytes,
                 )
-                out_crs = ql_grid.crs
-
-                # Scale and write as JPEG to the output.
-                (
-                    thumb_transform,
-                    thumb_width,
-                    thumb_height,
-                ) = calculate_default_transform(
-                    out_crs,
-                    out_crs,
-                    ql_grid.shape[1],
-                    ql_grid.shape[0],
-                    *ql_grid.bounds,
-                    dst_width=ql_grid.shape[1] // out_scale,
-                    dst_height=ql_grid.shape[0] // out_scale,
-                )
-                thumb_args = dict(
-                    driver="JPEG",
-                    quality=compress_quality,
-                    height=thumb_height,
-                    width=thumb_width,
-                    count=3,
-                    dtype="uint8",
-                    nodata=0,
-                    transform=thumb_transform,
-                    crs=out_crs,
-                )
+
                 with rasterio.open(tmp_quicklook_path, "r") as ql_ds:
                     ql_ds: DatasetReader
-                    with rasterio.open(out, "w", **thumb_args) as thumb_ds:
-                        thumb_ds: DatasetWriter
-                        for index in thumb_ds.indexes:
-                            thumb_ds.write(
-                                ql_ds.read(
+                    for out, out_scale in out_scales.items():
+                        # Scale and write as JPEG to the output.
+                        thumb_grid = _thumbnail_grid(ql_grid, out_scale)
+                        thumb_args = _thumbnail_args(thumb_grid, compress_quality)
+                        with rasterio.open(out, "w", **thumb_args) as thumb_ds:
+                            thumb_ds: DatasetWriter
+                            for index in thumb_ds.indexes:
+                                thumb_ds.write(
+                                    ql_ds.read(
+                                        index,
+                                        out_shape=thumb_grid.shape,
+                                        resampling=resampling,
+                                    ),
                                     index,
-                                    out_shape=(thumb_height, thumb_width),
-                                    resampling=resampling,
-                                ),
-                                index,
-                            )
+                                )
 
     def create_thumbnail_from_numpy(
         self,
@@ -884,6 +1297,7 @@ class FileWrite:
         compress_quality: int = 85,
         input_geobox: GridSpec = None,
         nodata: int = -999,
+        percentile_sample_size: Optional[int] = None,
     ):
         """
         Generate a thumbnail as numpy arrays.
@@ -896,6 +1310,8 @@ class FileWrite:
         override this with a static range of values.
 
         Any non-contiguous data across the colour domain, will be set to zero.
+
+        See :meth:`create_thumbnail` for ``percentile_sample_size``.
         """
         ql_grid, numpy_array_list, ql_write_args = _write_to_numpy_array(
             rgb,
@@ -904,6 +1320,7 @@ class FileWrite:
             percentile_range=percentile_stretch,
             input_geobox=input_geobox,
             nodata=nodata,
+            percentile_sample_size=percentile_sample_size,
         )
         out_crs = ql_grid.crs
 
@@ -965,6 +1382,9 @@ class FileWrite:
         Write out a JPG thumbnail from a singleband image.
         This takes in a path to a valid raster dataset and writes
         out a file with only the values of the bit (integer) as white
+
+        The whole band is read into memory (there's no size limit), so
+        only the final jpeg is written to disk.
         """
         if bit is not None and lookup_table is not None:
             raise ValueError(
@@ -976,32 +1396,25 @@ class FileWrite:
             )
 
         with rasterio.open(in_file) as dataset:
-            data = dataset.read()
-            out_data, stretch = self._filter_singleband_data(data, bit, lookup_table)
-
-        meta = dataset.meta
-        meta["driver"] = "GTiff"
-
-        with tempfile.TemporaryDirectory() as temp_dir:
-            if bit:
-                # Only use one file, three times
-                temp_file = Path(temp_dir) / "temp.tif"
-
-                with rasterio.open(temp_file, "w", **meta) as tmpdataset:
-                    tmpdataset.write(out_data)
-                self.create_thumbnail(
-                    (temp_file, temp_file, temp_file),
-                    out_file,
-                    static_stretch=stretch,
+            dataset: DatasetReader
+            if dataset.count != 1:
+                raise NotImplementedError(
+                    "multi-band measurement files aren't yet supported"
                 )
-            else:
-                # Use three different files
-                temp_files = tuple(Path(temp_dir) / f"temp_{i}.tif" for i in range(3))
-
-                for i in range(3):
-                    with rasterio.open(temp_files[i], "w", **meta) as tmpdataset:
-                        tmpdataset.write(out_data[i])
-                self.create_thumbnail(temp_files, out_file, static_stretch=stretch)
+            data = dataset.read(1)
+            input_geobox = GridSpec.from_rio(dataset)
+            nodata = dataset.nodata
+
+        # Only the final jpeg touches the disk.
+        out_file.write_bytes(
+            self.create_thumbnail_singleband_from_numpy(
+                data,
+                bit=bit,
+                lookup_table=lookup_table,
+                input_geobox=input_geobox,
+                nodata=nodata,
+            )
+        )
 
     def create_thumbnail_singleband_from_numpy(
         self,
@@ -1074,6 +1487,7 @@ def _write_to_numpy_array(
     percentile_range: Tuple[int, int] = (2, 98),
     input_geobox: GridSpec = None,
     nodata: int = -999,
+    percentile_sample_size: Optional[int] = None,
 ) -> GridSpec:
     """
     Write an intensity-scaled wgs84 image using the given files as bands.
@@ -1117,7 +1531,10 @@ def _write_to_numpy_array(
     # Calculate combined nodata mask
     valid_data_mask = numpy.ones(input_geobox.shape, dtype="bool")
     calculated_range = read_valid_mask_and_value_range(
-        valid_data_mask, _iter_arrays(rgb, nodata=nodata), percentile_range
+        valid_data_mask,
+        _iter_arrays(rgb, nodata=nodata),
+        percentile_range,
+        percentile_sample_size=percentile_sample_size,
     )
 
     output_list = []
@@ -1157,29 +1574,21 @@ def _write_quicklook(
     static_range: Tuple[int, int],
     percentile_range: Tuple[int, int] = (2, 98),
     input_geobox: GridSpec = None,
+    percentile_sample_size: Optional[int] = None,
+    max_cache_bytes: int = 0,
 ) -> GridSpec:
     """
     Write an intensity-scaled wgs84 image using the given files as bands.
+
+    :param max_cache_bytes: How much memory to use holding the decoded bands
+                            between calculating the stretch and writing, rather than
+                            reading them twice. (default: none)
     """
     if input_geobox is None:
         with rasterio.open(rgb[0]) as ds:
             input_geobox = GridSpec.from_rio(ds)
 
-    out_crs = CRS.from_epsg(4326)
-    (
-        reprojected_transform,
-        reprojected_width,
-        reprojected_height,
-    ) = calculate_default_transform(
-        input_geobox.crs,
-        out_crs,
-        input_geobox.shape[1],
-        input_geobox.shape[0],
-        *input_geobox.bounds,
-    )
-    reproj_grid = GridSpec(
-        (reprojected_height, reprojected_width), reprojected_transform, crs=out_crs
-    )
+    reproj_grid = _reprojected_grid(input_geobox)
     ql_write_args = dict(
         driver="GTiff",
         dtype="uint8",
@@ -1201,13 +1610,18 @@ def _write_quicklook(
     with rasterio.open(dest_path, "w", **ql_write_args) as ql_ds:
         ql_ds: DatasetWriter
 
+        bands = _ImageCache(rgb, max_cache_bytes)
+
         # Calculate combined nodata mask
         valid_data_mask = numpy.ones(input_geobox.shape, dtype="bool")
         calculated_range = read_valid_mask_and_value_range(
-            valid_data_mask, _iter_images(rgb), percentile_range
+            valid_data_mask,
+            bands.read(),
+            percentile_range,
+            percentile_sample_size=percentile_sample_size,
         )
 
-        for band_no, (image, nodata) in enumerate(_iter_images(rgb), start=1):
+        for band_no, (image, nodata) in enumerate(bands.reread(), start=1):
             reprojected_data = numpy.zeros(reproj_grid.shape, dtype=numpy.uint8)
             reproject(
                 rescale_intensity(
@@ -1233,23 +1647,185 @@ def _write_quicklook(
     return reproj_grid
 
 
+def _write_thumbnail_from_overviews(
+    rgb: Sequence[Path],
+    out: Path,
+    out_scale: int,
+    resampling: Resampling,
+    static_range: Tuple[int, int],
+    percentile_range: Tuple[int, int] = (2, 98),
+    compress_quality: int = 85,
+    input_geobox: GridSpec = None,
+    percentile_sample_size: Optional[int] = None,
+):
+    """
+    Write a thumbnail jpg by reading the given files at their closest overview level,
+    and reprojecting them directly to the thumbnail grid.
+    """
+    if input_geobox is None:
+        with rasterio.open(rgb[0]) as ds:
+            input_geobox = GridSpec.from_rio(ds)
+
+    thumb_grid = _thumbnail_grid(_reprojected_grid(input_geobox), out_scale)
+
+    # Read at the coarsest overview that's still no coarser than the thumbnail.
+    with rasterio.open(rgb[0]) as ds:
+        factor = max((f for f in ds.overviews(1) if f <= out_scale), default=1)
+    height, width = input_geobox.shape
+    read_shape = (-(-height // factor), -(-width // factor))
+    read_transform = input_geobox.transform * Affine.scale(
+        width / read_shape[1], height / read_shape[0]
+    )
+    bands = list(_iter_images(rgb, out_shape=read_shape))
+
+    valid_data_mask = numpy.ones(read_shape, dtype="bool")
+    calculated_range = read_valid_mask_and_value_range(
+        valid_data_mask,
+        bands,
+        percentile_range,
+        percentile_sample_size=percentile_sample_size,
+    )
+
+    with rasterio.open(
+        out, "w", **_thumbnail_args(thumb_grid, compress_quality)
+    ) as thumb_ds:
+        thumb_ds: DatasetWriter
+        for band_no, (image, nodata) in enumerate(bands, start=1):
+            thumb_data = numpy.zeros(thumb_grid.shape, dtype=numpy.uint8)
+            reproject(
+                rescale_intensity(
+                    image,
+                    image_null_mask=~valid_data_mask,
+                    in_range=(static_range or calculated_range),
+                    out_range=(1, 255),
+                    out_dtype=numpy.uint8,
+                ),
+                thumb_data,
+                src_crs=input_geobox.crs,
+                src_transform=read_transform,
+                src_nodata=0,
+                dst_crs=thumb_grid.crs,
+                dst_nodata=0,
+                dst_transform=thumb_grid.transform,
+                resampling=resampling,
+                num_threads=2,
+            )
+            thumb_ds.write(thumb_data, band_no)
+
+
+def _reprojected_grid(input_geobox: GridSpec) -> GridSpec:
+    """The full-resolution wgs84 grid of a quicklook for the given grid"""
+    out_crs = CRS.from_epsg(4326)
+    (
+        reprojected_transform,
+        reprojected_width,
+        reprojected_height,
+    ) = calculate_default_transform(
+        input_geobox.crs,
+        out_crs,
+        input_geobox.shape[1],
+        input_geobox.shape[0],
+        *input_geobox.bounds,
+    )
+    return GridSpec(
+        (reprojected_height, reprojected_width), reprojected_transform, crs=out_crs
+    )
+
+
+def _thumbnail_grid(ql_grid: GridSpec, out_scale: int) -> GridSpec:
+    """The grid of a thumbnail, scaled down from the quicklook grid"""
+    out_crs = ql_grid.crs
+    (
+        thumb_transform,
+        thumb_width,
+        thumb_height,
+    ) = calculate_default_transform(
+        out_crs,
+        out_crs,
+        ql_grid.shape[1],
+        ql_grid.shape[0],
+        *ql_grid.bounds,
+        dst_width=ql_grid.shape[1] // out_scale,
+        dst_height=ql_grid.shape[0] // out_scale,
+    )
+    return GridSpec((thumb_height, thumb_width), thumb_transform, crs=out_crs)
+
+
+def _thumbnail_args(thumb_grid: GridSpec, compress_quality: int) -> Dict:
+    return dict(
+        driver="JPEG",
+        quality=compress_quality,
+        height=thumb_grid.shape[0],
+        width=thumb_grid.shape[1],
+        count=3,
+        dtype="uint8",
+        nodata=0,
+        transform=thumb_grid.transform,
+        crs=thumb_grid.crs,
+    )
+
+
 LazyImages = Iterable[Tuple[numpy.ndarray, int]]
 
 
-def _iter_images(rgb: Sequence[Path]) -> LazyImages:
+def _iter_images(
+    rgb: Sequence[Path], out_shape: Optional[Tuple[int, int]] = None
+) -> LazyImages:
     """
     Lazily load a series of single-band images from a path.
 
     Yields the image array and nodata value.
+
+    :param out_shape: Read at a reduced resolution (GDAL will use overviews, if available)
     """
     for path in rgb:
-        with rasterio.open(path) as ds:
-            ds: DatasetReader
-            if ds.count != 1:
-                raise NotImplementedError(
-                    "multi-band measurement files aren't yet supported"
-                )
-            yield ds.read(1), ds.nodata
+        yield _read_image(path, out_shape=out_shape)
+
+
+def _read_image(
+    path: Path, out_shape: Optional[Tuple[int, int]] = None
+) -> Tuple[numpy.ndarray, int]:
+    with rasterio.open(path) as ds:
+        ds: DatasetReader
+        if ds.count != 1:
+            raise NotImplementedError(
+                "multi-band measurement files aren't yet supported"
+            )
+        return ds.read(1, out_shape=out_shape), ds.nodata
+
+
+class _ImageCache:
+    """
+    Read a series of single-band images twice, but only decode them once.
+
+    Images are held between reads while they fit within ``max_bytes``, and
+    any others are read again from disk.
+    """
+
+    def __init__(self, paths: Sequence[Path], max_bytes: int):
+        self._paths = list(paths)
+        self._remaining_bytes = max_bytes
+        self._images: Dict[Path, Tuple[numpy.ndarray, int]] = {}
+
+    def read(self) -> LazyImages:
+        """Read the images, holding them for :meth:`reread` if they fit."""
+        for path in self._paths:
+            image = self._images.get(path)
+            if image is None:
+                image = _read_image(path)
+                if image[0].nbytes <= self._remaining_bytes:
+                    self._images[path] = image
+                    self._remaining_bytes -= image[0].nbytes
+            yield image
+
+    def reread(self) -> LazyImages:
+        """Read the images again, releasing each after its last use."""
+        for i, path in enumerate(self._paths):
+            if path in self._paths[i + 1 :]:
+                image = self._images.get(path)
+            else:
+                image = self._images.pop(path, None)
+            yield image or _read_image(path)
 
 
 def _iter_arrays(rgb: Sequence[numpy.array], nodata: int) -> LazyImages:
@@ -1266,28 +1842,34 @@ def read_valid_mask_and_value_range(
     valid_data_mask: numpy.ndarray,
     images: LazyImages,
     calculate_percentiles: Optional[Tuple[int, int]] = None,
+    percentile_sample_size: Optional[int] = None,
 ) -> Optional[Tuple[int, int]]:
     """
     Read the given images, filling in a valid data mask and optional pixel percentiles.
+
+    Percentiles of 8 and 16 bit integer images are counted exactly from a histogram.
+    For other types, ``percentile_sample_size`` can be given to estimate them from
+    an evenly-spaced sample of (about) that many pixels, rather than from every pixel.
     """
     calculated_range = (-sys.maxsize - 1, sys.maxsize)
     for array, nodata in images:
         valid_data_mask &= array != nodata
 
         if calculate_percentiles is not None:
-            the_data = array[valid_data_mask]
-            # Check if there's a non-empty array first
-            if the_data.any():
-                # Numpy changed the 'interpolation' method, but we need to still support the
-                # older Python 3.6 module at NCI.
-                if numpy.__version__ < "1.22":
-                    low, high = numpy.percentile(
-                        the_data, calculate_percentiles, interpolation="nearest"
-                    )
-                else:
-                    low, high = numpy.percentile(
-                        the_data, calculate_percentiles, method="nearest"
-                    )
+            if array.dtype.kind in "ui" and array.dtype.itemsize <= 2:
+                percentiles = _histogram_percentiles(
+                    array, valid_data_mask, calculate_percentiles
+                )
+            else:
+                percentiles = _sampled_percentiles(
+                    array,
+                    valid_data_mask,
+                    calculate_percentiles,
+                    percentile_sample_size,
+                )
+
+            if percentiles is not None:
+                low, high = percentiles
                 calculated_range = (
                     max(low, calculated_range[0]),
                     min(high, calculated_range[1]),
@@ -1296,6 +1878,71 @@ def read_valid_mask_and_value_range(
     return calculated_range
 
 
+def _sampled_percentiles(
+    array: numpy.ndarray,
+    valid_data_mask: numpy.ndarray,
+    percentiles: Tuple[int, int],
+    sample_size: Optional[int] = None,
+) -> Optional[Tuple]:
+    """
+    The (nearest) percentile values of the valid pixels, or None if they're all zero.
+    """
+    if sample_size and array.size > sample_size:
+        step = -(-array.size // sample_size)
+        the_data = array.ravel()[::step][valid_data_mask.ravel()[::step]]
+    else:
+        the_data = array[valid_data_mask]
+
+    # Check if there's a non-empty array first
+    if not the_data.any():
+        return None
+
+    # Numpy changed the 'interpolation' method, but we need to still support the
+    # older Python 3.6 module at NCI.
+    if numpy.__version__ < "1.22":
+        return tuple(numpy.percentile(the_data, percentiles, interpolation="nearest"))
+    return tuple(numpy.percentile(the_data, percentiles, method="nearest"))
+
+
+def _histogram_percentiles(
+    array: numpy.ndarray,
+    valid_data_mask: numpy.ndarray,
+    percentiles: Tuple[int, int],
+) -> Optional[Tuple]:
+    """
+    The (nearest) percentile values of the valid pixels of an 8 or 16 bit integer
+    image, or None if they're all zero.
+
+    Identical to :func:`numpy.percentile`, but counts every possible value rather
+    than copying and partially-sorting the valid pixels.
+    """
+    dtype = array.dtype
+    bin_count = 256**dtype.itemsize
+    # Count unsigned values, a strip of rows at a time.
+    values = array.view(f"u{dtype.itemsize}")
+    histogram = numpy.zeros(bin_count, dtype=numpy.int64)
+    for row in range(0, array.shape[0], _MASK_STRIP_ROWS):
+        strip = slice(row, row + _MASK_STRIP_ROWS)
+        histogram += numpy.bincount(
+            values[strip][valid_data_mask[strip]], minlength=bin_count
+        )
+
+    min_value = numpy.iinfo(dtype).min
+    if min_value < 0:
+        # Negative values were counted after the positives. Put them in order.
+        histogram = numpy.roll(histogram, bin_count // 2)
+
+    pixel_count = histogram.sum()
+    # Are there any non-zero pixels?
+    if pixel_count == histogram[-min_value]:
+        return None
+
+    # The same rank as numpy's "nearest" method.
+    ranks = numpy.around((pixel_count - 1) * (numpy.asarray(percentiles) / 100))
+    positions = numpy.searchsorted(histogram.cumsum(), ranks, side="right")
+    return tuple(dtype.type(position + min_value) for position in positions)
+
+
 def rescale_intensity(
     image: numpy.ndarray,
     in_range: Tuple[int, int],
@@ -1318,6 +1965,25 @@ def rescale_intensity(
     imin, imax = in_range
     omin, omax = out_range or (numpy.iinfo(out_dtype).min, numpy.iinfo(out_dtype).max)
 
+    if image.dtype.kind in "ui" and image.size > 256**image.dtype.itemsize:
+        # There are fewer possible values than pixels, so calculate each value
+        # once and look them up, rather than calculating every pixel in floats.
+        unsigned_dtype = numpy.dtype(f"u{image.dtype.itemsize}")
+        all_values = numpy.arange(
+            numpy.iinfo(unsigned_dtype).max + 1, dtype=unsigned_dtype
+        ).view(image.dtype)
+        lookup_table = _rescale_values(all_values, imin, imax, omin, omax, out_dtype)
+        image = lookup_table.take(image.view(unsigned_dtype))
+    else:
+        image = _rescale_values(image, imin, imax, omin, omax, out_dtype)
+
+    image[image_null_mask] = out_nodata
+    return image
+
+
+def _rescale_values(
+    image: numpy.ndarray, imin, imax, omin, omax, out_dtype
+) -> numpy.ndarray:
     # The intermediate calculation will need floats.
     # We'll convert to it immediately to avoid modifying the input array
     image = image.astype(numpy.float64)
@@ -1327,6 +1993,4 @@ def rescale_intensity(
     image /= float(imax - imin)
     image *= omax - omin
     image += omin
-    image = image.astype(out_dtype)
-    image[image_null_mask] = out_nodata
-    return image
+    return image.astype(out_dtype)
@@ -19,6 +19,7 @@ class FileFormat(Enum):
     NetCDF = 2
     Zarr = 3
     JPEG2000 = 4
+    HDF5 = 5
 
 
 def nest_properties(d: Mapping[str, Any], separator=":") -> Dict[str, Any]:
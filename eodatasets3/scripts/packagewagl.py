@@ -6,8 +6,10 @@ GeoTIFFS (COGs) with datacube metadata using the DEA naming conventions
 for files.
 """
 
+import sys
+import time
 from pathlib import Path
-from typing import Optional, Sequence
+from typing import Dict, List, Optional, Sequence
 
 import click
 import rasterio
@@ -82,17 +84,58 @@ DEFAULT_MATURITY = wagl.ProductMaturity.stable
     type=float,
     default=None,
 )
-@click.argument("h5_file", type=PathPath(exists=True, readable=True, writable=False))
+@click.option(
+    "-j",
+    "--jobs",
+    "workers",
+    help="Number of granules to package in parallel, each in its own process, "
+    "sharing the CPUs between them. A failed granule won't stop the others (default: 1)",
+    type=click.IntRange(min=1),
+    default=1,
+)
+@click.option(
+    "--band-workers",
+    help="Number of bands to write at once within each granule, in threads, "
+    "sharing the granule's CPUs between them (default: one at a time)",
+    type=click.IntRange(min=1),
+    default=None,
+)
+@click.option(
+    "--resumable/--no-resumable",
+    help="Keep the work folder of a granule that fails part-way through, and reuse its "
+    "finished bands when run again (default: false)",
+    is_flag=True,
+    default=False,
+)
+@click.option(
+    "--reference-hdf5/--write-cogs",
+    "reference_hdf5",
+    help="Write only metadata, with measurements referencing the bands in the HDF5 file, "
+    "rather than converting them to COGs. Bands with quality-masked pixels are still "
+    "written as COGs (default: write COGs)",
+    is_flag=True,
+    default=False,
+)
+@click.argument(
+    "h5_files",
+    type=PathPath(exists=True, readable=True, writable=False),
+    nargs=-1,
+    required=True,
+)
 def run(
     level1: Path,
     output: Path,
-    h5_file: Path,
+    h5_files: Sequence[Path],
     products: Sequence[str],
     with_oa: bool,
     product_maturity: wagl.ProductMaturity,
     allow_missing_provenance: bool,
     oa_resolution: Optional[float],
     contiguity_resolution: Optional[float],
+    workers: int,
+    band_workers: Optional[int],
+    resumable: bool,
+    reference_hdf5: bool,
 ):
     if products:
         products = {p.lower() for p in products}
@@ -104,12 +147,32 @@ def run(
     if contiguity_resolution is not None:
         contiguity_resolution = (contiguity_resolution, contiguity_resolution)
 
-    with rasterio.Env(GDAL_PAM_ENABLED=False):
+    granules = (
+        granule
+        for h5_file in h5_files
         for granule in wagl.Granule.for_path(
             h5_file,
             level1_metadata_path=level1,
             allow_missing_provenance=allow_missing_provenance,
-        ):
+        )
+    )
+    package_args = dict(
+        product_maturity=product_maturity,
+        included_products=products,
+        include_oa=with_oa,
+        oa_resolution=oa_resolution,
+        contiguity_resolution=contiguity_resolution,
+        max_workers=band_workers,
+        resumable=resumable,
+        reference_hdf5=reference_hdf5,
+    )
+
+    if workers > 1:
+        _package_in_parallel(output, list(granules), workers, package_args)
+        return
+
+    with rasterio.Env(GDAL_PAM_ENABLED=False):
+        for granule in granules:
             with wagl.do(
                 f"Packaging {granule.name}. (products: {', '.join(products)})",
                 heading=True,
@@ -119,16 +182,51 @@ def run(
                 oa=with_oa,
             ):
                 dataset_id, dataset_path = wagl.package(
-                    out_directory=output,
-                    granule=granule,
-                    product_maturity=product_maturity,
-                    included_products=products,
-                    include_oa=with_oa,
-                    oa_resolution=oa_resolution,
-                    contiguity_resolution=contiguity_resolution,
+                    out_directory=output, granule=granule, **package_args
                 )
                 secho(f"Created folder {click.style(str(dataset_path), fg='green')}")
 
 
+def _package_in_parallel(
+    output: Path, granules: List[wagl.Granule], workers: int, package_args: Dict
+):
+    """
+    Package granules in a pool of processes, reporting each as it finishes.
+
+    Exits with an error code if any failed.
+    """
+    secho(f"Packaging {len(granules)} granules with {workers} workers", bold=True)
+    start_time = time.perf_counter()
+    failures = []
+    for result in wagl.package_granules(
+        output,
+        granules,
+        workers=workers,
+        gdal_options=dict(GDAL_PAM_ENABLED=False),
+        **package_args,
+    ):
+        if result.error:
+            failures.append(result)
+            secho(
+                f"Failed {result.granule_name} after {result.seconds:.1f}s:\n{result.error}",
+                fg="red",
+            )
+        else:
+            secho(
+                f"Created folder {click.style(str(result.metadata_path), fg='green')} "
+                f"({result.granule_name}, {result.seconds:.1f}s)"
+            )
+
+    secho(
+        f"Packaged {len(granules) - len(failures)} of {len(granules)} granules "
+        f"in {time.perf_counter() - start_time:.1f}s",
+        fg="red" if failures else None,
+    )
+    for result in failures:
+        secho(f"    Failed: {result.granule_name}", fg="red")
+    if failures:
+        sys.exit(1)
+
+
 if __name__ == "__main__":
     run()
@@ -10,17 +10,21 @@ We also append a checksum file at the end of the tar.
 
 import copy
 import io
+import multiprocessing
 import socket
 import stat
 import sys
 import tarfile
 import tempfile
+import time
 import traceback
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from contextlib import suppress
 from functools import partial
 from itertools import chain
 from pathlib import Path
-from typing import IO, Callable, Dict, Iterable, List, Tuple
+from typing import IO, Callable, Deque, Dict, Iterable, List, Optional, Tuple
 
 import click
 import numpy
@@ -33,6 +37,7 @@ from structlog.processors import (
     format_exc_info,
 )
 
+from eodatasets3.images import available_cpu_count
 from eodatasets3.ui import PathPath
 from eodatasets3.verify import PackageChecksum
 
@@ -52,6 +57,13 @@ _PREDICTOR_TABLE = {
 # The info of a file, and a method to open the file for reading.
 ReadableMember = Tuple[tarfile.TarInfo, Callable[[], IO]]
 
+# The info of an output file, and its contents (None for a directory).
+RecompressedMember = Tuple[tarfile.TarInfo, Optional[bytes]]
+
+# How many bytes of members (by their input size) may be held in memory at once,
+# waiting to be recompressed or written.
+DEFAULT_MAX_IN_FLIGHT_BYTES = 1024 * 1024 * 1024
+
 _LOG = structlog.get_logger()
 
 
@@ -102,10 +114,13 @@ def _create_tarinfo(path: Path, name=None) -> tarfile.TarInfo:
 
 
 def _tar_members(in_tar: tarfile.TarFile) -> Iterable[ReadableMember]:
-    """Get readable files (members) from a tar"""
-    members: List[tarfile.TarInfo] = in_tar.getmembers()
+    """
+    Get readable files (members) from a tar, as they're reached.
 
-    for member in members:
+    The tar may be a stream (opened with mode ``r|*``): each member must then be read
+    before asking for the next.
+    """
+    for member in in_tar:
         # We return a lambda/callable so that the file isn't opened until it's needed.
         yield member, partial(in_tar.extractfile, member)
 
@@ -149,20 +164,16 @@ def repackage_tar(
         return True
 
     try:
-        members = list(input_files)
-
-        # Add the MTL file to the beginning of the output tar, so it can be accessed faster.
-        # This slows down this repackage a little, as we're seeking/decompressing the input stream an extra time.
-        _reorder_tar_members(members, input_path.name)
-
-        _create_tar_with_files(input_path, members, output_tar_path, **compress_args)
+        members = _create_tar_with_files(
+            input_path, input_files, output_tar_path, **compress_args
+        )
 
         log.info(
             "complete",
-            in_size=sum(m.size for m, _ in members),
+            in_size=sum(m.size for m in members),
             in_count=len(members),
             # The user/group give us a hint as to whether this was repackaged outside of USGS.
-            in_users=list({(member.uname, member.gname) for member, _ in members}),
+            in_users=list({(member.uname, member.gname) for member in members}),
             out_size=output_tar_path.stat().st_size,
         )
 
@@ -182,14 +193,27 @@ def repackage_tar(
 
 def _create_tar_with_files(
     input_path: Path,
-    members: List[ReadableMember],
+    members: Iterable[ReadableMember],
     output_tar_path: Path,
+    workers: int = 1,
+    max_in_flight_bytes: int = DEFAULT_MAX_IN_FLIGHT_BYTES,
     **compress_args,
-) -> None:
+) -> List[tarfile.TarInfo]:
     """
     Package and compress the given input files to a new tar path.
 
+    The input files are read once, in order, so they can come from a stream.
+
+    The MTL file is put at the beginning of the output tar, so it can be accessed faster.
+    Members that come before it in the input are spooled to a temporary file until it's
+    written.
+
     The output tar path is written atomically, so on failure it will only exist if complete.
+
+    Returns the input members.
+
+    :param workers: How many members to recompress at once. (see :func:`_recompress_members`)
+    :param max_in_flight_bytes: How many bytes of members to hold in memory at once.
     """
 
     out_dir: Path = output_tar_path.parent
@@ -202,25 +226,45 @@ def _create_tar_with_files(
         tmpdir = Path(tmpdir).absolute()
         tmp_out_tar = tmpdir.joinpath(output_tar_path.name)
 
-        with tarfile.open(tmp_out_tar, "w") as out_tar:
+        input_members: List[tarfile.TarInfo] = []
+        # The members waiting for the MTL, and whether they have contents in the spool.
+        spooled_members: Optional[List[Tuple[tarfile.TarInfo, bool]]] = []
+
+        with tarfile.open(tmp_out_tar, "w") as out_tar, tempfile.TemporaryFile(
+            dir=tmpdir
+        ) as spool:
             with click.progressbar(
+                _recompress_members(
+                    members,
+                    compress_args,
+                    workers=workers,
+                    max_in_flight_bytes=max_in_flight_bytes,
+                ),
                 label=input_path.name,
-                length=sum(member.size for member, _ in members),
                 file=sys.stderr,
+                item_show_func=lambda item: item[0].name if item else None,
             ) as progress:
-                file_number = 0
-                for readable_member in members:
-                    file_number += 1
-                    progress.label = (
-                        f"{input_path.name} ({file_number:2d}/{len(members)})"
-                    )
-
-                    _recompress_tar_member(
-                        readable_member, out_tar, compress_args, verify, tmpdir
-                    )
-
-                    member, _ = readable_member
-                    progress.update(member.size)
+                for member, (new_member, contents) in progress:
+                    input_members.append(member)
+
+                    if spooled_members is None:
+                        _add_tar_member(out_tar, new_member, contents, verify, tmpdir)
+                    elif _is_mtl(member):
+                        _add_tar_member(out_tar, new_member, contents, verify, tmpdir)
+                        spool.seek(0)
+                        for spooled_member, has_contents in spooled_members:
+                            out_tar.addfile(
+                                spooled_member, spool if has_contents else None
+                            )
+                        spooled_members = None
+                    else:
+                        spooled_members.append((new_member, contents is not None))
+                        if contents is not None:
+                            spool.write(contents)
+                            verify.add(io.BytesIO(contents), tmpdir / new_member.name)
+
+            if spooled_members is not None:
+                raise _no_mtl_error(input_path.name, input_members)
 
             # Append sha1 checksum file
             checksum_path = tmpdir / "package.sha1"
@@ -234,24 +278,81 @@ def _create_tar_with_files(
             # Our output tar is complete. Move it into place.
             tmp_out_tar.rename(output_tar_path)
 
+    return input_members
 
-def _recompress_tar_member(
-    readable_member: ReadableMember,
-    out_tar: tarfile.TarFile,
+
+def _recompress_members(
+    members: Iterable[ReadableMember],
     compress_args: Dict,
-    verify: PackageChecksum,
-    tmpdir: Path,
-):
-    member, open_member = readable_member
+    workers: int = 1,
+    max_in_flight_bytes: int = DEFAULT_MAX_IN_FLIGHT_BYTES,
+) -> Iterable[Tuple[tarfile.TarInfo, RecompressedMember]]:
+    """
+    Recompress the members in a pool of threads, returning each input member with
+    its recompressed output, in their original order.
+
+    Members are read one at a time (an input tar can only be read serially), then
+    recompressed in memory concurrently. Reading pauses while the members in memory
+    (by input size) would exceed ``max_in_flight_bytes``, until the earliest is returned.
+    (A member larger than the limit is still read, once it's alone.)
+    """
+    in_flight: Deque[Tuple[tarfile.TarInfo, Future]] = deque()
+    in_flight_bytes = 0
+    with ThreadPoolExecutor(
+        max_workers=workers, thread_name_prefix="recompress"
+    ) as pool:
+        try:
+            for member, open_member in members:
+                while in_flight and in_flight_bytes + member.size > max_in_flight_bytes:
+                    done_member, future = in_flight.popleft()
+                    in_flight_bytes -= done_member.size
+                    yield done_member, future.result()
+
+                contents = None
+                if member.size:
+                    with open_member() as input_fp:
+                        contents = input_fp.read()
+                in_flight.append(
+                    (
+                        member,
+                        pool.submit(
+                            _recompress_member, member, contents, compress_args
+                        ),
+                    )
+                )
+                in_flight_bytes += member.size
+
+            while in_flight:
+                done_member, future = in_flight.popleft()
+                yield done_member, future.result()
+        finally:
+            # If we've stopped early, don't bother with the rest.
+            for _, future in in_flight:
+                future.cancel()
+
+
+def _recompress_member(
+    member: tarfile.TarInfo,
+    contents: Optional[bytes],
+    compress_args: Dict,
+) -> RecompressedMember:
+    """
+    Compress a member's contents, if it's an uncompressed tif.
 
+    (It's safe to call from multiple threads.)
+    """
     new_member = copy.copy(member)
     # Copy with a minimum 664 permission, which is used by USGS tars.
     # (some of our repacked datasets have only user read permission.)
     new_member.mode = new_member.mode | 0o664
 
+    if contents is None:
+        # Typically a directory entry.
+        return new_member, None
+
     # If it's a tif, check whether it's compressed.
     if member.name.lower().endswith(".tif"):
-        with open_member() as input_fp, rasterio.open(input_fp) as ds:
+        with rasterio.MemoryFile(contents) as input_file, input_file.open() as ds:
             if not ds.profile.get("compress"):
                 # No compression: let's compress it
                 with rasterio.MemoryFile(filename=member.name) as memory_file:
@@ -259,28 +360,34 @@ def _recompress_tar_member(
                         _recompress_image(ds, memory_file, **compress_args)
                     except Exception as e:
                         raise RecompressFailure(f"Error during {member.name}") from e
-                    new_member.size = memory_file.getbuffer().nbytes
-                    out_tar.addfile(new_member, memory_file)
-
-                    # Image has been written. Seek to beginning to take a checksum.
+                    # Image has been written. Seek to beginning to read it back.
                     memory_file.seek(0)
-                    verify.add(memory_file, tmpdir / new_member.name)
-                    return
+                    contents = memory_file.read()
+                    new_member.size = len(contents)
             else:
-                # It's already compressed, we'll fall through and copy it verbatim.
+                # It's already compressed, we'll copy it verbatim.
                 pass
 
-    if member.size == 0:
-        # Typically a directory entry.
+    # Otherwise, it's copied unchanged (typically text/metadata files).
+    return new_member, contents
+
+
+def _add_tar_member(
+    out_tar: tarfile.TarFile,
+    new_member: tarfile.TarInfo,
+    contents: Optional[bytes],
+    verify: PackageChecksum,
+    tmpdir: Path,
+):
+    """
+    Append a (recompressed) member to the output tar, and to our checksums.
+    """
+    if contents is None:
         out_tar.addfile(new_member)
         return
 
-    # Copy unchanged into target (typically text/metadata files).
-    with open_member() as member:
-        file_contents = member.read()
-    out_tar.addfile(new_member, io.BytesIO(file_contents))
-    verify.add(io.BytesIO(file_contents), tmpdir / new_member.name)
-    del file_contents
+    out_tar.addfile(new_member, io.BytesIO(contents))
+    verify.add(io.BytesIO(contents), tmpdir / new_member.name)
 
 
 def _reorder_tar_members(members: List[ReadableMember], identifier: str):
@@ -289,20 +396,28 @@ def _reorder_tar_members(members: List[ReadableMember], identifier: str):
     """
     # Find MTL
     for i, (member, _) in enumerate(members):
-        if "_MTL" in member.path:
+        if _is_mtl(member):
             mtl_index = i
             break
     else:
-        formatted_members = "\n\t".join(m.name for m, _ in members)
-        raise ValueError(
-            f"No MTL file found in package {identifier}. Have:\n\t{formatted_members}"
-        )
+        raise _no_mtl_error(identifier, [m for m, _ in members])
 
     # Move to front
     mtl_item = members.pop(mtl_index)
     members.insert(0, mtl_item)
 
 
+def _is_mtl(member: tarfile.TarInfo) -> bool:
+    return "_MTL" in member.path
+
+
+def _no_mtl_error(identifier: str, members: List[tarfile.TarInfo]) -> ValueError:
+    formatted_members = "\n\t".join(m.name for m in members)
+    return ValueError(
+        f"No MTL file found in package {identifier}. Have:\n\t{formatted_members}"
+    )
+
+
 def _recompress_image(
     input_image: rasterio.DatasetReader,
     output_fp: rasterio.MemoryFile,
@@ -359,6 +474,28 @@ def _recompress_image(
     default=False,
     help="Delete originals after repackaging",
 )
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Number of paths to repackage at once, each in its own process",
+    show_default=True,
+)
+@click.option(
+    "--threads",
+    type=click.IntRange(min=1),
+    default=None,
+    help="Number of tar members to recompress at once within each job "
+    "(default: share the CPUs between jobs)",
+)
+@click.option(
+    "--max-in-flight-mb",
+    type=click.IntRange(min=1),
+    default=DEFAULT_MAX_IN_FLIGHT_BYTES // (1024 * 1024),
+    help="Most megabytes of input members to hold in memory at once",
+    show_default=True,
+)
 @click.option("-f", "input_file", help="Read paths from file", type=click.File("r"))
 @click.argument("paths", nargs=-1, type=PathPath(exists=True, readable=True))
 def main(
@@ -368,16 +505,11 @@ def main(
     zlevel: int,
     clean_inputs: bool,
     block_size: int,
+    jobs: int,
+    threads: Optional[int],
+    max_in_flight_mb: int,
 ):
-    # Structured (json) logging goes to stdout
-    structlog.configure(
-        processors=[
-            StackInfoRenderer(),
-            format_exc_info,
-            TimeStamper(utc=False, fmt="iso"),
-            JSONRenderer(),
-        ]
-    )
+    _configure_logging()
 
     if (not output_base) and (not clean_inputs):
         raise click.UsageError(
@@ -388,49 +520,150 @@ def main(
     if input_file:
         paths = chain((Path(p.strip()) for p in input_file), paths)
 
-    with rasterio.Env():
-        total = failures = 0
-        for path in paths:
-            total += 1
-
-            # Input is either a tar.gz file, or a directory containing an MTL (already extracted)
-            if path.suffix.lower() == ".gz":
-                with tarfile.open(str(path), "r") as in_tar:
-                    success = repackage_tar(
-                        path,
-                        _tar_members(in_tar),
-                        _output_tar_path(output_base, path),
-                        clean_inputs=clean_inputs,
-                        zlevel=zlevel,
-                        block_size=(block_size, block_size),
-                    )
+    repackage = partial(
+        _repackage_path,
+        output_base=output_base,
+        clean_inputs=clean_inputs,
+        zlevel=zlevel,
+        block_size=(block_size, block_size),
+        workers=threads or max(available_cpu_count() // jobs, 1),
+        max_in_flight_bytes=max_in_flight_mb * 1024 * 1024,
+    )
 
-            elif path.is_dir():
-                success = repackage_tar(
-                    path,
-                    _folder_members(path),
-                    _output_tar_path_from_directory(output_base, path),
-                    clean_inputs=clean_inputs,
-                    zlevel=zlevel,
-                    block_size=(block_size, block_size),
-                )
-            else:
-                raise ValueError(
-                    f"Expected either tar.gz or a dataset folder. " f"Got: {path!r}"
-                )
+    start_time = time.perf_counter()
+    total = failures = in_bytes = out_bytes = 0
+    for success, in_size, out_size in _repackage_paths(paths, repackage, jobs):
+        total += 1
+        if success:
+            in_bytes += in_size
+            out_bytes += out_size
+        else:
+            failures += 1
 
-            if not success:
-                failures += 1
     if total > 1:
+        seconds = time.perf_counter() - start_time
         _LOG.info(
             "node.finish",
             host=socket.getfqdn(),
+            jobs=jobs,
             total_count=total,
             failure_count=failures,
+            in_bytes=in_bytes,
+            out_bytes=out_bytes,
+            seconds=round(seconds, 3),
+            in_bytes_per_second=round(in_bytes / seconds) if seconds else None,
         )
     sys.exit(failures)
 
 
+def _configure_logging():
+    """
+    Structured (json) logging goes to stdout
+    """
+    structlog.configure(
+        processors=[
+            StackInfoRenderer(),
+            format_exc_info,
+            TimeStamper(utc=False, fmt="iso"),
+            JSONRenderer(),
+        ]
+    )
+
+
+def _repackage_paths(
+    paths: Iterable[Path],
+    repackage: Callable[[Path], Tuple[bool, int, int]],
+    jobs: int = 1,
+) -> Iterable[Tuple[bool, int, int]]:
+    """
+    Repackage each path, optionally in a pool of processes.
+
+    Results are returned as each finishes, which may not be the order given.
+    """
+    if jobs == 1:
+        yield from map(repackage, paths)
+        return
+
+    with multiprocessing.Pool(jobs, initializer=_configure_logging) as pool:
+        yield from pool.imap_unordered(repackage, paths)
+        pool.close()
+        pool.join()
+
+
+def _repackage_path(
+    path: Path,
+    output_base: Optional[Path],
+    clean_inputs: bool,
+    **compress_args,
+) -> Tuple[bool, int, int]:
+    """
+    Repackage a path, which is either a tar.gz file, or a directory containing an MTL (already extracted)
+
+    Returns whether it succeeded, and the input and output sizes in bytes. A failure
+    is logged rather than raised, so it doesn't stop the other paths.
+    """
+    in_size = 0
+    try:
+        in_size = _disk_size(path)
+        return _repackage_path_or_fail(
+            path, in_size, output_base, clean_inputs, **compress_args
+        )
+    except Exception:
+        log = _LOG.bind(in_path=str(path.absolute()))
+        log.exception("error", exc_info=True)  # noqa: G202
+        return False, in_size, 0
+
+
+def _repackage_path_or_fail(
+    path: Path,
+    in_size: int,
+    output_base: Optional[Path],
+    clean_inputs: bool,
+    **compress_args,
+) -> Tuple[bool, int, int]:
+    with rasterio.Env():
+        if path.suffix.lower() == ".gz":
+            output_tar_path = _output_tar_path(output_base, path)
+            # Streamed, so it's only decompressed once.
+            with tarfile.open(str(path), "r|*") as in_tar:
+                success = repackage_tar(
+                    path,
+                    _tar_members(in_tar),
+                    output_tar_path,
+                    clean_inputs=clean_inputs,
+                    **compress_args,
+                )
+
+        elif path.is_dir():
+            output_tar_path = _output_tar_path_from_directory(output_base, path)
+            # Files can be read in any order, so the MTL can go first without spooling.
+            members = list(_folder_members(path))
+            _reorder_tar_members(members, path.name)
+            success = repackage_tar(
+                path,
+                members,
+                output_tar_path,
+                clean_inputs=clean_inputs,
+                **compress_args,
+            )
+        else:
+            raise ValueError(
+                f"Expected either tar.gz or a dataset folder. " f"Got: {path!r}"
+            )
+
+    out_size = output_tar_path.stat().st_size if success else 0
+    return success, in_size, out_size
+
+
+def _disk_size(path: Path) -> int:
+    """
+    The size of a file, or of all files in a directory, in bytes.
+    """
+    if path.is_dir():
+        return sum(p.stat().st_size for p in path.rglob("*") if p.is_file())
+    return path.stat().st_size
+
+
 def please_remove(path: Path, excluding: Path):
     """
     Delete all of path, excluding the given path.
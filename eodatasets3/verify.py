@@ -2,6 +2,7 @@ import binascii
 import hashlib
 import logging
 import os
+import threading
 import typing
 from distutils import spawn
 from pathlib import Path
@@ -117,6 +118,8 @@ class PackageChecksum:
 
     def __init__(self):
         self._file_hashes = {}
+        # Files may be added from multiple writer threads.
+        self._lock = threading.Lock()
 
     def add_file(self, file_path):
         """
@@ -172,7 +175,15 @@ class PackageChecksum:
         return hash_
 
     def _append_hash(self, file_path, hash_):
-        self._file_hashes[Path(file_path).absolute()] = hash_
+        with self._lock:
+            self._file_hashes[Path(file_path).absolute()] = hash_
+
+    def get(self, file_path) -> typing.Optional[str]:
+        """
+        Get the checksum of an added file, if any.
+        """
+        with self._lock:
+            return self._file_hashes.get(Path(file_path).absolute())
 
     def add_files(self, file_paths):
         for path in file_paths:
@@ -188,7 +199,7 @@ class PackageChecksum:
             f.writelines(
                 (
                     f"{hash_!s}\t{filename.relative_to(output_file.parent)!s}\n".encode()
-                    for filename, hash_ in sorted(self._file_hashes.items())
+                    for filename, hash_ in sorted(self.items())
                 )
             )
 
@@ -206,7 +217,8 @@ class PackageChecksum:
                 )
 
     def items(self):
-        return self._file_hashes.items()
+        with self._lock:
+            return list(self._file_hashes.items())
 
     def __len__(self):
         return len(self._file_hashes)
@@ -7,16 +7,32 @@ for files.
 """
 
 import contextlib
+import functools
+import multiprocessing
 import os
+import queue
 import re
 import sys
+import threading
+import time
+import traceback
+import warnings
 import zipfile
 from datetime import datetime, timedelta
 from enum import Enum
 from math import isnan
 from os.path import join
 from pathlib import Path
-from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+from typing import (
+    Any,
+    Dict,
+    Generator,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
 from uuid import UUID
 
 import attr
@@ -27,14 +43,13 @@ import rasterio
 from affine import Affine
 from boltons.iterutils import PathAccessError, get_path
 from click import secho
-from rasterio import DatasetReader
 from rasterio.crs import CRS
 from rasterio.enums import Resampling
 
 from eodatasets3 import DatasetAssembler, images, serialise, utils
 from eodatasets3.images import GridSpec
 from eodatasets3.model import DatasetDoc
-from eodatasets3.properties import Eo3Interface
+from eodatasets3.properties import Eo3Interface, FileFormat
 from eodatasets3.serialise import loads_yaml
 from eodatasets3.ui import bool_style
 from eodatasets3.utils import default_utc, flatten_dict
@@ -56,6 +71,11 @@ _THUMBNAILS = {
     "nbart": ("nbart:red", "nbart:green", "nbart:blue"),
 }
 
+# Bands are read ahead of writing in windows of this size, each into a reusable buffer.
+_PREFETCH_WINDOW_BYTES = images.DEFAULT_WINDOW_BYTES // 4
+# How many windows can be waiting to be written.
+_PREFETCH_DEPTH = 2
+
 os.environ["CPL_ZIP_ENCODING"] = "UTF-8"
 
 FILENAME_TIF_BAND = re.compile(
@@ -113,30 +133,50 @@ def _unpack_products(
     product_list: Iterable[str],
     h5group: h5py.Group,
     granule: "Granule",
+    contiguity_masks: Optional["ContiguityMasks"] = None,
+    prefetch_depth: int = _PREFETCH_DEPTH,
+    reference_hdf5: bool = False,
 ) -> None:
     """
     Unpack and package the NBAR and NBART products.
+
+    :param contiguity_masks: Accumulate each product's valid pixels as its bands are written.
+    :param prefetch_depth: Read bands ahead of writing them (see :func:`_read_bands`)
+    :param reference_hdf5: Reference the bands in the hdf5 file, rather than writing them.
+                           (No thumbnails are written, as they're made from the written bands)
     """
     # listing of all datasets of IMAGE CLASS type
     img_paths = _find_h5_paths(h5group, "IMAGE")
 
+    # Products have identical band masks, so we only load each once.
+    quality_masks = QualityMaskCache(granule)
+
     for product in product_list:
         with sub_product(product, p):
-            for pathname in [p for p in img_paths if f"/{product.upper()}/" in p]:
+            for pathname, dataset, quality_mask, tiles in _read_bands(
+                {
+                    pathname: h5group[pathname]
+                    for pathname in img_paths
+                    if f"/{product.upper()}/" in pathname
+                },
+                quality_masks,
+                prefetch_depth=prefetch_depth,
+            ):
                 with do(f"Path {pathname!r}"):
-                    dataset = h5group[pathname]
-                    band_masks = get_quality_masks(dataset, granule)
                     band_name = utils.normalise_band_name(dataset.attrs["alias"])
                     write_measurement_h5(
                         p,
                         f"{product}:{band_name}",
                         dataset,
-                        band_masks=band_masks,
+                        quality_mask=quality_mask,
                         overview_resampling=Resampling.average,
                         file_id=_file_id(dataset),
+                        contiguity_masks=contiguity_masks,
+                        tiles=tiles,
+                        reference_hdf5=reference_hdf5,
                     )
 
-            if product in _THUMBNAILS:
+            if product in _THUMBNAILS and not reference_hdf5:
                 red, green, blue = _THUMBNAILS[product]
                 with do(f"Thumbnailing {product}"):
                     p.write_thumbnail(
@@ -152,6 +192,8 @@ def _unpack_products(
                         path=p.names.thumbnail_filename(),
                     )
 
+    quality_masks.clear()
+
 
 def get_quality_masks(dataset: h5py.Dataset, granule: "Granule") -> BandMasks:
     """
@@ -240,74 +282,371 @@ def raw_mask_offsets_from_granule_xml(granule_metadata_xml: bytes):
     }
 
 
-def load_and_mask_data(g: h5py.Dataset, masks: BandMasks):
-    band_id = g.attrs["band_id"]
+class QualityMaskCache:
+    """
+    Load the quality masks of a granule's bands once, to share them between products.
+
+    (eg. NBAR and NBART bands have identical masks)
+
+    Masks are held bit-packed, up to ``max_bytes`` in total. Any more are loaded each
+    time they're needed.
+    """
+
+    def __init__(self, granule: "Granule", max_bytes: int = 256 * 1024 * 1024):
+        self.granule = granule
+        self.max_bytes = max_bytes
+        # The location of each band's mask, read once from the level 1 metadata.
+        self._band_masks: Optional[BandMasks] = None
+        # Packed masks by band id and grid.
+        self._masks: Dict[Tuple[str, Tuple], Optional[numpy.ndarray]] = {}
+
+    def load(self, dataset: h5py.Dataset) -> Optional[numpy.ndarray]:
+        """
+        Get the (bit-packed) quality mask of a band, if it has one.
+
+        See :func:`load_quality_mask`
+        """
+        band_id = dataset.attrs["band_id"]
+        if band_id not in WAGL_TO_ESA_BAND_NUMBER.keys():
+            return None
+        if self._band_masks is None:
+            self._band_masks = get_quality_masks(dataset, self.granule)
+        if not self._band_masks:
+            return None
+
+        key = (band_id, (dataset.shape, tuple(dataset.attrs["geotransform"])))
+        if key in self._masks:
+            return self._masks[key]
+
+        mask = load_quality_mask(dataset, self._band_masks)
+        mask_bytes = 0 if mask is None else mask.nbytes
+        if mask_bytes <= self.max_bytes - self._held_bytes():
+            self._masks[key] = mask
+        return mask
+
+    def _held_bytes(self) -> int:
+        return sum(mask.nbytes for mask in self._masks.values() if mask is not None)
+
+    def clear(self):
+        """Release all held masks."""
+        self._masks.clear()
+
+
+# How many rows of a quality mask to rasterise at once.
+_MASK_STRIP_ROWS = 1024
+
+
+def load_quality_mask(
+    dataset: h5py.Dataset, masks: BandMasks
+) -> Optional[numpy.ndarray]:
+    """
+    Load the quality mask of a band, if it has one: which of its pixels should be discarded.
+
+    It's bit-packed along each row (see :func:`numpy.packbits`), so that the mask for a
+    full band is much smaller than the band itself.
+    """
+    band_id = dataset.attrs["band_id"]
     esa_band = WAGL_TO_ESA_BAND_NUMBER[band_id]
     if esa_band not in masks:
         # No mask needs to be applied.
-        data_array = g[:] if hasattr(g, "chunks") else g
-        return data_array
+        return None
 
     type_, mask_string_path = masks[esa_band]
     if type_ == "MSK_TECQUA":
-        return mask_h5_vector(
-            g,
-            mask_string_path,
-        )
+        return _load_vector_mask(dataset, mask_string_path)
     elif type_ == "MSK_QUALIT":
-        return mask_h5_raster(
-            g,
-            mask_string_path,
-        )
+        return _load_raster_mask(dataset, mask_string_path)
     else:
         raise ValueError(f"unknown mask type {type_}")
 
 
-def mask_h5_vector(
-    dataset: h5py.Dataset,
-    mask_string_path,
-):
+def _load_vector_mask(
+    dataset: h5py.Dataset, mask_string_path: str
+) -> Optional[numpy.ndarray]:
     """
-    Mask a hdf5 dataset using the gml files provided in the path.
+    Rasterise the gml mask file for a hdf5 dataset.
     """
-    data_array = dataset[:] if hasattr(dataset, "chunks") else dataset
     # Open the gml file
     with fiona.open(mask_string_path) as gml:
         shapes = [feature["geometry"] for feature in gml]
-        if not shapes:
-            return data_array
-        mask_array = rasterio.features.rasterize(
+    if not shapes:
+        return None
+
+    transform = Affine.from_gdal(*dataset.attrs["geotransform"])
+    height, width = dataset.shape
+    packed_mask = numpy.empty((height, -(-width // 8)), dtype=numpy.uint8)
+    # A strip at a time, to avoid holding an unpacked mask of the whole band.
+    for row in range(0, height, _MASK_STRIP_ROWS):
+        mask_strip = rasterio.features.rasterize(
             shapes,
-            out_shape=data_array.shape,
+            out_shape=(min(_MASK_STRIP_ROWS, height - row), width),
             fill=0,
-            transform=Affine.from_gdal(*dataset.attrs["geotransform"]),
+            transform=transform * Affine.translation(0, row),
+        )
+        packed_mask[row : row + _MASK_STRIP_ROWS] = numpy.packbits(
+            mask_strip != 0, axis=1
         )
-        return numpy.where(mask_array == 0, data_array, dataset.attrs["no_data_value"])
+    return packed_mask
 
 
-def mask_h5_raster(
-    dataset: h5py.Dataset,
-    mask_string_path,
-):
+def _load_raster_mask(dataset: h5py.Dataset, mask_string_path: str) -> numpy.ndarray:
     """
-    Mask a hdf5 dataset using the gml files provided in the path.
+    Read the .jp2 mask file for a hdf5 dataset.
     """
-    data_array = dataset[:] if hasattr(dataset, "chunks") else dataset
-
-    # Open the .jp2 file
     with rasterio.open(mask_string_path) as source_ds:
         # Mask layer info:
         # https://sentinel.esa.int/web/sentinel/technical-guides/sentinel-2-msi/level-1c/masks
-        # MSI lost data layer
-        source_layer1 = source_ds.read(3)
-        # MSI degraded data layer
-        source_layer2 = source_ds.read(4)
-        # Mask where missing OR degraded packets
-        source_layer = source_layer1 | source_layer2
-        masked_data = numpy.where(
-            source_layer == 0, data_array, dataset.attrs["no_data_value"]
+        # MSI lost data layer, and MSI degraded data layer.
+        # (Read together, so the jpeg2000 is only decoded once)
+        lost_layer, degraded_layer = source_ds.read((3, 4))
+    if lost_layer.shape != dataset.shape:
+        # It's applied to the band one window at a time, so it must match pixel-for-pixel.
+        raise ValueError(
+            f"Quality mask {mask_string_path!r} has shape {lost_layer.shape}, "
+            f"but its band {dataset.name!r} has shape {dataset.shape}"
         )
-        return masked_data
+    # Mask where missing OR degraded packets
+    lost_layer |= degraded_layer
+    del degraded_layer
+    return numpy.packbits(lost_layer != 0, axis=1)
+
+
+def load_and_mask_data(g: h5py.Dataset, masks: BandMasks):
+    """
+    Read a whole hdf5 band, with its quality mask (if any) applied.
+
+    Deprecated: use :func:`load_quality_mask`, and apply it as the band is read.
+    """
+    warnings.warn(
+        "load_and_mask_data() is deprecated: use load_quality_mask(), which loads "
+        "the mask alone (bit-packed), to apply as the band is read.",
+        category=DeprecationWarning,
+    )
+    return _apply_quality_mask(g, load_quality_mask(g, masks))
+
+
+def mask_h5_vector(dataset: h5py.Dataset, mask_string_path):
+    """
+    Mask a hdf5 dataset using the gml files provided in the path.
+
+    Deprecated: use :func:`load_quality_mask`
+    """
+    warnings.warn(
+        "mask_h5_vector() is deprecated: use load_quality_mask()",
+        category=DeprecationWarning,
+    )
+    return _apply_quality_mask(
+        dataset, _load_vector_mask(dataset, str(mask_string_path))
+    )
+
+
+def mask_h5_raster(dataset: h5py.Dataset, mask_string_path):
+    """
+    Mask a hdf5 dataset using the jp2 mask file provided in the path.
+
+    Deprecated: use :func:`load_quality_mask`
+    """
+    warnings.warn(
+        "mask_h5_raster() is deprecated: use load_quality_mask()",
+        category=DeprecationWarning,
+    )
+    return _apply_quality_mask(
+        dataset, _load_raster_mask(dataset, str(mask_string_path))
+    )
+
+
+def _apply_quality_mask(
+    dataset: h5py.Dataset, packed_mask: Optional[numpy.ndarray]
+) -> numpy.ndarray:
+    """
+    Read a whole band, setting it to nodata where the (bit-packed) quality mask is set.
+    """
+    if packed_mask is None:
+        return dataset[:] if hasattr(dataset, "chunks") else dataset
+
+    # A copy, as we modify it.
+    data_array = numpy.array(dataset)
+    height, width = data_array.shape
+    [(_, masked)] = _masked_tiles(
+        [(((0, height), (0, width)), data_array)],
+        packed_mask,
+        _quality_mask_nodata(dataset),
+    )
+    return masked
+
+
+def _quality_mask_nodata(dataset: h5py.Dataset):
+    """
+    The value to set a band's quality-masked pixels to: its nodata.
+    """
+    nodata = dataset.attrs.get("no_data_value")
+    if nodata is None:
+        raise ValueError(
+            f"Can't apply a quality mask to {dataset.name!r}: "
+            f"it has no nodata value to set the masked pixels to"
+        )
+    return nodata
+
+
+def _iter_h5_tiles(dataset: h5py.Dataset) -> images.LazyTiles:
+    """
+    Lazily read a hdf5 dataset one window at a time, aligned to its chunks.
+    """
+    if images.is_chunked(dataset):
+        return images.iter_chunked_tiles(dataset)
+
+    # Not chunked? It can only be read whole.
+    height, width = dataset.shape
+    return iter([(((0, height), (0, width)), dataset[:])])
+
+
+def _read_bands(
+    datasets: Dict[str, h5py.Dataset],
+    quality_masks: Optional[QualityMaskCache] = None,
+    prefetch_depth: int = _PREFETCH_DEPTH,
+) -> Generator[
+    Tuple[str, h5py.Dataset, Optional[numpy.ndarray], images.LazyTiles], None, None
+]:
+    """
+    Read each named band's (bit-packed) quality mask and tiles, for writing in order.
+
+    They're read ahead in a background thread, so while one band is being encoded,
+    the next is already being read and decompressed. Up to ``prefetch_depth`` windows
+    wait at once, each read (with ``read_direct``) into one of a small pool of reused
+    buffers, so memory use doesn't grow with the bands.
+
+    Because buffers are reused:
+
+    - each band's tiles must be fully consumed before asking for the next band.
+      (so they can't be written in a worker pool. Asking early is an error.)
+    - a tile's pixels are only valid until the next tile is requested.
+
+    A ``prefetch_depth`` of zero reads each band lazily as it's written instead.
+    """
+    if not prefetch_depth:
+        for name, dataset in datasets.items():
+            quality_mask = quality_masks.load(dataset) if quality_masks else None
+            yield name, dataset, quality_mask, _iter_h5_tiles(dataset)
+        return
+
+    # Items are tagged with their band name and window (or None for the band's
+    # quality mask), so they can't be mistaken for another band's.
+    ready = queue.Queue(maxsize=prefetch_depth)
+    # One more buffer than can be queued for the reader to fill, and one for the
+    # consumer to hold, so the reader doesn't normally wait for a free buffer.
+    free_buffers = queue.SimpleQueue()
+    for _ in range(prefetch_depth + 2):
+        free_buffers.put(numpy.empty(_PREFETCH_WINDOW_BYTES, dtype=numpy.uint8))
+    stopped = threading.Event()
+
+    def put(item) -> bool:
+        while not stopped.is_set():
+            try:
+                ready.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def take_buffer() -> Optional[numpy.ndarray]:
+        while not stopped.is_set():
+            try:
+                return free_buffers.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return None
+
+    def read_all():
+        try:
+            for name, dataset in datasets.items():
+                quality_mask = quality_masks.load(dataset) if quality_masks else None
+                if not put((name, None, quality_mask, None)):
+                    return
+                for window in _h5_windows(dataset):
+                    (ystart, yend), (xstart, xend) = window
+                    shape = (yend - ystart, xend - xstart)
+                    block_bytes = shape[0] * shape[1] * dataset.dtype.itemsize
+                    if block_bytes <= _PREFETCH_WINDOW_BYTES:
+                        buffer = take_buffer()
+                        if buffer is None:
+                            return
+                        block = buffer[:block_bytes].view(dataset.dtype).reshape(shape)
+                    else:
+                        # An unchunked (or huge-chunked) band can't be read in pieces.
+                        buffer = None
+                        block = numpy.empty(shape, dtype=dataset.dtype)
+                    dataset.read_direct(
+                        block, source_sel=numpy.s_[ystart:yend, xstart:xend]
+                    )
+                    if not put((name, window, block, buffer)):
+                        return
+        except BaseException as e:
+            put(e)
+
+    def get(name: str, window: Optional[images.TileWindow]):
+        item = ready.get()
+        if isinstance(item, BaseException):
+            raise item
+        item_name, item_window, value, buffer = item
+        if (item_name, item_window) != (name, window):
+            if buffer is not None:
+                free_buffers.put(buffer)
+            raise RuntimeError(
+                f"Expected band {name!r} window {window}, but the next prefetched was "
+                f"{item_name!r} window {item_window}. "
+                f"(Was the previous band's tiles not fully read?)"
+            )
+        return value, buffer
+
+    def band_tiles(name: str, dataset: h5py.Dataset) -> images.LazyTiles:
+        for window in _h5_windows(dataset):
+            block, buffer = get(name, window)
+            try:
+                yield window, block
+            finally:
+                # The consumer has moved on, so the buffer can be reused.
+                if buffer is not None:
+                    free_buffers.put(buffer)
+
+    reader = threading.Thread(target=read_all, name="odc-wagl-prefetch", daemon=True)
+    reader.start()
+    try:
+        for name, dataset in datasets.items():
+            quality_mask, _ = get(name, None)
+            yield name, dataset, quality_mask, band_tiles(name, dataset)
+    finally:
+        stopped.set()
+        reader.join()
+        # Release anything it read that we didn't get to.
+        while True:
+            try:
+                ready.get_nowait()
+            except queue.Empty:
+                break
+
+
+def _h5_windows(dataset: h5py.Dataset) -> Iterable[images.TileWindow]:
+    """The windows to read a hdf5 dataset in, aligned to its chunks"""
+    if images.is_chunked(dataset):
+        return images.iter_chunked_windows(dataset, _PREFETCH_WINDOW_BYTES)
+    height, width = dataset.shape
+    return [((0, height), (0, width))]
+
+
+def _masked_tiles(
+    tiles: images.LazyTiles, packed_mask: numpy.ndarray, nodata: float
+) -> images.LazyTiles:
+    """
+    Set the pixels of each tile to nodata where the (bit-packed) quality mask is set.
+    """
+    for window, block in tiles:
+        (ystart, yend), (xstart, xend) = window
+        byte_start, bit_offset = divmod(xstart, 8)
+        masked = numpy.unpackbits(
+            packed_mask[ystart:yend, byte_start : -(-xend // 8)], axis=1
+        )[:, bit_offset : bit_offset + (xend - xstart)]
+        block[masked.view(bool)] = nodata
+        yield window, block
 
 
 def write_measurement_h5(
@@ -319,24 +658,72 @@ def write_measurement_h5(
     overview_resampling=Resampling.nearest,
     expand_valid_data=True,
     file_id: str = None,
+    quality_mask: Optional[numpy.ndarray] = None,
+    contiguity_masks: Optional["ContiguityMasks"] = None,
+    tiles: Optional[images.LazyTiles] = None,
+    reference_hdf5: bool = False,
 ):
     """
     Write a measurement by copying it from a hdf5 dataset.
+
+    It's streamed one window at a time (aligned to the hdf5 chunks), with any quality
+    mask applied to each window, so the whole band is never held in memory.
+
+    With ``reference_hdf5``, the measurement instead references the dataset where it
+    is, by the hdf5 file's path and the dataset's path within it (as its ``layer``).
+    Its windows are still read if needed for the valid data or contiguity, but
+    nothing is written. (Unless its quality mask removes any pixels: the hdf5 dataset
+    still holds them, so the masked band is written as a COG anyway.)
+
+    :param band_masks: The quality masks to load for the band.
+    :param quality_mask: Or, an already-loaded (bit-packed) quality mask for the band.
+                         (see :class:`QualityMaskCache`)
+    :param contiguity_masks: Add the band's (masked) pixels to its product's contiguity.
+    :param tiles: The band's tiles, if they've already been read. (see :func:`_read_bands`)
+    :param reference_hdf5: Reference the hdf5 dataset, rather than writing it as a COG.
     """
-    if band_masks:
-        data = load_and_mask_data(g, band_masks)
-    else:
-        data = g[:] if hasattr(g, "chunks") else g
+    nodata = g.attrs.get("no_data_value")
+    if quality_mask is None and band_masks:
+        quality_mask = load_quality_mask(g, band_masks)
+    if reference_hdf5 and quality_mask is not None and quality_mask.any():
+        # Referencing the dataset would give different pixels to a written package.
+        reference_hdf5 = False
+
+    if tiles is None:
+        tiles = _iter_h5_tiles(g)
+    if quality_mask is not None and quality_mask.any():
+        tiles = _masked_tiles(tiles, quality_mask, _quality_mask_nodata(g))
 
     product_name, band_name = full_name.split(":")
-    p.write_measurement_numpy(
-        array=data,
-        grid_spec=images.GridSpec(
-            shape=g.shape,
-            transform=Affine.from_gdal(*g.attrs["geotransform"]),
-            crs=CRS.from_wkt(g.attrs["crs_wkt"]),
-        ),
-        nodata=g.attrs.get("no_data_value"),
+    grid = images.GridSpec(
+        shape=g.shape,
+        transform=Affine.from_gdal(*g.attrs["geotransform"]),
+        crs=CRS.from_wkt(g.attrs["crs_wkt"]),
+    )
+    on_tile = (
+        None
+        if contiguity_masks is None
+        else functools.partial(contiguity_masks.add_tile, product_name, grid)
+    )
+    if reference_hdf5:
+        p.note_measurement(
+            full_name,
+            Path(g.file.filename).absolute(),
+            expand_valid_data=expand_valid_data,
+            grid=grid,
+            nodata=nodata,
+            layer=g.name,
+            tiles=tiles,
+            on_tile=on_tile,
+        )
+        return
+
+    p.write_measurement_tiles(
+        full_name,
+        tiles,
+        g.dtype,
+        grid_spec=grid,
+        nodata=nodata,
         overviews=overviews,
         overview_resampling=overview_resampling,
         expand_valid_data=expand_valid_data,
@@ -345,8 +732,8 @@ def write_measurement_h5(
         # product_name to be included in the recorded band metadata,
         # but not in its filename.
         # So we manually calculate a filename without the extra product name prefix.
-        name=full_name,
         path=p.names.measurement_filename(band_name, "tif", file_id=file_id),
+        on_tile=on_tile,
     )
 
 
@@ -369,45 +756,59 @@ def _file_id(dataset: h5py.Dataset) -> str:
 def _unpack_observation_attributes(
     p: DatasetAssembler,
     res_grp: h5py.Group,
+    prefetch_depth: int = _PREFETCH_DEPTH,
+    reference_hdf5: bool = False,
 ):
     """
     Unpack the angles + other supplementary datasets produced by wagl.
     Currently only the mode resolution group gets extracted.
-    """
 
-    def _write(section: str, dataset_names: Sequence[str]):
-        """
-        Write supplementary attributes as measurement.
-        """
-        for dataset_name in dataset_names:
-            o = f"{section}/{dataset_name}"
-            with do(f"Path {o!r} "):
-                measurement_name = utils.normalise_band_name(dataset_name)
-                write_measurement_h5(
-                    p,
-                    f"oa:{measurement_name}",
-                    res_grp[o],
-                    # We only use the product bands for valid data calc, not supplementary.
-                    # According to Josh: Supplementary pixels outside of the product bounds are implicitly invalid.
-                    expand_valid_data=False,
-                    overviews=None,
-                )
+    :param prefetch_depth: Read bands ahead of writing them (see :func:`_read_bands`)
+    :param reference_hdf5: Reference the datasets in the hdf5 file, rather than writing them.
+    """
+    if reference_hdf5:
+        # Their pixels aren't needed at all.
+        prefetch_depth = 0
+
+    supplementary_paths = [
+        f"{section}/{dataset_name}"
+        for section, dataset_names in (
+            (
+                "SATELLITE-SOLAR",
+                [
+                    "SATELLITE-VIEW",
+                    "SATELLITE-AZIMUTH",
+                    "SOLAR-ZENITH",
+                    "SOLAR-AZIMUTH",
+                    "RELATIVE-AZIMUTH",
+                    "TIME-DELTA",
+                ],
+            ),
+            ("INCIDENT-ANGLES", ["INCIDENT-ANGLE", "AZIMUTHAL-INCIDENT"]),
+            ("EXITING-ANGLES", ["EXITING-ANGLE", "AZIMUTHAL-EXITING"]),
+            ("RELATIVE-SLOPE", ["RELATIVE-SLOPE"]),
+            ("SHADOW-MASKS", ["COMBINED-TERRAIN-SHADOW"]),
+        )
+        for dataset_name in dataset_names
+    ]
 
-    _write(
-        "SATELLITE-SOLAR",
-        [
-            "SATELLITE-VIEW",
-            "SATELLITE-AZIMUTH",
-            "SOLAR-ZENITH",
-            "SOLAR-AZIMUTH",
-            "RELATIVE-AZIMUTH",
-            "TIME-DELTA",
-        ],
-    )
-    _write("INCIDENT-ANGLES", ["INCIDENT-ANGLE", "AZIMUTHAL-INCIDENT"])
-    _write("EXITING-ANGLES", ["EXITING-ANGLE", "AZIMUTHAL-EXITING"])
-    _write("RELATIVE-SLOPE", ["RELATIVE-SLOPE"])
-    _write("SHADOW-MASKS", ["COMBINED-TERRAIN-SHADOW"])
+    # Write supplementary attributes as measurements.
+    for o, dataset, _, tiles in _read_bands(
+        {o: res_grp[o] for o in supplementary_paths}, prefetch_depth=prefetch_depth
+    ):
+        with do(f"Path {o!r} "):
+            measurement_name = utils.normalise_band_name(o.split("/")[-1])
+            write_measurement_h5(
+                p,
+                f"oa:{measurement_name}",
+                dataset,
+                # We only use the product bands for valid data calc, not supplementary.
+                # According to Josh: Supplementary pixels outside of the product bounds are implicitly invalid.
+                expand_valid_data=False,
+                overviews=None,
+                tiles=tiles,
+                reference_hdf5=reference_hdf5,
+            )
 
 
 def get_oa_resolution_group(
@@ -439,10 +840,87 @@ def get_oa_resolution_group(
     return res_grp
 
 
+class ContiguityMasks:
+    """
+    Accumulate which pixels are valid in every band of a product, as the bands are written.
+
+    So the contiguity layers can be created without reading the written bands back again.
+
+    A pixel is valid if it's greater than zero. Masks are held bit-packed, one for each
+    product and grid.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Packed masks by product name and grid, in the order they were first written.
+        self._masks: Dict[Tuple[str, GridSpec], numpy.ndarray] = {}
+
+    def add_tile(
+        self,
+        product: str,
+        grid: GridSpec,
+        window: images.TileWindow,
+        block: numpy.ndarray,
+    ):
+        """
+        Add one window of a band's pixels to the product's mask.
+
+        (It's safe to call from multiple threads.)
+        """
+        (ystart, yend), (xstart, xend) = window
+        byte_start, bit_offset = divmod(xstart, 8)
+        byte_end = -(-xend // 8)
+
+        # Pad the window out to whole bytes with valid pixels, so the pixels of
+        # neighbouring windows are left untouched.
+        padding = ((0, 0), (bit_offset, byte_end * 8 - xend))
+        packed = numpy.empty((yend - ystart, byte_end - byte_start), dtype=numpy.uint8)
+        for row in range(0, yend - ystart, _MASK_STRIP_ROWS):
+            valid = numpy.pad(
+                block[row : row + _MASK_STRIP_ROWS] > 0, padding, constant_values=True
+            )
+            packed[row : row + _MASK_STRIP_ROWS] = numpy.packbits(valid, axis=1)
+            del valid
+
+        key = (product.lower(), grid)
+        with self._lock:
+            mask = self._masks.get(key)
+            if mask is None:
+                mask = numpy.full(
+                    (grid.shape[0], -(-grid.shape[1] // 8)), 0xFF, dtype=numpy.uint8
+                )
+                self._masks[key] = mask
+            mask[ystart:yend, byte_start:byte_end] &= packed
+
+    def grids(self, product: str) -> List[GridSpec]:
+        """The grids of a product's bands, in the order they were first written."""
+        return [grid for name, grid in self._masks if name == product.lower()]
+
+    def read(
+        self, product: str, grid: GridSpec, out_shape: Tuple[int, int]
+    ) -> numpy.ndarray:
+        """
+        Get a product's mask for one grid as a boolean array.
+
+        It's resampled to the ``out_shape`` (by nearest neighbour, as rasterio/gdal would)
+        """
+        mask = numpy.unpackbits(self._masks[(product.lower(), grid)], axis=1)[
+            :, : grid.shape[1]
+        ].view(bool)
+        if out_shape != grid.shape:
+            rows, cols = (
+                ((numpy.arange(out_size) + 0.5) * (size / out_size)).astype(int)
+                for size, out_size in zip(grid.shape, out_shape)
+            )
+            mask = mask[rows[:, numpy.newaxis], cols]
+        return mask
+
+
 def _create_contiguity(
     p: DatasetAssembler,
     product_list: Iterable[str],
     resolution_yx: Tuple[float, float],
+    contiguity_masks: ContiguityMasks,
     timedelta_product: str = "nbar",
     timedelta_data: numpy.ndarray = None,
 ):
@@ -450,43 +928,29 @@ def _create_contiguity(
     Create the contiguity (all pixels valid) dataset.
 
     Write a contiguity mask file based on the intersection of valid data pixels across all
-    bands from the input files.
+    bands, as accumulated when they were written (see :class:`ContiguityMasks`).
     """
-    for product in product_list:
-        contiguity = None
-        # A contiguity layer for each product
-        for grid, band_name, path in p.iter_measurement_paths():
-            if not band_name.startswith(f"{product.lower()}:"):
-                continue
-            # Only our given res group (no pan band in Landsat)
-            if grid.resolution_yx != resolution_yx:
-                continue
-            with rasterio.open(path) as ds:
-                ds: DatasetReader
-                out_shape = ds.shape
-                contiguity = numpy.ones(out_shape, dtype="uint8")
-                geobox = GridSpec.from_rio(ds)
-                break
+    # The masks are complete once all bands are written.
+    p.wait_for_writes()
 
-        if contiguity is None:
+    for product in product_list:
+        grids = contiguity_masks.grids(product)
+        # A contiguity layer for each product, on the grid of our given res group.
+        # (no pan band in Landsat)
+        geobox = next(
+            (grid for grid in grids if grid.resolution_yx == resolution_yx), None
+        )
+        if geobox is None:
             raise ValueError(f"no matching band with resolution {resolution_yx}")
 
-        for grid, band_name, path in p.iter_measurement_paths():
-            if not band_name.startswith(f"{product.lower()}:"):
-                continue
+        contiguity = numpy.ones(geobox.shape, dtype="uint8")
+        for grid in grids:
             # Only our given res group (no pan band in Landsat)
             if (p.platform.startswith("landsat")) and (
                 grid.resolution_yx != resolution_yx
             ):
                 continue
-            with rasterio.open(path) as ds:
-                ds: DatasetReader
-                contiguity &= (
-                    ds.read(
-                        ds.count, out_shape=out_shape, resampling=Resampling.nearest
-                    )
-                    > 0
-                )
+            contiguity &= contiguity_masks.read(product, grid, out_shape=geobox.shape)
 
         p.write_measurement_numpy(
             f"oa:{product.lower()}_contiguity",
@@ -809,6 +1273,7 @@ def package_file(
     hdf_file: Path,
     included_products: Iterable[str] = DEFAULT_PRODUCTS,
     include_oa: bool = True,
+    workers: int = 1,
 ) -> Dict[UUID, Path]:
     """
     Simple alternative to package().
@@ -816,21 +1281,126 @@ def package_file(
     Takes a single HDF5 and infers other paths (gqa etc) via naming conventions.
 
     Returns a dictionary of the output datasets: Mapping UUID to the their metadata path.
+
+    :param workers: Package this many granules at once, in a pool of processes.
+                    (A failed granule is then raised only after the others have finished.)
     """
 
     out = {}
-    for granule in Granule.for_path(hdf_file):
-        dataset_id, metadata_path = package(
-            out_directory,
-            granule,
-            included_products=included_products,
-            include_oa=include_oa,
-        )
-        out[dataset_id] = metadata_path
+    if workers == 1:
+        for granule in Granule.for_path(hdf_file):
+            dataset_id, metadata_path = package(
+                out_directory,
+                granule,
+                included_products=included_products,
+                include_oa=include_oa,
+            )
+            out[dataset_id] = metadata_path
+        return out
+
+    failures = []
+    for result in package_granules(
+        out_directory,
+        list(Granule.for_path(hdf_file)),
+        workers=workers,
+        included_products=included_products,
+        include_oa=include_oa,
+    ):
+        if result.error:
+            failures.append(result)
+        else:
+            out[result.dataset_id] = result.metadata_path
 
+    if failures:
+        raise RuntimeError(
+            f"Failed to package {len(failures)} granule(s) in {hdf_file}:\n"
+            + "\n".join(f"{r.granule_name}: {r.error}" for r in failures)
+        )
     return out
 
 
+@attr.s(auto_attribs=True)
+class PackagedGranule:
+    """
+    The outcome of packaging one granule (see :func:`package_granules`)
+    """
+
+    granule_name: str
+    #: How long packaging took, in seconds.
+    seconds: float
+    dataset_id: Optional[UUID] = None
+    metadata_path: Optional[Path] = None
+    #: The formatted exception, if it failed.
+    error: Optional[str] = None
+
+
+def package_granules(
+    out_directory: Path,
+    granules: Iterable[Granule],
+    workers: int = 1,
+    gdal_options: Optional[Dict[str, Any]] = None,
+    **package_args,
+) -> Generator[PackagedGranule, None, None]:
+    """
+    Package many granules, optionally in a pool of worker processes.
+
+    Each granule is packaged separately (opening its own hdf5 handle), so a failure in one
+    doesn't stop the others: it's reported in its result instead.
+
+    Results are yielded as each granule finishes, which may not be the order given.
+
+    :param workers: How many granules to package at once. The CPUs are shared between
+                    them, as each worker process has its own GDAL threads.
+    :param gdal_options: GDAL config options to package with. (Workers are separate
+                         processes, so they can't rely on the caller's ``rasterio.Env()``)
+    :param package_args: Other arguments for :func:`package`
+    """
+    package_args.setdefault(
+        "num_threads", max(images.available_cpu_count() // workers, 1)
+    )
+    package_granule = functools.partial(
+        _package_granule_safe, out_directory, gdal_options or {}, package_args
+    )
+    if workers == 1:
+        yield from map(package_granule, granules)
+        return
+
+    with multiprocessing.Pool(workers) as pool:
+        yield from pool.imap_unordered(package_granule, granules)
+        pool.close()
+        pool.join()
+
+
+def _package_granule_safe(
+    out_directory: Path,
+    gdal_options: Dict[str, Any],
+    package_args: Dict[str, Any],
+    granule: Granule,
+) -> PackagedGranule:
+    """
+    A wrapper around `package` that times it, and catches exceptions as
+    serialisable error strings.
+
+    (for use in multiprocessing pools etc.)
+    """
+    start_time = time.perf_counter()
+    try:
+        with rasterio.Env(**gdal_options):
+            dataset_id, metadata_path = package(out_directory, granule, **package_args)
+    except Exception:
+        return PackagedGranule(
+            granule.name,
+            time.perf_counter() - start_time,
+            error=traceback.format_exc(),
+        )
+    return PackagedGranule(
+        granule.name,
+        time.perf_counter() - start_time,
+        dataset_id=dataset_id,
+        metadata_path=metadata_path,
+    )
+
+
 def package(
     out_directory: Path,
     granule: Granule,
@@ -840,6 +1410,10 @@ def package(
     include_oa: bool = True,
     oa_resolution: Optional[Tuple[float, float]] = None,
     contiguity_resolution: Optional[Tuple[float, float]] = None,
+    max_workers: Optional[int] = None,
+    num_threads: Optional[int] = None,
+    resumable: bool = False,
+    reference_hdf5: bool = False,
 ) -> Tuple[UUID, Path]:
     """
     Package an L2 product.
@@ -857,6 +1431,28 @@ def package(
         A list of imagery products to include in the package.
         Defaults to all products.
 
+    :param max_workers:
+        Write this many bands at once, in a pool of threads. Bands are still recorded in
+        the same order, so the output is identical to writing them one at a time.
+        (see :class:`eodatasets3.DatasetAssembler`)
+
+    :param num_threads:
+        How many CPU threads GDAL may use to write this package, shared between the
+        ``max_workers``. (default: all available CPUs)
+
+    :param resumable:
+        If packaging fails part-way through, keep the bands that were finished, to be
+        reused when it's run again. (see :class:`eodatasets3.DatasetAssembler`)
+
+    :param reference_hdf5:
+        Don't convert the bands to COGs: the measurements instead reference the datasets
+        in the wagl hdf5 file (and the fmask/s2cloudless images) where they are, by
+        absolute path and (hdf5) layer. The bands are still read in chunks, to compute the
+        footprint and contiguity, so the package holds only the metadata and contiguity.
+
+        Quality masks can't be applied to referenced bands, so any band with pixels to
+        mask is still written as a (masked) COG.
+
     :return:
         The dataset UUID and output metadata path
     """
@@ -876,6 +1472,11 @@ def package(
                 if ("sentinel" in wagl_doc["source_datasets"]["platform_id"].lower())
                 else "dea"
             ),
+            max_workers=max_workers,
+            num_threads=num_threads,
+            resumable=resumable,
+            # Referenced bands are outside the dataset folder.
+            allow_absolute_paths=reference_hdf5,
         ) as p:
             _apply_wagl_metadata(p, wagl_doc)
 
@@ -927,7 +1528,21 @@ def package(
             if granule.tesp_doc:
                 _take_software_versions(p, granule.tesp_doc)
 
-            _unpack_products(p, included_products, granule_group, granule)
+            # Bands written in a worker pool are already read concurrently. Otherwise,
+            # read each band while the previous one is being written.
+            # (Unless resuming: bands finished previously won't be read at all.)
+            prefetch_depth = 0 if (max_workers or resumable) else _PREFETCH_DEPTH
+
+            contiguity_masks = ContiguityMasks()
+            _unpack_products(
+                p,
+                included_products,
+                granule_group,
+                granule,
+                contiguity_masks,
+                prefetch_depth=prefetch_depth,
+                reference_hdf5=reference_hdf5,
+            )
 
             if include_oa:
                 with sub_product("oa", p):
@@ -950,6 +1565,8 @@ def package(
                             get_oa_resolution_group(
                                 resolution_groups, p.platform, oa_resolution
                             ),
+                            prefetch_depth=prefetch_depth,
+                            reference_hdf5=reference_hdf5,
                         )
 
                     infer_datetime_range = p.platform.startswith("landsat")
@@ -979,15 +1596,17 @@ def package(
                             p,
                             included_products,
                             resolution_yx=tuple(contiguity_res_grp.attrs["resolution"]),
+                            contiguity_masks=contiguity_masks,
                             timedelta_data=timedelta_data,
                         )
 
                     if granule.fmask_image:
                         with do(f"Writing fmask from {granule.fmask_image} "):
-                            p.write_measurement(
+                            _write_image(
+                                p,
                                 "oa:fmask",
                                 granule.fmask_image,
-                                expand_valid_data=False,
+                                reference=reference_hdf5,
                                 overview_resampling=Resampling.mode,
                                 # Because of our strange sub-products and filename standards, we want the
                                 # 'oa_' prefix to be included in the recorded band metadata,
@@ -1000,10 +1619,11 @@ def package(
                         with do(
                             f"Writing s2cloudless probability from {granule.s2cloudless_prob} "
                         ):
-                            p.write_measurement(
+                            _write_image(
+                                p,
                                 "oa:s2cloudless_prob",
                                 granule.s2cloudless_prob,
-                                expand_valid_data=False,
+                                reference=reference_hdf5,
                                 overview_resampling=Resampling.bilinear,
                                 path=p.names.measurement_filename("s2cloudless-prob"),
                             )
@@ -1012,18 +1632,45 @@ def package(
                         with do(
                             f"Writing s2cloudless mask from {granule.s2cloudless_mask} "
                         ):
-                            p.write_measurement(
+                            _write_image(
+                                p,
                                 "oa:s2cloudless_mask",
                                 granule.s2cloudless_mask,
-                                expand_valid_data=False,
+                                reference=reference_hdf5,
                                 overview_resampling=Resampling.mode,
                                 path=p.names.measurement_filename("s2cloudless-mask"),
                             )
 
+            if reference_hdf5:
+                if "odc:file_format" in p.properties:
+                    # Some measurements were written (such as the contiguity), so the
+                    # package mixes formats. Eo3 can't record a format per measurement,
+                    # so none is recorded for the dataset.
+                    del p.properties["odc:file_format"]
+                else:
+                    # Nothing was written: every measurement is a referenced hdf5 dataset.
+                    p.properties["odc:file_format"] = FileFormat.HDF5
+
             with do("Finishing package"):
                 return p.done()
 
 
+def _write_image(
+    p: DatasetAssembler,
+    name: str,
+    image: Path,
+    reference: bool = False,
+    **write_args,
+):
+    """
+    Write an (OA) image file as a measurement, or with ``reference``, reference it where it is.
+    """
+    if reference:
+        p.note_measurement(name, image.absolute(), expand_valid_data=False)
+    else:
+        p.write_measurement(name, image, expand_valid_data=False, **write_args)
+
+
 def _read_gqa_doc(p: DatasetAssembler, doc: Dict):
     _take_software_versions(p, doc)
     p.extend_user_metadata("gqa", doc)
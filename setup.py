@@ -81,7 +81,8 @@ setup(
         "jsonschema>=4.18",  # We want a Draft6Validator
         "numpy>=1.15.4",
         "pyproj",
-        "rasterio",
+        # 1.3 sets config options thread-locally in worker threads.
+        "rasterio>=1.3",
         "ruamel.yaml",
         "scipy",
         "shapely",
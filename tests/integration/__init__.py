@@ -10,7 +10,11 @@ from typing import Dict, Tuple
 
 import numpy
 import rasterio
+from affine import Affine
 from rasterio import DatasetReader
+from rasterio.crs import CRS
+
+from eodatasets3.images import GridSpec
 
 allow_anything = object()
 
@@ -69,6 +73,17 @@ def directory_size(directory):
     return sum(p.stat().st_size for p in directory.rglob("*") if p.is_file())
 
 
+def utm_grid(shape: Tuple[int, int]) -> GridSpec:
+    """
+    A 30m grid of the given shape, in UTM zone 56, for tests that write their own images.
+    """
+    return GridSpec(
+        shape=shape,
+        transform=Affine(30.0, 0.0, 241485.0, 0.0, -30.0, -2281485.0),
+        crs=CRS.from_epsg(32656),
+    )
+
+
 class FakeAncilFile:
     def __init__(self, base_folder, type_, filename, folder_offset=()):
         """
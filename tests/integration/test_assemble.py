@@ -13,13 +13,17 @@ from uuid import UUID
 
 import numpy
 import pytest
+import rasterio
+from affine import Affine
 from ruamel import yaml
+from shapely.geometry import box
 
 from eodatasets3 import DatasetAssembler, DatasetPrepare, namer, serialise
 from eodatasets3.images import GridSpec
 from eodatasets3.model import DatasetDoc
 from tests import assert_file_structure
 from tests.common import assert_expected_eo3_path, assert_same
+from tests.integration import utm_grid
 
 
 def test_dea_style_package(
@@ -233,6 +237,247 @@ def test_minimal_package_with_product_name(tmp_path: Path, l1_ls8_folder: Path):
     )
 
 
+def test_windowed_measurement_copy(tmp_path: Path):
+    """
+    Copying a measurement window-by-window should give the same result as reading it whole.
+    """
+    grid = utm_grid((100, 90))
+    array = numpy.arange(100 * 90, dtype=numpy.uint16).reshape(grid.shape)
+    # A nodata corner, which should be excluded from the footprint.
+    array[60:, 50:] = 0
+
+    input_path = tmp_path / "input.tif"
+    with rasterio.open(
+        input_path,
+        "w",
+        driver="GTiff",
+        width=90,
+        height=100,
+        count=1,
+        dtype="uint16",
+        crs=grid.crs,
+        transform=grid.transform,
+        tiled=True,
+        blockxsize=16,
+        blockysize=16,
+    ) as ds:
+        ds.write(array, 1)
+
+    results = {}
+    for max_window_bytes in (None, 16 * 90 * 2 * 2):
+        out = tmp_path / f"out-{max_window_bytes}"
+        out.mkdir()
+        with DatasetAssembler(out) as p:
+            p.datetime = datetime(2019, 7, 4, 13, 7, 5)
+            p.product_name = "windowed_copies"
+            p.processed = datetime(2019, 7, 4, 13, 8, 7)
+
+            p.write_measurement("blue", input_path, max_window_bytes=max_window_bytes)
+            dataset_id, metadata_path = p.done()
+
+        dataset = serialise.from_path(metadata_path)
+        [written_path] = out.rglob("*_blue.tif")
+        with rasterio.open(written_path) as ds:
+            results[max_window_bytes] = (dataset.geometry, ds.read(1))
+
+    (whole_geometry, whole_pixels), (windowed_geometry, windowed_pixels) = (
+        results.values()
+    )
+    assert numpy.array_equal(whole_pixels, array)
+    assert numpy.array_equal(windowed_pixels, array)
+    assert windowed_geometry.equals(whole_geometry)
+    # The nodata corner was clipped from the footprint.
+    assert windowed_geometry.area < box(*grid.bounds).area
+
+
+def test_chunked_measurement_write(tmp_path: Path):
+    """
+    Writing a measurement from a chunked hdf5 dataset should match writing it from memory.
+    """
+    h5py = pytest.importorskip("h5py")
+    grid = utm_grid((100, 90))
+    array = numpy.arange(100 * 90, dtype=numpy.uint16).reshape(grid.shape)
+    # A nodata corner, which should be excluded from the footprint.
+    array[60:, 50:] = 0
+
+    with h5py.File(tmp_path / "input.h5", "w") as f:
+        f.create_dataset("blue", data=array, chunks=(16, 32))
+
+    results = {}
+    for source in ("memory", "h5"):
+        out = tmp_path / f"out-{source}"
+        out.mkdir()
+        with DatasetAssembler(out) as p, h5py.File(tmp_path / "input.h5", "r") as f:
+            p.datetime = datetime(2019, 7, 4, 13, 7, 5)
+            p.product_name = "chunked_writes"
+            p.processed = datetime(2019, 7, 4, 13, 8, 7)
+
+            p.write_measurement_numpy(
+                "blue", array if source == "memory" else f["blue"], grid
+            )
+            dataset_id, metadata_path = p.done()
+
+        dataset = serialise.from_path(metadata_path)
+        [written_path] = out.rglob("*_blue.tif")
+        with rasterio.open(written_path) as ds:
+            results[source] = (dataset.geometry, ds.read(1))
+
+    (memory_geometry, memory_pixels), (h5_geometry, h5_pixels) = results.values()
+    assert numpy.array_equal(h5_pixels, array)
+    assert h5_geometry.equals(memory_geometry)
+    assert h5_geometry.area < box(*grid.bounds).area
+
+
+def test_resume_package(tmp_path: Path):
+    """
+    A resumable package that fails part-way through should reuse its finished
+    measurements when run again, and produce the same package as running it once.
+    """
+    dataset_id = UUID("5d82f8e2-4b3d-4f55-9b3b-5c4a1bf5d5a2")
+    grid = utm_grid((100, 90))
+    blue = numpy.arange(100 * 90, dtype=numpy.uint16).reshape(grid.shape)
+    blue[60:, 50:] = 0
+    green = numpy.ones(grid.shape, dtype=numpy.uint16)
+    green[:10] = 0
+
+    def package(out: Path, fail=False, **kwargs) -> Path:
+        with DatasetAssembler(out, dataset_id=dataset_id, **kwargs) as p:
+            p.datetime = datetime(2019, 7, 4, 13, 7, 5)
+            p.product_name = "resumed"
+            p.processed = datetime(2019, 7, 4, 13, 8, 7)
+
+            p.write_measurement_numpy("blue", blue, grid)
+            if fail:
+                raise RuntimeError("Walltime exceeded")
+            p.write_measurement_numpy("green", green, grid)
+            dataset_id_, metadata_path = p.done()
+        return metadata_path
+
+    # The same package, made in one go.
+    expected_out = tmp_path / "expected"
+    expected_out.mkdir()
+    expected_path = package(expected_out)
+
+    out = tmp_path / "resumed"
+    out.mkdir()
+    with pytest.raises(RuntimeError, match="Walltime"):
+        with pytest.warns(UserWarning, match="without finishing"):
+            package(out, fail=True, resumable=True)
+
+    # The finished work is kept, in a folder named after the dataset.
+    [work_path] = out.glob(".odcdataset-*")
+    assert work_path.name == f".odcdataset-{dataset_id}"
+    [blue_path] = work_path.glob("*_blue.tif")
+    blue_written_time = blue_path.stat().st_mtime_ns
+
+    # Leftovers from dying part-way through a thumbnail, which isn't written this time.
+    (work_path / ".thumbgen-x8k2").mkdir()
+    (work_path / ".thumbgen-x8k2" / "quicklook.tif").write_bytes(b"II*\x00")
+    (work_path / "resumed_thumbnail.jpg").write_bytes(b"\xff\xd8")
+
+    metadata_path = package(out, resumable=True)
+    assert not list(out.glob(".odcdataset-*")), "Work folder should be moved into place"
+    assert not list(metadata_path.parent.glob(".thumbgen-*"))
+    assert not (metadata_path.parent / "resumed_thumbnail.jpg").exists()
+    [blue_path] = metadata_path.parent.glob("*_blue.tif")
+    assert blue_path.stat().st_mtime_ns == blue_written_time, "Blue wasn't reused"
+
+    # Identical to making it in one go (including its valid-data geometry).
+    assert sorted(p.name for p in metadata_path.parent.iterdir()) == sorted(
+        p.name for p in expected_path.parent.iterdir()
+    )
+    for expected_file in expected_path.parent.iterdir():
+        assert (metadata_path.parent / expected_file.name).read_bytes() == (
+            expected_file.read_bytes()
+        ), f"{expected_file.name} differs"
+
+    # A resumable package needs to know where to resume from.
+    with pytest.raises(ValueError, match="dataset_id"):
+        DatasetAssembler(out, resumable=True)
+
+
+def test_multiple_thumbnail_sizes(tmp_path: Path):
+    """
+    Several sizes of thumbnail can be written at once, each as its own accessory.
+    """
+    grid = utm_grid((400, 500))
+    array = numpy.arange(400 * 500, dtype=numpy.uint16).reshape(grid.shape)
+
+    with DatasetAssembler(tmp_path) as p:
+        p.datetime = datetime(2019, 7, 4, 13, 7, 5)
+        p.product_name = "thumbnail_sizes"
+        p.processed = datetime(2019, 7, 4, 13, 8, 7)
+        p.write_measurement_numpy("blue", array, grid)
+
+        with pytest.raises(ValueError):
+            p.write_thumbnail("blue", "blue", "blue", scale_factor={}, kind="small")
+
+        p.write_thumbnail(
+            "blue", "blue", "blue", scale_factor={"browse": 5, "icon": 50}
+        )
+        dataset_id, metadata_path = p.done()
+
+    dataset = serialise.from_path(metadata_path)
+    assert set(dataset.accessories) >= {"thumbnail:browse", "thumbnail:icon"}
+
+    shapes = {}
+    for kind in ("browse", "icon"):
+        with rasterio.open(
+            metadata_path.parent / dataset.accessories[f"thumbnail:{kind}"].path
+        ) as ds:
+            shapes[kind] = ds.shape
+    # The same quicklook, scaled differently.
+    assert shapes["browse"][1] // 10 == shapes["icon"][1]
+
+
+def test_concurrent_measurement_writes(tmp_path: Path):
+    """
+    Writing measurements in a worker pool should give an identical package to writing them serially.
+    """
+    grid = utm_grid((100, 90))
+    half_grid = GridSpec(
+        shape=(50, 45),
+        transform=grid.transform * Affine.scale(2),
+        crs=grid.crs,
+    )
+
+    def write_package(out: Path, max_workers=None) -> Path:
+        out.mkdir()
+        with DatasetAssembler(
+            out,
+            dataset_id=UUID("cd39c9b7-e2d2-4aa4-a1a3-b9ec0fb0d9a7"),
+            max_workers=max_workers,
+        ) as p:
+            p.datetime = datetime(2019, 7, 4, 13, 7, 5)
+            p.product_name = "concurrent_writes"
+            p.processed = datetime(2019, 7, 4, 13, 8, 7)
+
+            futures = []
+            for i in range(6):
+                array = numpy.full(grid.shape, i + 1, dtype=numpy.int16)
+                # Each band has a different nodata region.
+                array[: i * 10, :] = -999
+                futures.append(
+                    p.write_measurement_numpy(f"band{i}", array, grid, nodata=-999)
+                )
+            futures.append(
+                p.write_measurement_numpy(
+                    "coarse", numpy.ones(half_grid.shape, dtype=numpy.uint8), half_grid
+                )
+            )
+            dataset_id, metadata_path = p.done()
+        assert all(future.done() for future in futures)
+        return metadata_path
+
+    serial_path = write_package(tmp_path / "serial")
+    concurrent_path = write_package(tmp_path / "concurrent", max_workers=4)
+
+    assert concurrent_path.read_text() == serial_path.read_text()
+    [serial_checksums] = serial_path.parent.glob("*.sha1")
+    [concurrent_checksums] = concurrent_path.parent.glob("*.sha1")
+    assert concurrent_checksums.read_text() == serial_checksums.read_text()
+
+
 def test_in_memory_dataset(tmp_path: Path, l1_ls8_folder: Path):
     """
     You can create metadata fully in-memory, without touching paths.
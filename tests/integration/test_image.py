@@ -1,7 +1,16 @@
+from pathlib import Path
+
 import numpy as np
+import pytest
+import rasterio.features
+import shapely.affinity
+import shapely.geometry
+import shapely.ops
 
 from eodatasets3 import images
 
+from . import utm_grid
+
 
 def test_rescale_intensity():
     # Example was generated via:
@@ -158,3 +167,180 @@ def test_calc_range():
         34,
         65,
     ), f"Unexpected 2/98 percentile values: {calculated_range}"
+
+
+@pytest.mark.parametrize("overviews", [images.DEFAULT_OVERVIEWS, None])
+def test_write_staged_in_memory(tmp_path: Path, overviews):
+    """Staging in memory should write a file identical to the one staged on disk"""
+    grid = utm_grid((1100, 1300))
+    array = np.arange(1100 * 1300, dtype=np.int16).reshape(grid.shape) % 997
+
+    written = {}
+    for stage_in_memory in (False, True):
+        out_path = tmp_path / f"staged-in-memory-{stage_in_memory}.tif"
+        images.FileWrite.from_existing(
+            grid.shape, stage_in_memory=stage_in_memory
+        ).write_from_ndarray(array, out_path, geobox=grid, overviews=overviews)
+        written[stage_in_memory] = out_path.read_bytes()
+
+        # No staging files should be left behind.
+        assert [p.name for p in tmp_path.iterdir() if p.name.startswith(".")] == []
+
+    assert written[True] == written[False]
+
+
+def test_write_with_threads(tmp_path: Path):
+    """Compressing with multiple threads should give the same output as a single thread"""
+    grid = utm_grid((1100, 1300))
+    array = np.arange(1100 * 1300, dtype=np.int16).reshape(grid.shape) % 997
+
+    written = {}
+    for num_threads in (None, 4, "ALL_CPUS"):
+        out_path = tmp_path / f"threads-{num_threads}.tif"
+        images.FileWrite.from_existing(
+            grid.shape, num_threads=num_threads
+        ).write_from_ndarray(array, out_path, geobox=grid)
+        written[num_threads] = out_path.read_bytes()
+
+    assert written[4] == written[None]
+    assert written["ALL_CPUS"] == written[None]
+
+
+def test_mask_convex_hull_matches_vectorized():
+    """The footprint hull should match that of the fully-vectorized mask"""
+    # Stripes of nodata, like SLC-Off Landsat 7, with a ragged edge.
+    mask = np.zeros((200, 300), dtype=bool)
+    for row in range(20, 190):
+        mask[row, (row * 7) % 40 : 300 - (row * 3) % 50] = True
+    mask[:, ::9] = False
+    mask[5, 150] = True
+
+    expected_hull = shapely.ops.unary_union(
+        [
+            images._valid_shape(shapely.geometry.shape(shape))
+            for shape, val in rasterio.features.shapes(mask.astype("uint8"))
+            if val == 1
+        ]
+    ).convex_hull
+    hull = images._mask_convex_hull(mask)
+    assert hull.equals(expected_hull)
+    assert images._mask_convex_hull(mask.astype("uint8")).equals(expected_hull)
+
+    assert images._mask_convex_hull(np.zeros((10, 10), dtype=bool)).is_empty
+
+
+def test_bundler_packs_valid_data_masks():
+    """Valid data masks should be held bit-packed, including for unaligned windows"""
+    grid = utm_grid((30, 45))
+    expected_mask = np.zeros(grid.shape, dtype=bool)
+
+    bundler = images.MeasurementBundler()
+    for (ystart, yend), (xstart, xend) in [((0, 10), (3, 20)), ((5, 30), (19, 45))]:
+        block = np.zeros((yend - ystart, xend - xstart), dtype=np.int16)
+        block[::2, 1::3] = 7
+        bundler.expand_window(grid, ((ystart, yend), (xstart, xend)), block, nodata=0)
+        expected_mask[ystart:yend, xstart:xend] |= block != 0
+
+    # Eight pixels per byte.
+    packed_mask = bundler.mask_by_grid[grid]
+    assert packed_mask.shape == (30, 6)
+    assert (images._unpack_mask(packed_mask, grid.shape) == expected_mask).all()
+
+
+@pytest.mark.parametrize("overview_factor", [3, 8])
+def test_overview_valid_data_contains_all_pixels(overview_factor: int):
+    """A reduced-resolution footprint should still contain every valid pixel"""
+    grid = utm_grid((100, 130))
+    img = np.zeros(grid.shape, dtype=np.int16)
+    img[17:93, 5:121:2] = 1
+    img[60, 127] = 1
+
+    bundler = images.MeasurementBundler()
+    bundler.record_image("blue", grid, "blue.tif", img, nodata=0)
+    footprint = bundler.consume_and_get_valid_data(
+        images.ValidDataMethod.overview, overview_factor=overview_factor
+    )
+
+    valid_pixels = shapely.affinity.affine_transform(
+        images._mask_convex_hull(img == 1),
+        (30.0, 0.0, 0.0, -30.0, 241485.0, -2281485.0),
+    )
+    assert footprint.buffer(0.001).contains(valid_pixels)
+    assert shapely.geometry.box(*grid.bounds).buffer(0.001).contains(footprint)
+
+
+@pytest.mark.parametrize(
+    "method", [images.ValidDataMethod.filled, images.ValidDataMethod.convex_hull]
+)
+def test_deprecated_valid_data_methods_match_thorough(method):
+    """The deprecated methods should warn, and give the same footprint as thorough"""
+    grid = utm_grid((60, 70))
+    img = np.zeros(grid.shape, dtype=np.int16)
+    img[5:55, 3:66] = 1
+    # Striped, with holes.
+    img[5:55, 10:60:4] = 0
+    img[20:30, 20:40] = 0
+
+    def footprint(method):
+        bundler = images.MeasurementBundler()
+        bundler.record_image("blue", grid, "blue.tif", img, nodata=0)
+        return bundler.consume_and_get_valid_data(method)
+
+    with pytest.warns(DeprecationWarning, match=method.name):
+        assert footprint(method).equals(footprint(images.ValidDataMethod.thorough))
+
+
+@pytest.mark.parametrize("dtype", ["uint8", "int16", "uint16"])
+def test_histogram_percentiles_match_numpy(dtype: str):
+    """Percentiles counted from a histogram should be identical to numpy's"""
+    info = np.iinfo(dtype)
+    rng = np.random.default_rng(42)
+    array = rng.integers(info.min, info.max, size=(300, 200), endpoint=True).astype(
+        dtype
+    )
+    valid_data_mask = rng.random(array.shape) > 0.25
+
+    for percentiles in [(2, 98), (0, 100), (13, 50)]:
+        expected = np.percentile(array[valid_data_mask], percentiles, method="nearest")
+        assert images._histogram_percentiles(
+            array, valid_data_mask, percentiles
+        ) == tuple(expected)
+
+    # No non-zero pixels.
+    assert (
+        images._histogram_percentiles(np.zeros_like(array), valid_data_mask, (2, 98))
+        is None
+    )
+
+
+def test_sampled_percentiles():
+    """Percentiles of float images can be estimated from a sample"""
+    array = np.linspace(0, 1000, 500 * 400, dtype=np.float32).reshape((500, 400))
+    valid_data_mask = np.ones(array.shape, dtype=bool)
+
+    low, high = images.read_valid_mask_and_value_range(
+        valid_data_mask, [(array, -999)], (2, 98), percentile_sample_size=1000
+    )
+    assert low == pytest.approx(20, abs=2)
+    assert high == pytest.approx(980, abs=2)
+
+
+@pytest.mark.parametrize("dtype", ["uint8", "int16", "uint16"])
+def test_rescale_intensity_lookup_table(dtype: str):
+    """Rescaling via a lookup table should match rescaling every pixel"""
+    info = np.iinfo(dtype)
+    rng = np.random.default_rng(7)
+    # Large enough to use a lookup table.
+    image = rng.integers(info.min, info.max, size=(400, 300), endpoint=True).astype(
+        dtype
+    )
+    null_mask = rng.random(image.shape) > 0.9
+    in_range = (int(info.min) // 2 + 3, int(info.max) // 2 - 3)
+
+    expected = images._rescale_values(image, *in_range, 1, 255, np.uint8)
+    expected[null_mask] = 0
+    rescaled = images.rescale_intensity(
+        image, in_range, out_range=(1, 255), image_null_mask=null_mask
+    )
+    assert rescaled.dtype == np.uint8
+    assert np.array_equal(rescaled, expected)
@@ -5,6 +5,7 @@ from pathlib import Path
 from pprint import pprint
 from textwrap import indent
 
+import attr
 import pytest
 import rasterio
 from click.testing import CliRunner
@@ -679,6 +680,208 @@ def test_maturity_calculation():
     )
 
 
+def test_package_granules_in_parallel(tmp_path: Path):
+    """
+    Granules packaged in a pool should each report their result, and a failed one
+    shouldn't stop the others.
+    """
+    from eodatasets3 import wagl
+
+    [esa_granule] = wagl.Granule.for_path(
+        WAGL_ESA_SENTINEL_OUTPUT, level1_metadata_path=S2_ESA_L1_METADATA_PATH
+    )
+    [sinergise_granule] = wagl.Granule.for_path(
+        WAGL_SINERGISE_SENTINEL_OUTPUT,
+        level1_metadata_path=S2_SINERGISE_L1_METADATA_PATH,
+    )
+    missing_granule = attr.evolve(
+        esa_granule, name="missing", wagl_hdf5=tmp_path / "missing.wagl.h5"
+    )
+
+    results = {
+        result.granule_name: result
+        for result in wagl.package_granules(
+            tmp_path,
+            [esa_granule, missing_granule, sinergise_granule],
+            workers=2,
+            gdal_options=dict(GDAL_PAM_ENABLED=False),
+            oa_resolution=(998.1818181818181, 998.1818181818181),
+            contiguity_resolution=(998.1818181818181, 998.1818181818181),
+        )
+    }
+    assert results.keys() == {esa_granule.name, sinergise_granule.name, "missing"}
+
+    assert "missing.wagl.h5" in results["missing"].error
+    assert results["missing"].metadata_path is None
+
+    for granule in esa_granule, sinergise_granule:
+        result = results[granule.name]
+        assert result.error is None
+        assert result.metadata_path.exists()
+        assert result.seconds > 0
+        assert load_yaml(result.metadata_path)["id"] == str(result.dataset_id)
+
+
+class _InlinePool:
+    """A stand-in for a multiprocessing pool, running each job in this process."""
+
+    def __init__(self, processes: int):
+        self.processes = processes
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def imap_unordered(self, func, items):
+        return map(func, items)
+
+    def close(self):
+        pass
+
+    def join(self):
+        pass
+
+
+def test_package_granules_share_cpus(tmp_path: Path, monkeypatch):
+    """
+    Each worker process should get its share of the CPUs, which is then shared between
+    the bands it writes at once.
+    """
+    from eodatasets3 import wagl
+
+    monkeypatch.setattr(wagl.images, "available_cpu_count", lambda: 12)
+    monkeypatch.setattr(wagl.multiprocessing, "Pool", _InlinePool)
+
+    thread_counts = []
+
+    class RecordingAssembler(wagl.DatasetAssembler):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            thread_counts.append(self._default_num_threads)
+
+    monkeypatch.setattr(wagl, "DatasetAssembler", RecordingAssembler)
+
+    [granule] = wagl.Granule.for_path(
+        WAGL_ESA_SENTINEL_OUTPUT, level1_metadata_path=S2_ESA_L1_METADATA_PATH
+    )
+    [result] = wagl.package_granules(
+        tmp_path,
+        [granule],
+        workers=3,
+        gdal_options=dict(GDAL_PAM_ENABLED=False),
+        oa_resolution=(998.1818181818181, 998.1818181818181),
+        contiguity_resolution=(998.1818181818181, 998.1818181818181),
+        max_workers=2,
+    )
+    assert result.error is None
+    # 12 CPUs, between 3 processes each writing 2 bands at once.
+    assert thread_counts == [2]
+
+
+def test_package_bands_in_parallel(tmp_path: Path):
+    """
+    Writing a granule's bands in a thread pool should give identical output to writing
+    them one at a time.
+    """
+    from eodatasets3 import wagl
+
+    package_folders = []
+    for max_workers in None, 3:
+        out_directory = tmp_path / f"workers-{max_workers}"
+        out_directory.mkdir()
+        [granule] = wagl.Granule.for_path(
+            WAGL_ESA_SENTINEL_OUTPUT, level1_metadata_path=S2_ESA_L1_METADATA_PATH
+        )
+        with rasterio.Env(GDAL_PAM_ENABLED=False):
+            dataset_id, metadata_path = wagl.package(
+                out_directory,
+                granule,
+                oa_resolution=(998.1818181818181, 998.1818181818181),
+                contiguity_resolution=(998.1818181818181, 998.1818181818181),
+                max_workers=max_workers,
+            )
+        package_folders.append(metadata_path.parent)
+
+    serial_folder, parallel_folder = package_folders
+    file_names = sorted(path.name for path in serial_folder.iterdir())
+    assert file_names == sorted(path.name for path in parallel_folder.iterdir())
+    for name in file_names:
+        assert (serial_folder / name).read_bytes() == (
+            parallel_folder / name
+        ).read_bytes(), f"Parallel output differs: {name}"
+
+
+def test_package_referencing_hdf5(tmp_path: Path):
+    """
+    A package referencing the hdf5 bands should have the same footprint and contiguity
+    as one that writes them, without writing the bands themselves.
+    """
+    from eodatasets3 import serialise, wagl
+
+    docs = {}
+    for reference_hdf5 in False, True:
+        out_directory = tmp_path / f"reference-{reference_hdf5}"
+        out_directory.mkdir()
+        [granule] = wagl.Granule.for_path(
+            WAGL_ESA_SENTINEL_OUTPUT, level1_metadata_path=S2_ESA_L1_METADATA_PATH
+        )
+        with rasterio.Env(GDAL_PAM_ENABLED=False):
+            dataset_id, metadata_path = wagl.package(
+                out_directory,
+                granule,
+                oa_resolution=(998.1818181818181, 998.1818181818181),
+                contiguity_resolution=(998.1818181818181, 998.1818181818181),
+                reference_hdf5=reference_hdf5,
+            )
+        docs[reference_hdf5] = (serialise.from_path(metadata_path), metadata_path)
+
+    (written, written_path), (referenced, referenced_path) = docs.values()
+    assert referenced.geometry == written.geometry
+    assert referenced.measurements.keys() == written.measurements.keys()
+    # Its contiguity is still written as GeoTIFF, so it has no single file format.
+    assert written.properties["odc:file_format"] == "GeoTIFF"
+    assert "odc:file_format" not in referenced.properties
+
+    with h5py.File(WAGL_ESA_SENTINEL_OUTPUT, "r") as h5:
+        for name, measurement in referenced.measurements.items():
+            if measurement.layer is None:
+                continue
+            assert measurement.path == WAGL_ESA_SENTINEL_OUTPUT.absolute().as_uri()
+            assert (
+                h5[measurement.layer].shape
+                == written.grids[written.measurements[name].grid].shape
+            ), f"Wrong layer for {name}: {measurement.layer}"
+
+    # Contiguity is still computed and written. (The other images are referenced where they are)
+    assert {name for name, m in referenced.measurements.items() if m.layer is None} == {
+        "oa_nbar_contiguity",
+        "oa_nbart_contiguity",
+        "oa_fmask",
+        "oa_s2cloudless_mask",
+        "oa_s2cloudless_prob",
+    }
+    for product in "nbar", "nbart":
+        contiguity = referenced.measurements[f"oa_{product}_contiguity"].path
+        assert (referenced_path.parent / contiguity).read_bytes() == (
+            written_path.parent / contiguity
+        ).read_bytes()
+    assert not list(referenced_path.parent.glob("*_band*.tif"))
+    assert not list(referenced_path.parent.glob("*thumbnail*"))
+
+    # Without OA, nothing is written, so all of its measurements are hdf5 datasets.
+    out_directory = tmp_path / "reference-no-oa"
+    out_directory.mkdir()
+    with rasterio.Env(GDAL_PAM_ENABLED=False):
+        dataset_id, metadata_path = wagl.package(
+            out_directory, granule, include_oa=False, reference_hdf5=True
+        )
+    bands_only = serialise.from_path(metadata_path)
+    assert all(m.layer is not None for m in bands_only.measurements.values())
+    assert bands_only.properties["odc:file_format"] == "HDF5"
+
+
 @contextmanager
 def expect_no_warnings():
     """Throw an assertion error if any warnings are produced."""
@@ -1,3 +1,5 @@
+import io
+import json
 import shutil
 import tarfile
 from pathlib import Path
@@ -266,6 +268,151 @@ def test_recompress_dirty_dataset(tmp_path: Path):
     ]
 
 
+def test_recompress_in_parallel(tmp_path: Path):
+    """
+    Recompressing members in a pool of threads should give the same tar as doing it serially,
+    even when the in-flight limit is smaller than the members.
+    """
+    outputs = []
+    for threads in "1", "3":
+        output_base = tmp_path / f"threads-{threads}"
+        _run_recompress(
+            packaged_path,
+            "--output-base",
+            str(output_base),
+            "--threads",
+            threads,
+            "--max-in-flight-mb",
+            "1",
+        )
+        [output_tar] = output_base.rglob("*.tar")
+        with tarfile.open(output_tar, "r") as tar:
+            outputs.append(
+                [
+                    (m.name, m.size, m.mode, m.isfile() and tar.extractfile(m).read())
+                    for m in tar.getmembers()
+                ]
+            )
+
+    serial, parallel = outputs
+    assert serial[0][0] == "LT05_L1GS_092091_19910506_20170126_01_T2_MTL.txt"
+    assert parallel == serial
+
+
+def test_recompress_many_paths_in_parallel(tmp_path: Path):
+    """
+    Several paths repackaged with --jobs should each get their output, and one summary log.
+    """
+    input_paths = sorted(packaged_base.rglob("*.tar.gz"))
+    assert len(input_paths) > 1
+    output_base = tmp_path / "out"
+
+    res = _run_recompress(
+        input_paths[0],
+        "--output-base",
+        str(output_base),
+        "--jobs",
+        "2",
+        *(str(p) for p in input_paths[1:]),
+    )
+
+    assert sorted(p.name for p in output_base.rglob("*.tar")) == sorted(
+        p.stem for p in input_paths
+    )
+    [summary] = [
+        json.loads(line) for line in res.stdout.splitlines() if "node.finish" in line
+    ]
+    assert summary["total_count"] == len(input_paths)
+    assert summary["failure_count"] == 0
+    assert summary["in_bytes"] == sum(p.stat().st_size for p in input_paths)
+    assert summary["out_bytes"] == sum(
+        p.stat().st_size for p in output_base.rglob("*.tar")
+    )
+
+
+def test_recompress_failures_dont_stop_other_jobs(tmp_path: Path):
+    """
+    A path that fails should be counted in the summary, without stopping the others.
+    """
+    [input_path, *_] = sorted(packaged_base.rglob("*.tar.gz"))
+    # A dataset folder with no MTL in it.
+    empty_dataset = tmp_path / "in" / unpackaged_offset
+    empty_dataset.mkdir(parents=True)
+    (empty_dataset / "README.txt").write_text("Not a dataset")
+    output_base = tmp_path / "out"
+
+    res = _run_recompress(
+        input_path,
+        "--output-base",
+        str(output_base),
+        "--jobs",
+        "2",
+        str(empty_dataset),
+        expected_return=1,
+    )
+
+    assert [p.name for p in output_base.rglob("*.tar")] == [input_path.stem]
+    [summary] = [
+        json.loads(line) for line in res.stdout.splitlines() if "node.finish" in line
+    ]
+    assert summary["total_count"] == 2
+    assert summary["failure_count"] == 1
+    assert summary["in_bytes"] == input_path.stat().st_size
+
+
+class _UnseekableReader(io.RawIOBase):
+    """A file that can only be read forwards, like a pipe."""
+
+    def __init__(self, path: Path):
+        self._f = path.open("rb")
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        return self._f.readinto(b)
+
+    def close(self):
+        self._f.close()
+        super().close()
+
+
+def test_recompress_streamed_tar(tmp_path: Path):
+    """
+    A tar.gz should be repackaged in a single pass, without seeking back,
+    but still with its MTL first in the output.
+    """
+    output_tar = tmp_path / "out.tar"
+    with _UnseekableReader(packaged_path) as stream, tarfile.open(
+        fileobj=stream, mode="r|gz"
+    ) as in_tar:
+        assert recompress.repackage_tar(
+            packaged_path,
+            recompress._tar_members(in_tar),
+            output_tar,
+            clean_inputs=False,
+            block_size=(32, 32),
+        )
+
+    checksums, members = _get_checksums_members(output_tar)
+    with tarfile.open(packaged_path, "r") as in_tar:
+        input_names = in_tar.getnames()
+    assert input_names[0] != "LT05_L1GS_092091_19910506_20170126_01_T2_MTL.txt"
+
+    assert [m.name for m in members] == [
+        "LT05_L1GS_092091_19910506_20170126_01_T2_MTL.txt",
+        *(name for name in input_names if not name.endswith("_MTL.txt")),
+        "package.sha1",
+    ]
+    with tarfile.open(output_tar, "r") as out_tar:
+        for m in members[:-1]:
+            if m.isfile():
+                assert (
+                    verify.calculate_hash(io.BytesIO(out_tar.extractfile(m).read()))
+                    == checksums[m.name]
+                ), f"Wrong contents for {m.name}"
+
+
 def test_run_with_corrupt_data(tmp_path: Path):
     output_path = tmp_path / "out"
     output_path.mkdir()
@@ -276,8 +423,11 @@ def test_run_with_corrupt_data(tmp_path: Path):
     non_usgs_path = tmp_path / packaged_path.name
     non_usgs_path.symlink_to(packaged_path)
 
-    with pytest.raises(ValueError, match="Expected AODH input path structure"):
-        _run_recompress(non_usgs_path, "--output-base", str(output_path))
+    res = _run_recompress(
+        non_usgs_path, "--output-base", str(output_path), expected_return=1
+    )
+    assert "Expected AODH input path structure" in res.stdout
+    assert not list(output_path.iterdir())
 
 
 def _run_recompress(input_path: Path, *args, expected_return=0):
@@ -1,11 +1,14 @@
 import tempfile
 from pathlib import Path
 
+import numpy as np
 import rasterio
+from rasterio.enums import Resampling
 
+from eodatasets3 import images
 from eodatasets3.images import FileWrite, GridSpec
 
-from . import assert_image
+from . import assert_image, utm_grid
 
 
 def test_thumbnail_bitflag(input_uint8_tif: Path):
@@ -90,3 +93,96 @@ def test_thumbnail_from_numpy_lookuptable(input_uint8_tif_2: Path):
             jpeg_file.write(image_bytes)
 
         assert_image(outfile, bands=3)
+
+
+def test_thumbnail_from_overviews(tmp_path: Path):
+    """Thumbnails from overviews should match those from full-resolution images"""
+    grid = utm_grid((1000, 1100))
+    yy, xx = np.mgrid[0 : grid.shape[0], 0 : grid.shape[1]]
+    rgb = []
+    for i in range(3):
+        band = ((np.sin(yy / (100 * (i + 1))) + np.cos(xx / 120) + 2) * 2000).astype(
+            np.int16
+        )
+        band[:200, :300] = -999
+        path = tmp_path / f"band{i}.tif"
+        FileWrite.from_existing(grid.shape).write_from_ndarray(
+            band,
+            path,
+            geobox=grid,
+            nodata=-999,
+            overview_resampling=Resampling.average,
+        )
+        rgb.append(path)
+
+    thumbnails = {}
+    for from_overviews in (False, True):
+        outfile = tmp_path / f"thumb-{from_overviews}.jpg"
+        FileWrite().create_thumbnail(tuple(rgb), outfile, from_overviews=from_overviews)
+        assert_image(outfile, bands=3)
+        with rasterio.open(outfile) as ds:
+            thumbnails[from_overviews] = ds.read().astype(int)
+
+    full_res, from_overviews = thumbnails.values()
+    assert full_res.shape == from_overviews.shape
+    assert np.abs(full_res - from_overviews).mean() < 5
+
+
+def test_quicklook_image_cache(input_uint8_tif: Path, input_uint8_tif_2: Path):
+    """Images that fit in the cache should only be read once"""
+    paths = (input_uint8_tif, input_uint8_tif_2, input_uint8_tif)
+
+    cache = images._ImageCache(paths, max_bytes=1024**3)
+    first = [image for image, nodata in cache.read()]
+    second = [image for image, nodata in cache.reread()]
+    # The same path is only decoded once.
+    assert first[0] is first[2]
+    assert all(a is b for a, b in zip(first, second))
+
+    # Nothing fits, so they're read again.
+    cache = images._ImageCache(paths, max_bytes=0)
+    first = [image for image, nodata in cache.read()]
+    second = [image for image, nodata in cache.reread()]
+    assert not any(a is b for a, b in zip(first, second))
+    assert all(np.array_equal(a, b) for a, b in zip(first, second))
+
+
+def test_thumbnail_singleband_colours(tmp_path: Path, monkeypatch):
+    """
+    A single-band thumbnail of a file should have the lookup table's colour for each
+    class, and be made in-memory: only the thumbnail is written.
+    """
+    # Intermediate files used to go to the system temp directory, so watch it too.
+    temp_dir = tmp_path / "temp"
+    temp_dir.mkdir()
+    monkeypatch.setattr(tempfile, "tempdir", str(temp_dir))
+
+    grid = utm_grid((400, 400))
+    # Dry on the left, water on the right.
+    band = np.zeros(grid.shape, dtype=np.uint8)
+    band[:, 200:] = 128
+    in_path = tmp_path / "input" / "wofs.tif"
+    in_path.parent.mkdir()
+    FileWrite.from_existing(grid.shape).write_from_ndarray(
+        band, in_path, geobox=grid, nodata=255
+    )
+
+    out_dir = tmp_path / "output"
+    out_dir.mkdir()
+    outfile = out_dir / "wofs.jpg"
+    FileWrite().create_thumbnail_singleband(
+        in_path, outfile, lookup_table={0: [150, 150, 110], 128: [79, 129, 189]}
+    )
+    assert [p.name for p in out_dir.iterdir()] == ["wofs.jpg"]
+    assert not list(temp_dir.iterdir())
+
+    with rasterio.open(outfile) as ds:
+        thumbnail = ds.read().astype(int)
+    _, height, width = thumbnail.shape
+    rows = slice(height // 4, height * 3 // 4)
+    left = thumbnail[:, rows, width // 8 : width * 3 // 8]
+    right = thumbnail[:, rows, width * 5 // 8 : width * 7 // 8]
+
+    # Each colour is rescaled from 0-255 to 1-255, then jpeg-compressed.
+    assert np.abs(left.mean(axis=(1, 2)) - [150, 150, 110]).max() < 4
+    assert np.abs(right.mean(axis=(1, 2)) - [79, 129, 189]).max() < 4
@@ -1,9 +1,25 @@
 from pathlib import Path
 from uuid import UUID
 
+import numpy
 import pytest
+import rasterio
+from affine import Affine
+from rasterio.crs import CRS
+from rasterio.enums import Resampling
 
-from eodatasets3.wagl import _load_level1_doc
+from eodatasets3 import DatasetAssembler, serialise
+from eodatasets3.model import AccessoryDoc, DatasetDoc
+from eodatasets3.wagl import (
+    ContiguityMasks,
+    Granule,
+    QualityMaskCache,
+    _load_level1_doc,
+    _read_bands,
+    load_quality_mask,
+    mask_h5_raster,
+    write_measurement_h5,
+)
 
 # data/LC08_L1TP_090084_20160121_20200907_02_T1/LC08_L1TP_090084_20160121_20200907_02_T1.odc-metadata.yaml
 
@@ -48,3 +64,331 @@ def test_get_level1_metadata_no_source():
     # .... unless we allow missing provenance.
     doc = _load_level1_doc(Path("/no/where/good"), allow_missing_provenance=True)
     assert doc is None
+
+
+def _write_quality_mask(path: Path, mask: numpy.ndarray):
+    count, height, width = mask.shape
+    with rasterio.open(
+        path,
+        "w",
+        driver="GTiff",
+        count=count,
+        height=height,
+        width=width,
+        dtype="uint8",
+    ) as ds:
+        ds.write(mask)
+
+
+def test_write_masked_measurement_h5(tmp_path: Path):
+    """
+    A band should be streamed from its hdf5 chunks, with the quality mask applied to each.
+    """
+    h5py = pytest.importorskip("h5py")
+    crs = CRS.from_epsg(32656)
+    transform = Affine(10.0, 0.0, 600000.0, 0.0, -10.0, 7000000.0)
+    band = (numpy.arange(300 * 400).reshape((300, 400)) % 4000).astype("int16")
+
+    # A Sentinel-2 quality mask, with lost (layer 3) and degraded (layer 4) packets.
+    mask_path = tmp_path / "MSK_QUALIT.tif"
+    mask = numpy.zeros((8, 300, 400), dtype="uint8")
+    mask[2, 100:120, :] = 1
+    mask[3, :, 203:250] = 1
+    _write_quality_mask(mask_path, mask)
+
+    with h5py.File(tmp_path / "wagl.h5", "w") as f:
+        dataset = f.create_dataset("blue", data=band, chunks=(64, 64))
+        dataset.attrs.update(
+            band_id="2",
+            no_data_value=-999,
+            geotransform=transform.to_gdal(),
+            crs_wkt=crs.to_wkt(),
+        )
+
+    with DatasetAssembler(tmp_path) as p, h5py.File(tmp_path / "wagl.h5", "r") as f:
+        p.product_name = "masked"
+        p.datetime = "2020-10-31"
+        p.processed_now()
+        write_measurement_h5(
+            p,
+            "nbar:blue",
+            f["blue"],
+            band_masks={"1": ("MSK_QUALIT", str(mask_path))},
+        )
+        dataset_id, metadata_path = p.done()
+
+    [written_path] = metadata_path.parent.rglob("*_blue.tif")
+    with rasterio.open(written_path) as ds:
+        written = ds.read(1)
+
+    expected = numpy.where((mask[2] | mask[3]) == 0, band, -999)
+    assert numpy.array_equal(written, expected)
+
+
+def test_quality_mask_must_match_band(tmp_path: Path):
+    """
+    A raster quality mask of a different shape to its band can't be applied.
+    """
+    h5py = pytest.importorskip("h5py")
+    mask_path = tmp_path / "MSK_QUALIT.tif"
+    _write_quality_mask(mask_path, numpy.zeros((8, 30, 40), dtype="uint8"))
+
+    with h5py.File(tmp_path / "wagl.h5", "w") as f:
+        dataset = f.create_dataset("blue", data=numpy.ones((60, 80), "int16"))
+        dataset.attrs.update(band_id="2", no_data_value=-999)
+
+        with pytest.raises(ValueError, match=r"has shape \(30, 40\)"):
+            load_quality_mask(dataset, {"1": ("MSK_QUALIT", str(mask_path))})
+
+
+def test_quality_mask_needs_nodata(tmp_path: Path):
+    """
+    A band without a nodata value has nothing to set its masked pixels to.
+    """
+    h5py = pytest.importorskip("h5py")
+    mask_path = tmp_path / "MSK_QUALIT.tif"
+    mask = numpy.zeros((8, 30, 40), dtype="uint8")
+    mask[2, 10:20, :] = 1
+    _write_quality_mask(mask_path, mask)
+
+    with h5py.File(tmp_path / "wagl.h5", "w") as f:
+        dataset = f.create_dataset("blue", data=numpy.ones((30, 40), "int16"))
+        dataset.attrs.update(
+            band_id="2",
+            geotransform=Affine(10.0, 0.0, 600000.0, 0.0, -10.0, 7000000.0).to_gdal(),
+            crs_wkt=CRS.from_epsg(32656).to_wkt(),
+        )
+
+        with DatasetAssembler(tmp_path) as p:
+            with pytest.raises(ValueError, match="has no nodata value"):
+                write_measurement_h5(
+                    p,
+                    "nbar:blue",
+                    dataset,
+                    band_masks={"1": ("MSK_QUALIT", str(mask_path))},
+                )
+
+
+def test_deprecated_mask_h5_raster(tmp_path: Path):
+    """
+    The old whole-band masking function should still work, with a warning.
+    """
+    h5py = pytest.importorskip("h5py")
+    mask_path = tmp_path / "MSK_QUALIT.tif"
+    mask = numpy.zeros((8, 3, 4), dtype="uint8")
+    mask[2, 0, 1] = 1
+    mask[3, 2, 3] = 1
+    _write_quality_mask(mask_path, mask)
+
+    with h5py.File(tmp_path / "wagl.h5", "w") as f:
+        dataset = f.create_dataset(
+            "blue", data=numpy.arange(12, dtype="int16").reshape((3, 4))
+        )
+        dataset.attrs.update(band_id="2", no_data_value=-999)
+
+        with pytest.warns(DeprecationWarning, match="load_quality_mask"):
+            masked = mask_h5_raster(dataset, mask_path)
+
+    assert masked.tolist() == [
+        [0, -999, 2, 3],
+        [4, 5, 6, 7],
+        [8, 9, 10, -999],
+    ]
+
+
+def test_masked_band_is_written_when_referencing_hdf5(tmp_path: Path):
+    """
+    A band with masked pixels can't be referenced in the hdf5, which doesn't have them
+    masked, so it should be written as a masked COG instead.
+    """
+    h5py = pytest.importorskip("h5py")
+    crs = CRS.from_epsg(32656)
+    transform = Affine(10.0, 0.0, 600000.0, 0.0, -10.0, 7000000.0)
+    mask_path = tmp_path / "MSK_QUALIT.tif"
+    mask = numpy.zeros((8, 30, 40), dtype="uint8")
+    mask[2, 10:12, :] = 1
+    _write_quality_mask(mask_path, mask)
+
+    with h5py.File(tmp_path / "wagl.h5", "w") as f:
+        for name in "blue", "green":
+            dataset = f.create_dataset(name, data=numpy.ones((30, 40), "int16"))
+            dataset.attrs.update(
+                no_data_value=-999,
+                geotransform=transform.to_gdal(),
+                crs_wkt=crs.to_wkt(),
+            )
+        f["blue"].attrs["band_id"] = "2"
+        # Its mask is empty.
+        f["green"].attrs["band_id"] = "3"
+        mask[2] = 0
+        _write_quality_mask(tmp_path / "MSK_QUALIT_B03.tif", mask)
+
+    band_masks = {
+        "1": ("MSK_QUALIT", str(mask_path)),
+        "2": ("MSK_QUALIT", str(tmp_path / "MSK_QUALIT_B03.tif")),
+    }
+    with DatasetAssembler(tmp_path, allow_absolute_paths=True) as p, h5py.File(
+        tmp_path / "wagl.h5", "r"
+    ) as f:
+        p.product_name = "referenced"
+        p.datetime = "2020-10-31"
+        p.processed_now()
+        for name in "blue", "green":
+            write_measurement_h5(
+                p, f"nbar:{name}", f[name], band_masks=band_masks, reference_hdf5=True
+            )
+        dataset_id, metadata_path = p.done()
+
+    doc = serialise.from_path(metadata_path)
+    assert doc.measurements["nbar_green"].layer == "/green"
+    assert doc.measurements["nbar_blue"].layer is None
+
+    [written_path] = metadata_path.parent.rglob("*_blue.tif")
+    with rasterio.open(written_path) as ds:
+        written = ds.read(1)
+    assert (written[10:12] == -999).all()
+    assert (written[:10] == 1).all() and (written[12:] == 1).all()
+
+
+def test_contiguity_masks_match_written_bands(tmp_path: Path):
+    """
+    Contiguity accumulated while writing should match reading the written bands back.
+    """
+    h5py = pytest.importorskip("h5py")
+    crs = CRS.from_epsg(32656)
+    rng = numpy.random.default_rng(2)
+
+    with h5py.File(tmp_path / "wagl.h5", "w") as f:
+        # Chunks that aren't aligned to bytes of the packed masks.
+        for name, resolution, chunks in (
+            ("blue", 10, (37, 53)),
+            ("swir", 20, (16, 13)),
+        ):
+            data = rng.integers(-5, 100, size=(1200 // resolution,) * 2).astype("int16")
+            dataset = f.create_dataset(name, data=data, chunks=chunks)
+            dataset.attrs.update(
+                no_data_value=-999,
+                geotransform=(600000.0, resolution, 0.0, 7000000.0, 0.0, -resolution),
+                crs_wkt=crs.to_wkt(),
+            )
+
+    contiguity_masks = ContiguityMasks()
+    with DatasetAssembler(tmp_path) as p, h5py.File(tmp_path / "wagl.h5", "r") as f:
+        p.product_name = "contiguous"
+        p.datetime = "2020-10-31"
+        p.processed_now()
+        for name in ("blue", "swir"):
+            write_measurement_h5(
+                p, f"nbar:{name}", f[name], contiguity_masks=contiguity_masks
+            )
+        dataset_id, metadata_path = p.done()
+
+    blue_grid, swir_grid = contiguity_masks.grids("nbar")
+    assert blue_grid.resolution_yx == (10.0, 10.0)
+    for grid, name in ((blue_grid, "blue"), (swir_grid, "swir")):
+        [written_path] = metadata_path.parent.rglob(f"*_{name}.tif")
+        with rasterio.open(written_path) as ds:
+            expected = (
+                ds.read(1, out_shape=blue_grid.shape, resampling=Resampling.nearest) > 0
+            )
+        assert numpy.array_equal(
+            contiguity_masks.read("nbar", grid, out_shape=blue_grid.shape), expected
+        )
+
+
+def test_prefetched_bands_match_lazy_reads(tmp_path: Path):
+    """
+    Bands read ahead into reused buffers should give the same tiles as lazy reads.
+    """
+    h5py = pytest.importorskip("h5py")
+    rng = numpy.random.default_rng(3)
+
+    with h5py.File(tmp_path / "wagl.h5", "w") as f:
+        f.create_dataset("a", data=rng.integers(-999, 4000, (300, 400), dtype="int16"))
+        f.create_dataset(
+            "b", data=rng.random((200, 100), dtype="float32"), chunks=(7, 100)
+        )
+        f.create_dataset(
+            "c", data=rng.integers(0, 255, (50, 60), dtype="uint8"), chunks=(16, 16)
+        )
+
+    def read_all(prefetch_depth: int):
+        # Copy each tile, as prefetch buffers are reused.
+        return [
+            (name, dataset.name, [(window, block.copy()) for window, block in tiles])
+            for name, dataset, quality_mask, tiles in _read_bands(
+                {name: f[name] for name in ("a", "b", "c")},
+                prefetch_depth=prefetch_depth,
+            )
+        ]
+
+    with h5py.File(tmp_path / "wagl.h5", "r") as f:
+        expected = read_all(prefetch_depth=0)
+        for prefetch_depth in (1, 2):
+            bands = read_all(prefetch_depth)
+            assert [b[:2] for b in bands] == [b[:2] for b in expected]
+            for (*_, tiles), (*_, expected_tiles) in zip(bands, expected):
+                assert [w for w, _ in tiles] == [w for w, _ in expected_tiles]
+                for (_, block), (_, expected_block) in zip(tiles, expected_tiles):
+                    assert block.dtype == expected_block.dtype
+                    assert numpy.array_equal(block, expected_block)
+
+        # Stopping part-way through shouldn't leave the reader waiting forever.
+        bands = _read_bands({name: f[name] for name in ("a", "b", "c")})
+        name, dataset, quality_mask, tiles = next(bands)
+        next(iter(tiles))
+        bands.close()
+
+        # Asking for the next band before reading the last one's tiles is an error,
+        # rather than returning the wrong tiles.
+        bands = _read_bands({name: f[name] for name in ("b", "c")})
+        next(bands)
+        with pytest.raises(RuntimeError, match="Expected band 'c'"):
+            next(bands)
+
+
+def test_quality_mask_cache(tmp_path: Path):
+    """
+    Each band's quality mask should only be loaded once, and shared between products.
+    """
+    h5py = pytest.importorskip("h5py")
+
+    # A Sinergise-style level 1 directory, with a raster mask for band 2 ("1" in ESA numbering)
+    level1_path = tmp_path / "level1"
+    level1_path.mkdir()
+    (level1_path / "metadata.xml").write_text(
+        "<Level-1C_Tile_ID><Quality_Indicators_Info><Pixel_Level_QI>"
+        '<MASK_FILENAME bandId="1" type="MSK_QUALIT">MSK_QUALIT_B02.tif</MASK_FILENAME>'
+        "</Pixel_Level_QI></Quality_Indicators_Info></Level-1C_Tile_ID>"
+    )
+    mask = numpy.zeros((8, 30, 40), dtype="uint8")
+    mask[2, 10:12, :] = 1
+    _write_quality_mask(level1_path / "MSK_QUALIT_B02.tif", mask)
+
+    granule = Granule(
+        name="granule",
+        wagl_hdf5=tmp_path / "wagl.h5",
+        wagl_metadata={"source_datasets": {"platform_id": "SENTINEL_2A"}},
+        source_level1_metadata=DatasetDoc(
+            accessories={"metadata:s2_tile": AccessoryDoc("metadata.xml")}
+        ),
+        source_level1_data=level1_path,
+    )
+    with h5py.File(granule.wagl_hdf5, "w") as f:
+        for product in ("NBAR", "NBART"):
+            dataset = f.create_dataset(product, data=numpy.ones((30, 40), "int16"))
+            dataset.attrs.update(band_id="2", geotransform=(0, 10, 0, 0, 0, -10))
+
+        cache = QualityMaskCache(granule)
+        nbar_mask = cache.load(f["NBAR"])
+        assert cache.load(f["NBART"]) is nbar_mask
+
+        expected_mask = numpy.zeros((30, 40), dtype=bool)
+        expected_mask[10:12, :] = True
+        assert numpy.array_equal(
+            numpy.unpackbits(nbar_mask, axis=1).view(bool), expected_mask
+        )
+
+        # Masks beyond the memory limit are loaded again each time.
+        cache = QualityMaskCache(granule, max_bytes=0)
+        assert cache.load(f["NBART"]) is not cache.load(f["NBAR"])